@@ -0,0 +1,83 @@
+"""
+Compare card issuer detection with the prefix index against the regex loop, and
+time lookups in a BIN database of 300,000 ranges.
+
+Run from the repository root::
+
+    python benchmarks/card_issuer.py
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import tempfile
+import timeit
+from functools import partial
+from typing import TYPE_CHECKING
+
+import django
+from django.conf import settings
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+BIN_DATABASE = os.path.join(tempfile.mkdtemp(), "bins.db")
+
+settings.configure(
+    PAYMENT_HOST="example.com",
+    PAYMENT_BIN_DATABASE=BIN_DATABASE,
+    INSTALLED_APPS=["payments"],
+)
+django.setup()
+
+from payments.cards import write_bin_database  # noqa: E402
+from payments.core import CARD_TYPES  # noqa: E402
+from payments.core import get_card_info  # noqa: E402
+from payments.core import get_credit_card_issuer  # noqa: E402
+
+NUMBERS = [
+    "4111111111111111",
+    "5555555555554444",
+    "2223003122003222",
+    "6011111111111117",
+    "378282246310005",
+    "3530111333300000",
+    "30569309025904",
+    "6304000000000000",
+    "9999999999999999",
+]
+
+
+def regex_loop(number: str) -> tuple[str | None, str | None]:
+    for regexp, card_type, name in CARD_TYPES:
+        if re.match(regexp, number):
+            return card_type, name
+    return None, None
+
+
+def lookup_all(func: Callable[[str], object]) -> None:
+    for card in NUMBERS:
+        func(card)
+
+
+def main(repeat: int = 5, number: int = 20000) -> None:
+    write_bin_database(
+        BIN_DATABASE,
+        (
+            (f"{iin:08d}", f"{iin + 99:08d}", "US", "credit", "classic", "")
+            for iin in range(20_000_000, 80_000_000, 200)
+        ),
+    )
+    for func in (regex_loop, get_credit_card_issuer, get_card_info):
+        timings = timeit.repeat(
+            partial(lookup_all, func),
+            repeat=repeat,
+            number=number,
+        )
+        per_call = min(timings) / (number * len(NUMBERS)) * 1e6
+        print(f"{func.__name__:>24}: {per_call:.3f} µs per lookup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compare the Sage Pay ``Crypt`` codec against building a cipher per call.
+
+Run from the repository root::
+
+    python benchmarks/sagepay_crypt.py
+"""
+
+from __future__ import annotations
+
+import binascii
+import timeit
+
+import django
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher
+from cryptography.hazmat.primitives.ciphers import algorithms
+from cryptography.hazmat.primitives.ciphers import modes
+from django.conf import settings
+
+settings.configure(PAYMENT_HOST="example.com", INSTALLED_APPS=["payments"])
+django.setup()
+
+from payments.sagepay import SagepayCrypt  # noqa: E402
+
+KEY = b"1234abdd1234abcd"
+FIELDS = {
+    "VendorTxCode": "1234",
+    "Amount": "100.00",
+    "Currency": "GBP",
+    "Description": "Payment #1234",
+    "SuccessURL": "https://example.com/payments/process/1234/",
+    "FailureURL": "https://example.com/payments/process/1234/",
+    "BillingSurname": "Doe",
+    "BillingFirstnames": "John",
+    "BillingAddress1": "1 Example Street",
+    "BillingCity": "London",
+    "BillingPostCode": "N1 1AA",
+    "BillingCountry": "GB",
+}
+
+
+def get_cipher():
+    return Cipher(algorithms.AES(KEY), modes.CBC(KEY), backend=default_backend())
+
+
+def per_call_encode(fields: dict) -> bytes:
+    data = "&".join("{}={}".format(*kv) for kv in fields.items()).encode("utf-8")
+    padder = padding.PKCS7(128).padder()
+    data = padder.update(data) + padder.finalize()
+    encryptor = get_cipher().encryptor()
+    return b"@" + binascii.hexlify(encryptor.update(data) + encryptor.finalize())
+
+
+def per_call_decode(crypt: bytes) -> dict:
+    data = binascii.unhexlify(crypt.lstrip(b"@"))
+    decryptor = get_cipher().decryptor()
+    data = decryptor.update(data) + decryptor.finalize()
+    unpadder = padding.PKCS7(128).unpadder()
+    text = (unpadder.update(data) + unpadder.finalize()).decode("utf-8")
+    return dict(pair.split("=", 1) for pair in text.split("&"))
+
+
+def main(repeat: int = 5, number: int = 20000) -> None:
+    codec = SagepayCrypt(KEY)
+    crypt = codec.encode(FIELDS)
+    assert per_call_encode(FIELDS) == crypt
+    assert per_call_decode(crypt) == codec.decode(crypt) == FIELDS
+    cases = {
+        "per-call encode": lambda: per_call_encode(FIELDS),
+        "SagepayCrypt.encode": lambda: codec.encode(FIELDS),
+        "per-call decode": lambda: per_call_decode(crypt),
+        "SagepayCrypt.decode": lambda: codec.decode(crypt),
+    }
+    for name, func in cases.items():
+        per_call = min(timeit.repeat(func, repeat=repeat, number=number)) / number
+        print(f"{name:>20}: {per_call * 1e6:.2f} µs per call")
+
+
+if __name__ == "__main__":
+    main()
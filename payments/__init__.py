@@ -3,7 +3,7 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 from typing import NamedTuple
 
-from django.apps import apps
+from django.apps import apps as django_apps
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import pgettext_lazy
@@ -93,7 +93,7 @@ def get_payment_model():
         raise ImproperlyConfigured(
             'PAYMENT_MODEL must be of the form "app_label.model_name"'
         ) from e
-    payment_model = apps.get_model(app_label, model_name)
+    payment_model = django_apps.get_model(app_label, model_name)
     if payment_model is None:
         msg = (
             f'PAYMENT_MODEL refers to model "{settings.PAYMENT_MODEL}"'
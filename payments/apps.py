@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import logging
+
+from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentsConfig(AppConfig):
+    name = "payments"
+
+    def ready(self) -> None:
+        from .cards import get_card_issuer_index
+        from .core import provider_registry
+
+        # Compile the card issuer tables before the first card is validated.
+        get_card_issuer_index()
+        preload = getattr(settings, "PAYMENT_PRELOAD_VARIANTS", ())
+        if not preload:
+            return
+        # ``True`` means every variant in PAYMENT_VARIANTS.
+        timings = provider_registry.warm_up(None if preload is True else preload)
+        for variant, elapsed in timings.items():
+            logger.info("Preloaded payment variant %r in %.3fs", variant, elapsed)
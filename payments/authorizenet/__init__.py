@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import requests
 from django.core.exceptions import ImproperlyConfigured
 from django.http import HttpResponseForbidden
 
@@ -76,7 +75,7 @@ class AuthorizeNetProvider(BasicProvider):
 
     def get_payment_response(self, payment, extra_data=None):
         post = self.get_product_data(payment, extra_data)
-        return requests.post(self.endpoint, data=post)
+        return self.http_session.post(self.endpoint, data=post)
 
     def get_form(self, payment, data=None):
         if payment.status == PaymentStatus.WAITING:
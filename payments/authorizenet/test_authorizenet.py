@@ -69,7 +69,7 @@ def test_provider_redirects_to_success_on_payment_success(payment: Payment) -> N
         "1234",
     ]
 
-    with patch("requests.post") as mocked_post:
+    with patch("requests.Session.post") as mocked_post:
         post = MagicMock()
         post.text = "|".join(response_data)
         mocked_post.return_value = post
@@ -88,7 +88,7 @@ def test_provider_shows_validation_error_message(payment: Payment) -> None:
     error_msg = "The merchant does not accept this type of credit card."
     response_data = [ERROR_PROCESSING, "", "", error_msg, "", "", "1234"]
 
-    with patch("requests.post") as mocked_post:
+    with patch("requests.Session.post") as mocked_post:
         post = MagicMock()
         post.text = "|".join(response_data)
         mocked_post.return_value = post
@@ -108,7 +108,7 @@ def test_provider_shows_rejection_error_message(payment: Payment) -> None:
     error_msg = " This transaction has been declined."
     response_data = [STATUS_DECLINED, "", "", error_msg, "", "", "1234"]
 
-    with patch("requests.post") as mocked_post:
+    with patch("requests.Session.post") as mocked_post:
         post = MagicMock()
         post.text = "|".join(response_data)
         mocked_post.return_value = post
@@ -1,6 +1,10 @@
 from __future__ import annotations
 
+from functools import cached_property
+
 import braintree
+import requests
+from braintree.util.http import Http
 from django.core.exceptions import ImproperlyConfigured
 
 from payments import PaymentStatus
@@ -10,6 +14,36 @@ from payments.core import BasicProvider
 from .forms import BraintreePaymentForm
 
 
+class _SessionHttp(Http):
+    """Braintree's HTTP strategy, sending requests through a shared session."""
+
+    def __init__(self, config, environment, session: requests.Session) -> None:
+        super().__init__(config, environment)
+        self.session = session
+
+    def http_do(self, http_verb, path, headers, request_body):
+        data, files = request_body, None
+        if isinstance(request_body, tuple):
+            data, files = request_body
+        if self.config.environment == braintree.Environment.Development:
+            verify = False
+        else:
+            verify = self.environment.ssl_certificate
+        request = requests.Request(
+            method=http_verb, url=path, headers=headers, data=data, files=files
+        ).prepare()
+        # Like the SDK, keep the URL exactly as Braintree built it.
+        request.url = path
+        settings = self.session.merge_environment_settings(path, {}, None, verify, None)
+        # The session applies the timeouts from PAYMENT_HTTP_OPTIONS.
+        response = self.session.send(request, timeout=None, **settings)
+        return [response.status_code, response.text]
+
+    def close(self) -> None:
+        # The session belongs to the provider.
+        pass
+
+
 class BraintreeProvider(BasicProvider):
     """Payment provider for Braintree.
 
@@ -17,6 +51,9 @@ class BraintreeProvider(BasicProvider):
 
     This backend does not support fraud detection.
 
+    Each provider has its own :attr:`gateway`, so several variants may use
+    different merchant accounts in the same process.
+
     :param merchant_id: Merchant ID assigned by Braintree
     :param public_key: Public key assigned by Braintree
     :param private_key: Private key assigned by Braintree
@@ -35,19 +72,30 @@ class BraintreeProvider(BasicProvider):
         self.public_key = public_key
         self.private_key = private_key
 
-        environment = braintree.Environment.Sandbox
+        self.environment = braintree.Environment.Sandbox
         if not sandbox:
-            environment = braintree.Environment.Production
+            self.environment = braintree.Environment.Production
+        super().__init__(**kwargs)
+        if not self._capture:
+            raise ImproperlyConfigured("Braintree does not support pre-authorization.")
+
+    @cached_property
+    def gateway(self) -> braintree.BraintreeGateway:
+        """The gateway of this provider's merchant account.
 
-        braintree.Configuration.configure(
-            environment,
+        Its requests are sent through :attr:`http_session`.
+        """
+        session = self.http_session
+        config = braintree.Configuration(
+            self.environment,
             merchant_id=self.merchant_id,
             public_key=self.public_key,
             private_key=self.private_key,
+            http_strategy=lambda config, environment: _SessionHttp(
+                config, environment, session
+            ),
         )
-        super().__init__(**kwargs)
-        if not self._capture:
-            raise ImproperlyConfigured("Braintree does not support pre-authorization.")
+        return braintree.BraintreeGateway(config)
 
     def get_form(self, payment, data=None):
         if payment.status == PaymentStatus.WAITING:
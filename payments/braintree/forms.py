@@ -1,7 +1,5 @@
 from __future__ import annotations
 
-import braintree
-
 from payments import PaymentStatus
 from payments.forms import CreditCardPaymentFormWithName
 
@@ -13,7 +11,7 @@ class BraintreePaymentForm(CreditCardPaymentFormWithName):
         data = self.cleaned_data
 
         if not self.errors and not self.payment.transaction_id:
-            result = braintree.Transaction.sale(
+            result = self.provider.gateway.transaction.sale(
                 {
                     "amount": str(self.payment.total),
                     "billing": self.get_billing_data(),
@@ -62,7 +60,7 @@ class BraintreePaymentForm(CreditCardPaymentFormWithName):
         }
 
     def save(self) -> None:
-        braintree.Transaction.submit_for_settlement(self.transaction_id)
+        self.provider.gateway.transaction.submit_for_settlement(self.transaction_id)
         self.payment.transaction_id = self.transaction_id
         self.payment.captured_amount = self.payment.total
         self.payment.change_status(PaymentStatus.CONFIRMED)
@@ -5,6 +5,7 @@ from unittest.mock import MagicMock
 from unittest.mock import Mock
 from unittest.mock import patch
 
+import braintree
 import pytest
 
 from payments import PaymentStatus
@@ -55,18 +56,16 @@ def payment() -> Payment:
 def test_provider_redirects_to_success_on_payment_success(payment: Payment) -> None:
     provider = BraintreeProvider(MERCHANT_ID, PUBLIC_KEY, PRIVATE_KEY)
     transaction_id = "12345"
-    with (
-        patch("braintree.Transaction"),
-        patch("braintree.Transaction.sale") as mocked_sale,
-    ):
+    with patch.object(provider.gateway, "transaction") as mocked_transaction:
         sale = MagicMock()
         sale.is_success = True
         sale.transaction.id = transaction_id
-        mocked_sale.return_value = sale
+        mocked_transaction.sale.return_value = sale
         with pytest.raises(RedirectNeeded) as exc:
             provider.get_form(payment, data=PROCESS_DATA)
         url = exc.value.args[0]
         assert url == payment.get_success_url()
+    mocked_transaction.submit_for_settlement.assert_called_once_with(transaction_id)
     assert payment.status == PaymentStatus.CONFIRMED
     assert payment.captured_amount == payment.total
     assert payment.transaction_id == transaction_id
@@ -75,15 +74,35 @@ def test_provider_redirects_to_success_on_payment_success(payment: Payment) -> N
 def test_provider_shows_validation_error_message(payment: Payment) -> None:
     provider = BraintreeProvider(MERCHANT_ID, PUBLIC_KEY, PRIVATE_KEY)
     error_msg = "error message"
-    with (
-        patch("braintree.Transaction"),
-        patch("braintree.Transaction.sale") as mocked_sale,
-    ):
+    with patch.object(provider.gateway, "transaction") as mocked_transaction:
         sale = MagicMock()
         sale.is_success = False
         sale.message = error_msg
-        mocked_sale.return_value = sale
+        mocked_transaction.sale.return_value = sale
         form = provider.get_form(payment, data=PROCESS_DATA)
         assert form.errors["__all__"][0] == error_msg
     assert payment.status == PaymentStatus.ERROR
     assert payment.captured_amount == 0
+
+
+def test_providers_have_independent_gateways() -> None:
+    first = BraintreeProvider(MERCHANT_ID, PUBLIC_KEY, PRIVATE_KEY)
+    second = BraintreeProvider("test22", "efgh5678", "5678efgh", sandbox=False)
+    assert first.gateway is first.gateway
+    assert first.gateway.config.merchant_id == MERCHANT_ID
+    assert first.gateway.config.environment == braintree.Environment.Sandbox
+    assert second.gateway.config.merchant_id == "test22"
+    assert second.gateway.config.environment == braintree.Environment.Production
+
+
+def test_gateway_uses_http_session() -> None:
+    provider = BraintreeProvider(MERCHANT_ID, PUBLIC_KEY, PRIVATE_KEY)
+    config = provider.gateway.config
+    response = MagicMock(status_code=200, text="<ping><status>ok</status></ping>")
+    with patch.object(provider.http_session, "send", return_value=response) as send:
+        result = config.http().get(config.base_merchant_path() + "/ping")
+    assert result == {"ping": {"status": "ok"}}
+    request = send.call_args.args[0]
+    assert request.url == f"{config.base_url()}/merchants/{MERCHANT_ID}/ping"
+    assert request.headers["Authorization"].startswith(b"Basic ")
+    assert send.call_args.kwargs["timeout"] is None
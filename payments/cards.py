@@ -0,0 +1,425 @@
+"""
+Detection of card issuers from the leading digits (IIN) of card numbers.
+
+Issuers are described by tables of ``(prefixes, lengths, card_type, name)``
+entries, where each prefix is either a string of digits (``"34"``) or an
+inclusive range of prefixes of the same length (``"2221-2720"``). The tables
+are compiled into a trie of digits, so a number is matched in a single pass
+over its first few digits.
+
+More details about a card (its country, funding and level) can be read from an
+optional BIN database: a file of sorted IIN ranges that is memory-mapped and
+searched with :mod:`bisect`, so that processes share its pages instead of each
+loading a copy.
+"""
+
+from __future__ import annotations
+
+import bisect
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from itertools import pairwise
+from typing import TYPE_CHECKING
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from collections.abc import Sequence
+
+    CardIssuerEntry = tuple[Sequence[str], Iterable[int], str, str]
+
+#: The built-in issuers, matching the numbers described by
+#: :data:`payments.core.CARD_TYPES`.
+CARD_ISSUERS: list[CardIssuerEntry] = [
+    (["4"], (13, 16, 17, 18, 19), "visa", "VISA"),
+    (["51-55", "2221-2720"], (16,), "mastercard", "MasterCard"),
+    (["6011", "65"], range(16, 20), "discover", "Discover"),
+    (["34", "37"], (15,), "amex", "American Express"),
+    (["2131", "1800"], (15,), "jcb", "JCB"),
+    (["35"], (16,), "jcb", "JCB"),
+    (["300-305", "36", "38"], (14,), "diners", "Diners Club"),
+    (["50", "56-58", "6304", "6390", "67"], range(12, 20), "maestro", "Maestro"),
+]
+
+
+class _Node:
+    __slots__ = ("children", "entries")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _Node] = {}
+        self.entries: list[tuple[int, frozenset[int], str, str]] = []
+
+
+class CardIssuerIndex:
+    """A trie of IIN prefixes that maps card numbers to their issuer.
+
+    When several entries match a number, the one that was added first wins,
+    regardless of how specific its prefix is.
+
+    :param table: Entries of ``(prefixes, lengths, card_type, name)`` to add.
+    """
+
+    def __init__(self, table: Iterable[CardIssuerEntry] = ()) -> None:
+        self._root = _Node()
+        self._depth = 0
+        self._count = 0
+        self.names: dict[str, str] = {}
+        for prefixes, lengths, card_type, name in table:
+            self.add(prefixes, lengths, card_type, name)
+
+    def add(
+        self,
+        prefixes: Iterable[str],
+        lengths: Iterable[int],
+        card_type: str,
+        name: str,
+    ) -> None:
+        """Add an issuer whose numbers start with any of ``prefixes``.
+
+        :raises ValueError: if a prefix is not a string of digits or a range of
+            them.
+        """
+        entry = (self._count, frozenset(lengths), card_type, name)
+        self._count += 1
+        self.names.setdefault(card_type, name)
+        for prefix_range in prefixes:
+            for prefix in _expand_range(prefix_range):
+                node = self._root
+                for digit in prefix:
+                    node = node.children.setdefault(digit, _Node())
+                node.entries.append(entry)
+                self._depth = max(self._depth, len(prefix))
+
+    def lookup(self, number: str) -> tuple[str | None, str | None]:
+        """Return the type and name of the issuer of ``number``.
+
+        Returns ``(None, None)`` if no issuer matches, or if ``number`` contains
+        anything other than digits.
+        """
+        if not (number.isascii() and number.isdigit()):
+            return None, None
+        length = len(number)
+        best = None
+        node = self._root
+        for digit in number[: self._depth]:
+            child = node.children.get(digit)
+            if child is None:
+                break
+            node = child
+            for entry in node.entries:
+                if length in entry[1] and (best is None or entry[0] < best[0]):
+                    best = entry
+        if best is None:
+            return None, None
+        return best[2], best[3]
+
+
+def _expand_range(prefix_range: str) -> list[str]:
+    """Return the fewest prefixes that cover an inclusive range of prefixes.
+
+    For example, ``"2221-2720"`` becomes ``["2221", ..., "2229", "223", ...,
+    "229", "23", ..., "26", "270", "271", "2720"]``.
+    """
+    start, _sep, end = prefix_range.partition("-")
+    end = end or start
+    if not (
+        start.isascii()
+        and start.isdigit()
+        and end.isascii()
+        and end.isdigit()
+        and len(start) == len(end)
+        and start <= end
+    ):
+        raise ValueError(f"Invalid card number prefix: {prefix_range!r}")
+    width = len(start)
+    current, last = int(start), int(end)
+    prefixes = []
+    while current <= last:
+        # Take the largest aligned block of numbers that fits in the range.
+        size = 0
+        while (
+            size + 1 < width
+            and current % 10 ** (size + 1) == 0
+            and current + 10 ** (size + 1) - 1 <= last
+        ):
+            size += 1
+        prefixes.append(str(current).zfill(width)[: width - size])
+        current += 10**size
+    return prefixes
+
+
+class BinRange(NamedTuple):
+    """The details of a range of IINs in a :class:`BinDatabase`.
+
+    Each field is ``None`` if the database doesn't know it.
+    """
+
+    #: ISO 3166-1 alpha-2 code of the issuer's country.
+    country: str | None
+    #: How the card is funded, e.g.: ``"credit"``, ``"debit"`` or ``"prepaid"``.
+    funding: str | None
+    #: The card's product level, e.g.: ``"classic"`` or ``"platinum"``.
+    level: str | None
+    #: The name of the issuing bank.
+    bank: str | None
+
+
+class CardInfo(NamedTuple):
+    """What is known about a card number; see
+    :func:`payments.core.get_card_info`."""
+
+    card_type: str | None
+    issuer: str | None
+    country: str | None
+    funding: str | None
+    level: str | None
+    bank: str | None
+
+
+# A BIN database file starts with a header (magic, version, number of digits
+# per range bound, number of ranges and offset of the string table), followed
+# by the ranges sorted by their first IIN, and a table of the strings they
+# refer to. Index 0 of the string table is the empty string, meaning unknown.
+_BIN_HEADER = struct.Struct("<4sBBxxII")
+_BIN_RANGE = struct.Struct("<QQHHHH")
+_BIN_STRING_LENGTH = struct.Struct("<H")
+_BIN_MAGIC = b"PBIN"
+_BIN_VERSION = 1
+#: Maximum number of distinct strings (including the empty one) in a file.
+BIN_MAX_STRINGS = 2**16
+
+
+class _RangeStarts:
+    """The first IIN of each range of a BIN database, for :mod:`bisect`.
+
+    Only used on big-endian platforms, which can't view the little-endian
+    ranges as an array of integers.
+    """
+
+    def __init__(self, buffer: mmap.mmap, count: int) -> None:
+        self._buffer = buffer
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> int:
+        offset = _BIN_HEADER.size + index * _BIN_RANGE.size
+        return struct.unpack_from("<Q", self._buffer, offset)[0]
+
+
+class BinDatabase:
+    """A read-only, memory-mapped database of IIN ranges.
+
+    Files are built with :func:`write_bin_database` (or the
+    ``payments_build_bin_database`` command). Only the string table is loaded
+    into memory; ranges are read from the mapped file as they are searched.
+
+    :param path: Path to the database file.
+    :raises ValueError: if the file is not a BIN database.
+    """
+
+    def __init__(self, path: str | os.PathLike) -> None:
+        with open(path, "rb") as f:
+            try:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:  # The file is empty.
+                raise ValueError(f"Not a BIN database: {path}") from e
+        try:
+            magic, version, self.width, count, strings_offset = _BIN_HEADER.unpack_from(
+                self._buffer
+            )
+            valid = magic == _BIN_MAGIC and version == _BIN_VERSION
+            if valid:
+                self._strings = _read_strings(self._buffer, strings_offset)
+        except (struct.error, UnicodeDecodeError):
+            valid = False
+        if not valid:
+            self._buffer.close()
+            raise ValueError(f"Not a BIN database: {path}")
+        self._views: list[memoryview] = []
+        self._starts: Sequence[int] | _RangeStarts
+        if sys.byteorder == "little":
+            # Each range is three 64-bit words, starting with its first IIN.
+            end = _BIN_HEADER.size + count * _BIN_RANGE.size
+            words = memoryview(self._buffer)[_BIN_HEADER.size : end].cast("Q")
+            self._views = [words, words[:: _BIN_RANGE.size // 8]]
+            self._starts = self._views[-1]
+        else:
+            self._starts = _RangeStarts(self._buffer, count)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def lookup(self, number: str) -> BinRange | None:
+        """Return the details of the range that ``number`` belongs to.
+
+        Returns ``None`` if no range matches, or if ``number`` contains anything
+        other than digits.
+        """
+        if not (number.isascii() and number.isdigit()):
+            return None
+        iin = int(number[: self.width].ljust(self.width, "0"))
+        index = bisect.bisect_right(self._starts, iin) - 1
+        if index < 0:
+            return None
+        offset = _BIN_HEADER.size + index * _BIN_RANGE.size
+        _start, end, *fields = _BIN_RANGE.unpack_from(self._buffer, offset)
+        if iin > end:
+            return None
+        strings = self._strings
+        return BinRange(*(strings[field] or None for field in fields))
+
+    def close(self) -> None:
+        for view in reversed(self._views):
+            view.release()
+        self._buffer.close()
+
+
+def _read_strings(buffer: mmap.mmap, offset: int) -> list[str]:
+    (count,) = struct.unpack_from("<I", buffer, offset)
+    offset += 4
+    strings = []
+    for _i in range(count):
+        (length,) = _BIN_STRING_LENGTH.unpack_from(buffer, offset)
+        offset += _BIN_STRING_LENGTH.size
+        strings.append(buffer[offset : offset + length].decode())
+        offset += length
+    return strings
+
+
+def write_bin_database(
+    path: str | os.PathLike,
+    ranges: Iterable[tuple[str, str, str, str, str, str]],
+    width: int = 8,
+) -> int:
+    """Write a :class:`BinDatabase` file.
+
+    :param ranges: Tuples of ``(start, end, country, funding, level, bank)``.
+        ``start`` and ``end`` are the first and last IIN of an inclusive range;
+        they may have fewer than ``width`` digits, so ``("4111", "4111", ...)``
+        covers every number that starts with ``4111``. Empty strings mean
+        unknown.
+    :param width: Number of leading digits of card numbers to compare.
+    :returns: The number of ranges written.
+    :raises ValueError: if a bound is invalid, ranges overlap, or there are
+        more than :data:`BIN_MAX_STRINGS` distinct strings or strings longer
+        than 65535 bytes.
+
+    The file is written next to ``path`` and then moved in its place, so
+    processes that have the previous file open keep reading it unchanged.
+    """
+    strings: dict[str, int] = {"": 0}
+    records = []
+    for start, end, *fields in ranges:
+        low, high = _parse_bound(start, width, "0"), _parse_bound(end, width, "9")
+        if low > high:
+            raise ValueError(f"Invalid BIN range: {start}-{end}")
+        indexes = [strings.setdefault(field, len(strings)) for field in fields]
+        records.append((low, high, *indexes))
+    records.sort()
+    for previous, record in pairwise(records):
+        if record[0] <= previous[1]:
+            raise ValueError(f"Overlapping BIN ranges at {record[0]}")
+
+    if len(strings) > BIN_MAX_STRINGS:
+        raise ValueError(
+            f"Too many distinct BIN strings: {len(strings)} > {BIN_MAX_STRINGS}"
+        )
+    encoded_strings = [string.encode() for string in strings]
+    for encoded in encoded_strings:
+        if len(encoded) > 0xFFFF:
+            raise ValueError(f"BIN string too long: {encoded[:20]!r}...")
+
+    strings_offset = _BIN_HEADER.size + len(records) * _BIN_RANGE.size
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".bins-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(
+                _BIN_HEADER.pack(
+                    _BIN_MAGIC, _BIN_VERSION, width, len(records), strings_offset
+                )
+            )
+            for record in records:
+                f.write(_BIN_RANGE.pack(*record))
+            f.write(struct.pack("<I", len(encoded_strings)))
+            for encoded in encoded_strings:
+                f.write(_BIN_STRING_LENGTH.pack(len(encoded)))
+                f.write(encoded)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp() creates files only readable by their owner.
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return len(records)
+
+
+def _parse_bound(bound: str, width: int, fill: str) -> int:
+    if not (bound.isascii() and bound.isdigit() and len(bound) <= width):
+        raise ValueError(f"Invalid IIN: {bound!r}")
+    return int(bound.ljust(width, fill))
+
+
+_index: CardIssuerIndex | None = None
+_index_lock = threading.Lock()
+_bin_database: BinDatabase | None = None
+
+
+def get_card_issuer_index() -> CardIssuerIndex:
+    """Return the index built from ``PAYMENT_CARD_ISSUERS`` and the built-ins.
+
+    Entries from the setting take precedence over :data:`CARD_ISSUERS`. The
+    index is built once and rebuilt when the setting changes.
+    """
+    global _index
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                extra = getattr(settings, "PAYMENT_CARD_ISSUERS", ())
+                _index = CardIssuerIndex([*extra, *CARD_ISSUERS])
+            index = _index
+    return index
+
+
+def get_bin_database() -> BinDatabase | None:
+    """Return the database at the ``PAYMENT_BIN_DATABASE`` path, if set.
+
+    The file is opened once per process and reopened when the setting changes.
+    """
+    global _bin_database
+    database = _bin_database
+    if database is None:
+        path = getattr(settings, "PAYMENT_BIN_DATABASE", None)
+        if not path:
+            return None
+        with _index_lock:
+            if _bin_database is None:
+                _bin_database = BinDatabase(path)
+            database = _bin_database
+    return database
+
+
+@receiver(setting_changed)
+def _invalidate_card_issuer_index(setting, **kwargs) -> None:
+    global _index, _bin_database
+    if setting == "PAYMENT_CARD_ISSUERS":
+        with _index_lock:
+            _index = None
+    elif setting == "PAYMENT_BIN_DATABASE":
+        # Lookups in other threads may still be using the old database; its
+        # file is unmapped once they are done with it.
+        with _index_lock:
+            _bin_database = None
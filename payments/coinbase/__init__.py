@@ -1,12 +1,15 @@
 from __future__ import annotations
 
+import asyncio
 import hashlib
 import hmac
 import json
+import threading
 import time
 from collections import OrderedDict
+from concurrent.futures import Future
 
-import requests
+from asgiref.sync import sync_to_async
 from django.core.exceptions import ImproperlyConfigured
 from django.http import HttpResponse
 from django.http import HttpResponseForbidden
@@ -22,6 +25,11 @@ class CoinbaseProvider(BasicProvider):
 
     This backend does not support fraud detection.
 
+    The checkout code of each payment is stored in its ``attrs`` and reused
+    until the payment's total, currency or description change, so rendering
+    the payment form again does not create another button. Concurrent renders
+    of the same payment within a process share one button.
+
     :param key: Api key generated by Coinbase
     :param secret: Api secret generated by Coinbase
     :param endpoint: Coinbase endpoint domain to use. For the production
@@ -36,6 +44,8 @@ class CoinbaseProvider(BasicProvider):
         self.endpoint = endpoint
         self.key = key
         self.secret = secret
+        self._pending_codes: dict[tuple[str, str], Future[str]] = {}
+        self._pending_lock = threading.Lock()
         super().__init__(**kwargs)
         if not self._capture:
             raise ImproperlyConfigured("Coinbase does not support pre-authorization.")
@@ -45,6 +55,26 @@ class CoinbaseProvider(BasicProvider):
         return hashlib.md5(value.encode("utf-8")).hexdigest()
 
     def get_checkout_code(self, payment):
+        api_url, data, headers = self._get_button_request(payment)
+        response = self.http_session.post(
+            api_url, data=json.dumps(data), headers=headers
+        )
+
+        response.raise_for_status()
+        results = response.json()
+        return results["button"]["code"]
+
+    async def aget_checkout_code(self, payment):
+        """Asynchronous version of :meth:`get_checkout_code`."""
+        api_url, data, headers = await sync_to_async(self._get_button_request)(payment)
+        response = await self.get_async_http_client().post(
+            api_url, content=json.dumps(data), headers=headers
+        )
+        response.raise_for_status()
+        results = response.json()
+        return results["button"]["code"]
+
+    def _get_button_request(self, payment) -> tuple[str, dict, dict]:
         api_url = self.api_url % {"endpoint": self.endpoint}
         button_data = {
             "name": payment.description,
@@ -65,18 +95,103 @@ class CoinbaseProvider(BasicProvider):
         headers = {
             "ACCESS_KEY": self.key,
             "ACCESS_SIGNATURE": signature,
-            "ACCESS_NONCE": nonce,
+            "ACCESS_NONCE": str(nonce),
             "Accept": "application/json",
         }
-        response = requests.post(api_url, data=json.dumps(data), headers=headers)
-
-        response.raise_for_status()
-        results = response.json()
-        return results["button"]["code"]
+        return api_url, data, headers
 
     def get_action(self, payment) -> str:
         checkout_url = self.checkout_url % {"endpoint": self.endpoint}
-        return f"{checkout_url}/{self.get_checkout_code(payment)}"
+        fingerprint = self._get_button_fingerprint(payment)
+        code = self._get_stored_checkout_code(payment, fingerprint)
+        if code is None:
+            future, is_owner = self._get_pending_code(payment, fingerprint)
+            if is_owner:
+                try:
+                    future.set_result(self.get_checkout_code(payment))
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                finally:
+                    self._forget_pending_code(payment, fingerprint, future)
+            code = future.result()
+            self._store_checkout_code(payment, fingerprint, code)
+        return f"{checkout_url}/{code}"
+
+    async def aget_action(self, payment) -> str:
+        """Asynchronous version of :meth:`get_action`."""
+        checkout_url = self.checkout_url % {"endpoint": self.endpoint}
+        fingerprint = self._get_button_fingerprint(payment)
+        code = self._get_stored_checkout_code(payment, fingerprint)
+        if code is None:
+            future, is_owner = self._get_pending_code(payment, fingerprint)
+            if is_owner:
+                try:
+                    future.set_result(await self.aget_checkout_code(payment))
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                finally:
+                    self._forget_pending_code(payment, fingerprint, future)
+            code = await asyncio.wrap_future(future)
+            await sync_to_async(self._store_checkout_code)(payment, fingerprint, code)
+        return f"{checkout_url}/{code}"
+
+    def _get_button_fingerprint(self, payment) -> str:
+        """Identify the inputs of a button; a new one is needed if they change."""
+        inputs = [
+            self.endpoint,
+            self.key,
+            str(payment.total),
+            payment.currency,
+            payment.description,
+        ]
+        return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
+
+    def _get_stored_checkout_code(self, payment, fingerprint: str) -> str | None:
+        stored = getattr(payment.attrs, "coinbase_checkout", None) or {}
+        if stored.get("fingerprint") != fingerprint:
+            return None
+        return stored.get("code")
+
+    def _store_checkout_code(self, payment, fingerprint: str, code: str) -> None:
+        payment.attrs.coinbase_checkout = {"code": code, "fingerprint": fingerprint}
+        payment.save()
+
+    def _get_pending_code(self, payment, fingerprint: str) -> tuple[Future[str], bool]:
+        """Return the future of the button being created for ``payment``.
+
+        The second value is ``True`` if the caller must create the button and
+        resolve the future, or ``False`` if another request is already doing so.
+        """
+        key = (payment.token, fingerprint)
+        with self._pending_lock:
+            future = self._pending_codes.get(key)
+            if future is not None:
+                return future, False
+            future = self._pending_codes[key] = Future()
+            return future, True
+
+    def _forget_pending_code(self, payment, fingerprint: str, future) -> None:
+        # Waiters are woken up even if the owner was interrupted.
+        future.cancel()
+        with self._pending_lock:
+            self._pending_codes.pop((payment.token, fingerprint), None)
+
+    async def aget_form(self, payment, data=None):
+        if (
+            self._overrides("get_form", CoinbaseProvider)
+            or self._overrides("get_action", CoinbaseProvider)
+            or self._overrides("get_checkout_code", CoinbaseProvider)
+        ):
+            return await super().aget_form(payment, data)
+        from payments.forms import PaymentForm
+
+        return PaymentForm(
+            self.get_hidden_fields(payment),
+            await self.aget_action(payment),
+            self._method,
+        )
 
     def get_hidden_fields(self, payment):
         return {}
@@ -2,11 +2,15 @@ from __future__ import annotations
 
 import hashlib
 import json
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 from unittest.mock import MagicMock
 from unittest.mock import patch
 
 import pytest
+from asgiref.sync import async_to_sync
 from django.http import HttpResponse
 from django.http import HttpResponseForbidden
 
@@ -37,6 +41,10 @@ class Payment:
     token = PAYMENT_TOKEN
     variant = VARIANT
 
+    def __init__(self) -> None:
+        self.attrs = types.SimpleNamespace()
+        self.saves = 0
+
     def change_status(self, status: str) -> None:
         self.status = status
 
@@ -50,6 +58,7 @@ class Payment:
         return []
 
     def save(self) -> Payment:
+        self.saves += 1
         return self
 
     def get_success_url(self) -> str:
@@ -94,7 +103,7 @@ def test_incorrect_data_process_data(
 
 
 @patch("time.time")
-@patch("requests.post")
+@patch("requests.Session.post")
 def test_provider_returns_checkout_url(
     mocked_post: MagicMock,
     mocked_time: MagicMock,
@@ -113,3 +122,133 @@ def test_provider_returns_checkout_url(
     form = prov.get_form(payment)
     assert form.action == url
     assert mocked_post.call_args[1]["headers"]["ACCESS_SIGNATURE"] == signature
+
+
+@patch("time.time")
+def test_provider_returns_checkout_url_async(
+    mocked_time: MagicMock,
+    provider: tuple[Payment, CoinbaseProvider],
+) -> None:
+    httpx = pytest.importorskip("httpx")
+    payment, prov = provider
+    code = "123abc"
+    signature = "21d476eff7b2e6cccdfe6deb0c097ba638d5de7e775b303e4fdb2f8bfeff72e2"
+    headers = {}
+
+    def handler(request):
+        headers.update(request.headers)
+        return httpx.Response(200, json={"button": {"code": code}})
+
+    mocked_time.return_value = 1
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    with patch.object(CoinbaseProvider, "get_async_http_client", return_value=client):
+        form = async_to_sync(prov.aget_form)(payment)
+    assert form.action == f"https://sandbox.coinbase.com/checkouts/{code}"
+    assert headers["access_signature"] == signature
+
+
+@patch.object(CoinbaseProvider, "get_checkout_code", side_effect=["code1", "code2"])
+def test_provider_reuses_checkout_code(
+    mocked_get_checkout_code: MagicMock,
+    provider: tuple[Payment, CoinbaseProvider],
+) -> None:
+    payment, prov = provider
+    url = "https://sandbox.coinbase.com/checkouts/"
+    assert prov.get_action(payment) == url + "code1"
+    assert prov.get_action(payment) == url + "code1"
+    assert mocked_get_checkout_code.call_count == 1
+    assert payment.attrs.coinbase_checkout["code"] == "code1"
+    assert payment.saves == 1
+
+    payment.total = Decimal(200)
+    assert prov.get_action(payment) == url + "code2"
+    assert async_to_sync(prov.aget_action)(payment) == url + "code2"
+    assert mocked_get_checkout_code.call_count == 2
+
+
+def test_provider_coalesces_concurrent_checkout_codes(
+    provider: tuple[Payment, CoinbaseProvider],
+) -> None:
+    _payment, prov = provider
+    started = threading.Event()
+    joined = threading.Event()
+    release = threading.Event()
+    calls = []
+    get_pending_code = prov._get_pending_code
+
+    def get_checkout_code(payment):
+        calls.append(payment)
+        started.set()
+        assert release.wait(5)
+        return "code"
+
+    def join_pending_code(payment, fingerprint):
+        future, is_owner = get_pending_code(payment, fingerprint)
+        if not is_owner:
+            joined.set()
+        return future, is_owner
+
+    payments = [Payment(), Payment()]
+    with (
+        patch.object(prov, "get_checkout_code", side_effect=get_checkout_code),
+        patch.object(prov, "_get_pending_code", side_effect=join_pending_code),
+        ThreadPoolExecutor(max_workers=2) as executor,
+    ):
+        first = executor.submit(prov.get_action, payments[0])
+        assert started.wait(5)
+        second = executor.submit(prov.get_action, payments[1])
+        assert joined.wait(5)
+        release.set()
+        assert first.result() == second.result()
+    assert len(calls) == 1
+    assert all(p.attrs.coinbase_checkout["code"] == "code" for p in payments)
+    assert not prov._pending_codes
+
+
+@patch.object(CoinbaseProvider, "get_checkout_code", side_effect=ValueError("boom"))
+def test_provider_does_not_store_failed_checkout_code(
+    mocked_get_checkout_code: MagicMock,
+    provider: tuple[Payment, CoinbaseProvider],
+) -> None:
+    payment, prov = provider
+    with pytest.raises(ValueError, match="boom"):
+        prov.get_action(payment)
+    assert not hasattr(payment.attrs, "coinbase_checkout")
+    assert not prov._pending_codes
+
+
+class Interrupted(BaseException):
+    pass
+
+
+def test_provider_passes_interruptions_to_waiters(
+    provider: tuple[Payment, CoinbaseProvider],
+) -> None:
+    _payment, prov = provider
+    started = threading.Event()
+    joined = threading.Event()
+    get_pending_code = prov._get_pending_code
+
+    def get_checkout_code(payment):
+        started.set()
+        assert joined.wait(5)
+        raise Interrupted
+
+    def join_pending_code(payment, fingerprint):
+        future, is_owner = get_pending_code(payment, fingerprint)
+        if not is_owner:
+            joined.set()
+        return future, is_owner
+
+    with (
+        patch.object(prov, "get_checkout_code", side_effect=get_checkout_code),
+        patch.object(prov, "_get_pending_code", side_effect=join_pending_code),
+        ThreadPoolExecutor(max_workers=2) as executor,
+    ):
+        first = executor.submit(prov.get_action, Payment())
+        assert started.wait(5)
+        second = executor.submit(prov.get_action, Payment())
+        for future in (first, second):
+            with pytest.raises(Interrupted):
+                future.result()
+    assert not prov._pending_codes
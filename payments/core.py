@@ -1,19 +1,44 @@
 from __future__ import annotations
 
-import re
+import asyncio
+import http.cookiejar
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from functools import cached_property
 from typing import TYPE_CHECKING
+from typing import Any
+from typing import NamedTuple
 from urllib.parse import urlencode
 from urllib.parse import urljoin
 
+import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .cards import CardInfo
+from .cards import get_bin_database
+from .cards import get_card_issuer_index
 
 if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from decimal import Decimal
+
+    import httpx
     from django.http import HttpRequest
 
     from .models import BasePayment
 
+logger = logging.getLogger(__name__)
+
 PAYMENT_VARIANTS: dict[str, tuple[str, dict]] = {
     "default": ("payments.dummy.DummyProvider", {})
 }
@@ -35,28 +60,170 @@ def get_base_url(request: HttpRequest | None = None) -> str:
     Protocol is chosen by checking ``PAYMENT_USES_SSL`` variable, and will fall
     back to plain text (``http``).
 
-    If the ``PAYMENT_HOST`` setting is not specified, gets domain from Sites.
+    If the ``PAYMENT_HOST`` setting is not specified, gets domain from Sites,
+    which caches the current site.
 
     Otherwise checks if it's callable and returns it's result. If it's not a
     callable treats it as domain.
     """
     protocol = "https" if PAYMENT_USES_SSL else "http"
     if not PAYMENT_HOST:
-        try:
-            current_site = Site.objects.get_current(request)
-            domain = current_site.domain
-        except Site.DoesNotExist:
-            if request:
-                domain = request.get_host()
-            else:
-                raise
-    elif callable(PAYMENT_HOST):
-        domain = PAYMENT_HOST()
-    else:
-        domain = PAYMENT_HOST
+        return f"{protocol}://{_get_site_domain(request)}"
+    domain = PAYMENT_HOST() if callable(PAYMENT_HOST) else PAYMENT_HOST
     return f"{protocol}://{domain}"
 
 
+def _get_site_domain(request: HttpRequest | None) -> str:
+    try:
+        return Site.objects.get_current(request).domain
+    except Site.DoesNotExist:
+        if request:
+            return request.get_host()
+        raise
+
+
+DEFAULT_HTTP_OPTIONS: dict[str, Any] = {
+    "pool_connections": 10,
+    "pool_maxsize": 10,
+    "pool_block": False,
+    "keep_alive": True,
+    # A (connect, read) tuple, in seconds.
+    "timeout": (5, 30),
+    "max_retries": 2,
+    "backoff_factor": 0.3,
+}
+
+
+class _TimeoutHTTPAdapter(HTTPAdapter):
+    """An ``HTTPAdapter`` that applies a default timeout to every request."""
+
+    def __init__(self, timeout=None, **kwargs) -> None:
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+class _RejectCookiesPolicy(http.cookiejar.DefaultCookiePolicy):
+    """A cookie policy that keeps no cookies set by responses.
+
+    Sessions and clients are shared by all payments of a provider, so cookies
+    set by a gateway for one customer must not be sent along for the next.
+    """
+
+    def set_ok(self, cookie, request) -> bool:
+        return False
+
+
+def create_http_session(options: dict[str, Any] | None = None) -> requests.Session:
+    """Return a ``requests.Session`` backed by a connection pool.
+
+    Options are taken from :data:`DEFAULT_HTTP_OPTIONS`, overridden by the
+    ``PAYMENT_HTTP_OPTIONS`` setting and then by ``options``.
+
+    Only connection errors are retried: a request that may have reached the
+    gateway is never sent again, since most gateway calls are not idempotent.
+    Cookies set by responses are not kept.
+    """
+    options = _get_http_options(options)
+    retry = Retry(
+        total=options["max_retries"],
+        connect=options["max_retries"],
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=options["backoff_factor"],
+        raise_on_status=False,
+    )
+    adapter = _TimeoutHTTPAdapter(
+        timeout=options["timeout"],
+        pool_connections=options["pool_connections"],
+        pool_maxsize=options["pool_maxsize"],
+        pool_block=options["pool_block"],
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.cookies.set_policy(_RejectCookiesPolicy())
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not options["keep_alive"]:
+        session.headers["Connection"] = "close"
+    return session
+
+
+def create_async_http_client(
+    options: dict[str, Any] | None = None,
+) -> httpx.AsyncClient:
+    """Return an ``httpx.AsyncClient`` backed by a connection pool.
+
+    This is the asynchronous counterpart of :func:`create_http_session` and
+    takes the same options. ``pool_maxsize`` limits the number of open
+    connections only if ``pool_block`` is set. Requires ``httpx``, which is
+    installed with the ``async`` extra.
+    """
+    try:
+        import httpx
+    except ImportError as e:
+        raise ImproperlyConfigured(
+            'Asynchronous providers require httpx; install "django-payments[async]".'
+        ) from e
+
+    options = _get_http_options(options)
+    timeout = options["timeout"]
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    limits = httpx.Limits(
+        max_connections=options["pool_maxsize"] if options["pool_block"] else None,
+        max_keepalive_connections=(
+            options["pool_maxsize"] if options["keep_alive"] else 0
+        ),
+    )
+    headers = {} if options["keep_alive"] else {"Connection": "close"}
+    client = httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(
+            limits=limits, retries=options["max_retries"]
+        ),
+        timeout=httpx.Timeout(read, connect=connect),
+        headers=headers,
+    )
+    client.cookies.jar.set_policy(_RejectCookiesPolicy())
+    return client
+
+
+def _close_async_http_clients(clients) -> None:
+    for loop, client in list(clients.items()):
+        # Clients can only be closed by their own event loop; those of loops
+        # that no longer run are dropped, and their connections with them.
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+    clients.clear()
+
+
+def _get_http_options(options: dict[str, Any] | None) -> dict[str, Any]:
+    return {
+        **DEFAULT_HTTP_OPTIONS,
+        **getattr(settings, "PAYMENT_HTTP_OPTIONS", {}),
+        **(options or {}),
+    }
+
+
+class StatusUpdate(NamedTuple):
+    """A payment's state as reported by its gateway.
+
+    See :meth:`BasicProvider.poll_statuses`.
+    """
+
+    status: str
+    message: str = ""
+    #: The amount captured so far, if the gateway reports it.
+    captured_amount: Decimal | None = None
+    #: New :attr:`~payments.models.BasePayment.extra_data` for the payment, if
+    #: the provider keeps the gateway's details there.
+    extra_data: str | None = None
+
+
 class BasicProvider:
     """Defined a base provider API.
 
@@ -67,6 +234,12 @@ class BasicProvider:
 
     _method = "post"
 
+    #: Overrides for ``PAYMENT_HTTP_OPTIONS`` used by :attr:`http_session`.
+    http_options: dict[str, Any] = {}
+
+    #: Maximum number of payments passed to :meth:`poll_statuses` at once.
+    poll_batch_size = 100
+
     def get_action(self, payment):
         """The ``action`` for the HTML form element."""
         return self.get_return_url(payment)
@@ -79,6 +252,56 @@ class BasicProvider:
         """
         self._capture = capture
 
+    @cached_property
+    def http_session(self) -> requests.Session:
+        """A pooled HTTP session used for all requests to the gateway.
+
+        Reusing it keeps connections (and their TLS sessions) alive between
+        requests. See :func:`create_http_session`.
+        """
+        return create_http_session(self.http_options)
+
+    def get_async_http_client(self) -> httpx.AsyncClient:
+        """A pooled asynchronous HTTP client for the running event loop.
+
+        Connections cannot be shared between event loops, so a client is kept
+        for each loop the provider is used from. See
+        :func:`create_async_http_client`.
+        """
+        loop = asyncio.get_running_loop()
+        clients = self.__dict__.get("_async_http_clients")
+        if clients is None:
+            clients = self.__dict__["_async_http_clients"] = weakref.WeakKeyDictionary()
+            # Close the clients once the provider is discarded, e.g.: evicted
+            # from the provider cache, and no request uses it anymore.
+            weakref.finalize(self, _close_async_http_clients, clients)
+        client = clients.get(loop)
+        if client is None:
+            client = clients[loop] = create_async_http_client(self.http_options)
+        return client
+
+    def close(self) -> None:
+        """Close the provider's HTTP session and asynchronous HTTP clients.
+
+        Asynchronous clients are closed by their event loop, once it gets to
+        it. This also happens when the provider is garbage collected.
+        """
+        session = self.__dict__.pop("http_session", None)
+        if session is not None:
+            session.close()
+        _close_async_http_clients(self.__dict__.get("_async_http_clients", {}))
+
+    async def aclose(self) -> None:
+        """Asynchronous version of :meth:`close`.
+
+        The client of the running event loop is closed before returning.
+        """
+        clients = self.__dict__.get("_async_http_clients", {})
+        client = clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+        self.close()
+
     def get_hidden_fields(self, payment):
         """
         Converts a payment into a dict containing transaction data
@@ -118,6 +341,16 @@ class BasicProvider:
         """Return payment token from provider request."""
         raise NotImplementedError
 
+    def get_webhook_event_id(self, request) -> str | None:
+        """Return the ID of the event delivered by a webhook request.
+
+        This is used to recognise redeliveries when ``PAYMENT_WEBHOOK_DEDUP_TTL``
+        is set. Return ``None`` to identify events by a hash of the request
+        body, or an empty string if deliveries should never be deduplicated
+        (e.g.: if identical notifications may report different changes).
+        """
+        return None
+
     def get_return_url(
         self,
         payment,
@@ -155,8 +388,211 @@ class BasicProvider:
     def cancel(self, payment):
         raise NotImplementedError
 
+    def poll_statuses(self, payments: list[BasePayment]) -> dict[Any, StatusUpdate]:
+        """Fetch the current state of ``payments`` from the gateway.
+
+        This is used by :func:`~payments.reconcile.reconcile_payments` to catch
+        up on missed webhooks, so implementations should query the gateway in
+        bulk where it allows it. It is called from worker threads, and must
+        neither modify the payments nor access the database.
+
+        :param payments: Waiting or pre-authorized payments of this variant; at
+            most :attr:`poll_batch_size` of them.
+        :returns: A :class:`StatusUpdate` for each payment the gateway knows
+            about, keyed by the payment's primary key.
+        """
+        raise NotImplementedError
+
+    # Asynchronous API. By default each method runs its synchronous
+    # counterpart in a worker thread; providers that talk to their gateway
+    # over HTTP override them with native implementations.
+
+    async def aget_form(self, payment, data=None):
+        """Asynchronous version of :meth:`get_form`."""
+        return await sync_to_async(self.get_form)(payment, data=data)
+
+    async def aprocess_data(self, payment, request):
+        """Asynchronous version of :meth:`process_data`."""
+        return await sync_to_async(self.process_data)(payment, request)
+
+    async def acapture(self, payment, amount=None):
+        """Asynchronous version of :meth:`capture`."""
+        return await sync_to_async(self.capture)(payment, amount)
+
+    async def arelease(self, payment):
+        """Asynchronous version of :meth:`release`."""
+        return await sync_to_async(self.release)(payment)
+
+    async def arefund(self, payment, amount=None):
+        """Asynchronous version of :meth:`refund`."""
+        return await sync_to_async(self.refund)(payment, amount)
+
+    async def acancel(self, payment):
+        """Asynchronous version of :meth:`cancel`."""
+        return await sync_to_async(self.cancel)(payment)
+
+    def _overrides(self, name: str, cls: type) -> bool:
+        """Whether a subclass of ``cls`` overrides its method ``name``.
+
+        Native asynchronous methods fall back to running the synchronous method
+        in a thread if a subclass has customised it.
+        """
+        return getattr(type(self), name) is not getattr(cls, name)
+
+
+class ProviderRegistryStats(NamedTuple):
+    """A snapshot of a :class:`ProviderRegistry`'s counters."""
+
+    hits: int
+    misses: int
+    size: int
+    instantiation_times: dict[str, float]
 
-PROVIDER_CACHE = {}
+
+class ProviderRegistry:
+    """A thread-safe, bounded cache of provider instances keyed by variant.
+
+    Providers are built lazily from ``PAYMENT_VARIANTS`` the first time a
+    variant is requested. Each variant has its own lock, so concurrent requests
+    that miss the cache build the provider only once, while lookups of other
+    variants are not blocked.
+
+    :param maxsize: Maximum number of providers to keep. The least recently used
+        provider is evicted once the limit is reached. ``None`` means unbounded.
+    """
+
+    def __init__(self, maxsize: int | None = None) -> None:
+        self.maxsize = maxsize
+        self._providers: OrderedDict[str, BasicProvider] = OrderedDict()
+        self._lock = threading.Lock()
+        self._variant_locks: dict[str, threading.Lock] = {}
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._instantiation_times: dict[str, float] = {}
+
+    def get(self, variant: str) -> BasicProvider:
+        """Return the provider for ``variant``, building it if necessary.
+
+        :raises ValueError: if the variant is not defined in ``PAYMENT_VARIANTS``.
+        """
+        with self._lock:
+            provider = self._lookup(variant)
+            if provider is not None:
+                return provider
+        if variant not in _get_variants():
+            # Checked before creating a lock, so that lookups of unknown
+            # variants (e.g.: from request URLs) don't accumulate locks.
+            raise ValueError(f"Payment variant does not exist: {variant}")
+        with self._lock:
+            variant_lock = self._variant_locks.setdefault(variant, threading.Lock())
+        with variant_lock:
+            with self._lock:
+                # Another thread may have built it while we were waiting.
+                provider = self._lookup(variant)
+                if provider is not None:
+                    return provider
+                self._misses += 1
+                generation = self._generation
+            provider, elapsed = self._build(variant)
+            with self._lock:
+                # Don't cache an instance built from settings that have since
+                # been invalidated; the next lookup will build a fresh one.
+                if generation == self._generation:
+                    self._store(variant, provider, elapsed)
+        return provider
+
+    def invalidate(self, variant: str | None = None) -> None:
+        """Drop cached providers so that they are rebuilt on next use.
+
+        Use this after rotating credentials. If ``variant`` is ``None``, all
+        providers are dropped.
+        """
+        with self._lock:
+            self._generation += 1
+            if variant is None:
+                self._providers.clear()
+                self._instantiation_times.clear()
+            else:
+                self._providers.pop(variant, None)
+                self._instantiation_times.pop(variant, None)
+
+    def variants(self) -> list[str]:
+        """Return the names of the variants defined in ``PAYMENT_VARIANTS``."""
+        return list(_get_variants())
+
+    def warm_up(self, variants: Iterable[str] | None = None) -> dict[str, float]:
+        """Build providers ahead of time.
+
+        :param variants: Names of the variants to build. Defaults to every
+            variant in ``PAYMENT_VARIANTS``.
+        :returns: The construction time, in seconds, of each variant. Variants
+            that were already cached are reported with their original time.
+        """
+        variants = list(self.variants() if variants is None else variants)
+        for variant in variants:
+            self.get(variant)
+        with self._lock:
+            return {
+                variant: self._instantiation_times.get(variant, 0.0)
+                for variant in variants
+            }
+
+    def stats(self) -> ProviderRegistryStats:
+        with self._lock:
+            return ProviderRegistryStats(
+                hits=self._hits,
+                misses=self._misses,
+                size=len(self._providers),
+                instantiation_times=dict(self._instantiation_times),
+            )
+
+    def __contains__(self, variant: str) -> bool:
+        return variant in self._providers
+
+    def _lookup(self, variant: str) -> BasicProvider | None:
+        provider = self._providers.get(variant)
+        if provider is not None:
+            self._providers.move_to_end(variant)
+            self._hits += 1
+        return provider
+
+    def _store(self, variant: str, provider: BasicProvider, elapsed: float) -> None:
+        self._providers[variant] = provider
+        self._instantiation_times[variant] = elapsed
+        if self.maxsize is not None:
+            while len(self._providers) > self.maxsize:
+                evicted, _provider = self._providers.popitem(last=False)
+                self._instantiation_times.pop(evicted, None)
+
+    def _build(self, variant: str) -> tuple[BasicProvider, float]:
+        handler, config = _get_variants().get(variant, (None, None))
+        if not handler:
+            raise ValueError(f"Payment variant does not exist: {variant}")
+        start = time.perf_counter()
+        class_ = import_string(handler)
+        provider = class_(**config)
+        elapsed = time.perf_counter() - start
+        logger.debug("Built payment provider %r in %.3fs", variant, elapsed)
+        return provider, elapsed
+
+
+def _get_variants() -> dict[str, tuple[str, dict]]:
+    return getattr(settings, "PAYMENT_VARIANTS", PAYMENT_VARIANTS)
+
+
+provider_registry = ProviderRegistry(
+    maxsize=getattr(settings, "PAYMENT_PROVIDER_CACHE_SIZE", 128)
+)
+
+# Kept for backwards compatibility; prefer using ``provider_registry``.
+PROVIDER_CACHE = provider_registry._providers
+
+
+@receiver(setting_changed)
+def _invalidate_provider_registry(setting, **kwargs) -> None:
+    if setting == "PAYMENT_VARIANTS":
+        provider_registry.invalidate()
 
 
 def _default_provider_factory(variant: str, payment: BasePayment | None = None):
@@ -164,14 +600,7 @@ def _default_provider_factory(variant: str, payment: BasePayment | None = None):
 
     :arg variant: The name of a variant defined in ``PAYMENT_VARIANTS``.
     """
-    variants = getattr(settings, "PAYMENT_VARIANTS", PAYMENT_VARIANTS)
-    handler, config = variants.get(variant, (None, None))
-    if not handler:
-        raise ValueError(f"Payment variant does not exist: {variant}")
-    if variant not in PROVIDER_CACHE:
-        class_ = import_string(handler)
-        PROVIDER_CACHE[variant] = class_(**config)
-    return PROVIDER_CACHE[variant]
+    return provider_registry.get(variant)
 
 
 PAYMENT_VARIANT_FACTORY = getattr(settings, "PAYMENT_VARIANT_FACTORY", None)
@@ -180,6 +609,8 @@ if PAYMENT_VARIANT_FACTORY:
 else:
     provider_factory = _default_provider_factory
 
+# Kept for backwards compatibility; card numbers are matched by the index built
+# from ``payments.cards.CARD_ISSUERS``.
 CARD_TYPES = [
     (r"^4[0-9]{12}(?:[0-9]{3,6})?$", "visa", "VISA"),
     (
@@ -196,7 +627,25 @@ CARD_TYPES = [
 
 
 def get_credit_card_issuer(number: str) -> tuple[str | None, str | None]:
-    for regexp, card_type, name in CARD_TYPES:
-        if re.match(regexp, number):
-            return card_type, name
-    return None, None
+    """Return the type and name of the issuer of a card number.
+
+    Issuers are looked up in :func:`payments.cards.get_card_issuer_index`,
+    which includes any issuers from the ``PAYMENT_CARD_ISSUERS`` setting.
+    Returns ``(None, None)`` for unknown numbers.
+    """
+    return get_card_issuer_index().lookup(number)
+
+
+def get_card_info(number: str) -> CardInfo:
+    """Return the issuer of a card number and what the BIN database knows.
+
+    The country, funding, level and bank come from the database at the
+    ``PAYMENT_BIN_DATABASE`` path (see :class:`payments.cards.BinDatabase`);
+    they are ``None`` without one, or when the number is not in it.
+    """
+    card_type, issuer = get_credit_card_issuer(number)
+    database = get_bin_database()
+    details = database.lookup(number) if database is not None else None
+    if details is None:
+        return CardInfo(card_type, issuer, None, None, None, None)
+    return CardInfo(card_type, issuer, *details)
@@ -2,8 +2,10 @@ from __future__ import annotations
 
 import contextlib
 import datetime
+import hashlib
 import os.path
 
+import suds.cache
 import suds.client
 import suds.wsse
 from django.core import signing
@@ -40,6 +42,50 @@ SMART_AUTHORIZATION_FAIL = 520
 WSDL_PATH_TEST = "xml/CyberSourceTransaction_1.101.test.wsdl"
 WSDL_PATH = "xml/CyberSourceTransaction_1.101.wsdl"
 
+_WSDL_DIGESTS: dict[str, str] = {}
+
+
+def _get_wsdl_cache(wsdl_path, cache_dir):
+    """Return the suds cache to use for the WSDL at ``wsdl_path``.
+
+    When ``cache_dir`` is set, parsed definitions are pickled into a
+    subdirectory named after a hash of the bundled WSDL and XSD files, so all
+    processes share them and a new schema never picks up stale entries.
+    """
+    if not cache_dir:
+        # suds' default cache is a per-process temporary directory, which
+        # costs disk writes but is never read back.
+        return suds.cache.NoCache()
+    digest = _WSDL_DIGESTS.get(wsdl_path)
+    if digest is None:
+        xml_dir = os.path.join(os.path.dirname(__file__), "xml")
+        sha256 = hashlib.sha256()
+        for name in sorted(os.listdir(xml_dir)):
+            with open(os.path.join(xml_dir, name), "rb") as f:
+                sha256.update(f.read())
+        sha256.update(wsdl_path.encode())
+        digest = _WSDL_DIGESTS[wsdl_path] = sha256.hexdigest()[:16]
+    return suds.cache.ObjectCache(location=os.path.join(cache_dir, digest))
+
+
+def _copy_object(obj):
+    """Return a copy of a suds object created by ``client.factory.create``.
+
+    Schema metadata is shared with the original, which is much cheaper than
+    both ``factory.create`` and ``copy.deepcopy``.
+    """
+    if not isinstance(obj, Object):
+        return obj
+    new = obj.__class__()
+    new.__metadata__ = obj.__metadata__
+    for key, value in obj:
+        if isinstance(value, Object):
+            value = _copy_object(value)
+        elif isinstance(value, list):
+            value = [_copy_object(item) for item in value]
+        setattr(new, key, value)
+    return new
+
 
 class CyberSourceProvider(BasicProvider):
     """Payment provider for CyberSource
@@ -56,6 +102,10 @@ class CyberSourceProvider(BasicProvider):
     :param sandbox: Whether to use a sandbox environment for testing
     :param capture: Whether to capture the payment automatically.  See
         :ref:`capture-payments` for more details.
+    :param wsdl_cache_dir: A directory where the parsed WSDL schema is cached
+        and shared between processes. It must only be writable by the user
+        running the application, since cached entries are unpickled. Disabled
+        by default.
     """
 
     fingerprint_url: str
@@ -68,6 +118,7 @@ class CyberSourceProvider(BasicProvider):
         fingerprint_url="https://h.online-metrix.net/fp/",
         sandbox=True,
         capture=True,
+        wsdl_cache_dir=None,
     ) -> None:
         self.merchant_id = merchant_id
         self.password = password
@@ -86,7 +137,12 @@ class CyberSourceProvider(BasicProvider):
         else:
             wsdl_path = f"file://{local_path}/{WSDL_PATH}"
             self.endpoint = "https://ics2ws.ic3.com/commerce/1.x/transactionProcessor"
-        self.client = suds.client.Client(wsdl_path)
+        self.client = suds.client.Client(
+            wsdl_path,
+            cache=_get_wsdl_cache(wsdl_path, wsdl_cache_dir),
+            cachingpolicy=1,
+        )
+        self._templates: dict[str, Object] = {}
         self.fingerprint_url = fingerprint_url
         self.org_id = org_id
         security_header = suds.wsse.Security()
@@ -97,6 +153,20 @@ class CyberSourceProvider(BasicProvider):
         self.client.set_options(soapheaders=[security_header.xml()])
         super().__init__(capture=capture)
 
+    def _create(self, type_name):
+        """Return a new, empty instance of a schema type.
+
+        Each type is built with ``client.factory.create`` once; later calls
+        return a copy of that template.
+        """
+        try:
+            template = self._templates[type_name]
+        except KeyError:
+            template = self._templates.setdefault(
+                type_name, self.client.factory.create(type_name)
+            )
+        return _copy_object(template)
+
     def get_form(self, payment, data=None):
         if payment.status == PaymentStatus.WAITING:
             payment.change_status(PaymentStatus.INPUT)
@@ -292,17 +362,17 @@ class CyberSourceProvider(BasicProvider):
         return response
 
     def _prepare_payer_auth_validation_check(self, payment, card_data, pa_response):
-        check_service = self.client.factory.create("data:PayerAuthValidateService")
+        check_service = self._create("data:PayerAuthValidateService")
         check_service._run = "true"
         check_service.signedPARes = pa_response
         params = self._get_params_for_new_payment(payment)
         params["payerAuthValidateService"] = check_service
         if payment.attrs.capture:
-            service = self.client.factory.create("data:CCCreditService")
+            service = self._create("data:CCCreditService")
             service._run = "true"
             params["ccCreditService"] = service
         else:
-            service = self.client.factory.create("data:CCAuthService")
+            service = self._create("data:CCAuthService")
             service._run = "true"
             params["ccAuthService"] = service
         params.update(
@@ -316,9 +386,9 @@ class CyberSourceProvider(BasicProvider):
         return params
 
     def _prepare_sale(self, payment, card_data):
-        service = self.client.factory.create("data:CCCreditService")
+        service = self._create("data:CCCreditService")
         service._run = "true"
-        check_service = self.client.factory.create("data:PayerAuthEnrollService")
+        check_service = self._create("data:PayerAuthEnrollService")
         check_service._run = "true"
         params = self._get_params_for_new_payment(payment)
         params.update(
@@ -334,9 +404,9 @@ class CyberSourceProvider(BasicProvider):
         return params
 
     def _prepare_preauth(self, payment, card_data):
-        service = self.client.factory.create("data:CCAuthService")
+        service = self._create("data:CCAuthService")
         service._run = "true"
-        check_service = self.client.factory.create("data:PayerAuthEnrollService")
+        check_service = self._create("data:PayerAuthEnrollService")
         check_service._run = "true"
         params = self._get_params_for_new_payment(payment)
         params.update(
@@ -352,7 +422,7 @@ class CyberSourceProvider(BasicProvider):
         return params
 
     def _prepare_capture(self, payment, amount=None):
-        service = self.client.factory.create("data:CCCaptureService")
+        service = self._create("data:CCCaptureService")
         service._run = "true"
         service.authRequestID = payment.transaction_id
         return {
@@ -363,7 +433,7 @@ class CyberSourceProvider(BasicProvider):
         }
 
     def _prepare_release(self, payment):
-        service = self.client.factory.create("data:CCAuthReversalService")
+        service = self._create("data:CCAuthReversalService")
         service._run = "true"
         service.authRequestID = payment.transaction_id
         return {
@@ -374,7 +444,7 @@ class CyberSourceProvider(BasicProvider):
         }
 
     def _prepare_refund(self, payment, amount=None):
-        service = self.client.factory.create("data:CCCreditService")
+        service = self._create("data:CCCreditService")
         service._run = "true"
         service.captureRequestID = payment.transaction_id
         return {
@@ -403,7 +473,7 @@ class CyberSourceProvider(BasicProvider):
         return None
 
     def _prepare_card_data(self, data):
-        card = self.client.factory.create("data:Card")
+        card = self._create("data:Card")
         card.fullName = data["name"]
         card.accountNumber = data["number"]
         card.expirationMonth = data["expiration"].month
@@ -413,7 +483,7 @@ class CyberSourceProvider(BasicProvider):
         return card
 
     def _prepare_billing_data(self, payment):
-        billing = self.client.factory.create("data:BillTo")
+        billing = self._create("data:BillTo")
         billing.firstName = payment.billing_first_name
         billing.lastName = payment.billing_last_name
         billing.street1 = payment.billing_address_1
@@ -429,7 +499,7 @@ class CyberSourceProvider(BasicProvider):
     def _prepare_items(self, payment):
         items = []
         for i, item in enumerate(payment.get_purchased_items()):
-            purchased = self.client.factory.create("data:Item")
+            purchased = self._create("data:Item")
             purchased._id = i
             purchased.unitPrice = str(item.price)
             purchased.quantity = str(item.quantity)
@@ -444,16 +514,16 @@ class CyberSourceProvider(BasicProvider):
         except AttributeError:
             return None
         else:
-            data = self.client.factory.create("data:MerchantDefinedData")
+            data = self._create("data:MerchantDefinedData")
             for i, value in merchant_defined_data.items():
-                field = self.client.factory.create("data:MDDField")
+                field = self._create("data:MDDField")
                 field._id = int(i)
                 field.value = value
                 data.mddField.append(field)
             return data
 
     def _prepare_totals(self, payment, amount=None):
-        totals = self.client.factory.create("data:PurchaseTotals")
+        totals = self._create("data:PurchaseTotals")
         totals.currency = payment.currency
         if amount is None:
             totals.grandTotalAmount = str(payment.total)
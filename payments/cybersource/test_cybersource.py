@@ -290,3 +290,25 @@ def test_provider_redirects_on_failure(
     assert payment.status == PaymentStatus.ERROR
     assert payment.captured_amount == 0
     assert payment.transaction_id == transaction_id
+
+
+def test_provider_creates_independent_schema_objects(tmp_path) -> None:
+    prov = CyberSourceProvider(
+        merchant_id=MERCHANT_ID, password=PASSWORD, wsdl_cache_dir=str(tmp_path)
+    )
+    card = prov._create("data:Card")
+    card.fullName = "John Doe"
+    item = prov._create("data:Item")
+    item._id = 1
+
+    assert prov._create("data:Card").fullName is None
+    assert str(prov._create("data:Item")) == str(
+        prov.client.factory.create("data:Item")
+    )
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # A second provider loads the parsed schema from the cache directory.
+    cached = CyberSourceProvider(
+        merchant_id=MERCHANT_ID, password=PASSWORD, wsdl_cache_dir=str(tmp_path)
+    )
+    assert str(cached._create("data:Card")) == str(prov._create("data:Card"))
@@ -9,6 +9,7 @@ from django.http import HttpResponseForbidden
 from payments.core import BasicProvider
 
 from .forms import ProcessPaymentForm
+from .forms import verify_signature
 
 CENTS = Decimal("0.01")
 
@@ -96,9 +97,11 @@ class DotpayProvider(BasicProvider):
         return data
 
     def process_data(self, payment, request):
-        form = ProcessPaymentForm(
-            payment=payment, pin=self.pin, data=request.POST or None
-        )
+        data = request.POST
+        # Reject forged or garbled callbacks before doing any other work.
+        if not verify_signature(self.pin, data):
+            return HttpResponseForbidden("FAILED")
+        form = ProcessPaymentForm(payment=payment, pin=self.pin, data=data)
         if not form.is_valid():
             return HttpResponseForbidden("FAILED")
         form.save()
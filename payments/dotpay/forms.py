@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import hashlib
+import hmac
 
 from django import forms
 
@@ -13,6 +14,54 @@ REJECTED = "rejected"
 PROCESSING_REALIZATION_WAITING = "processing_realization_waiting"
 PROCESSING_REALIZATION = "processing_realization"
 
+#: Fields of a URLC callback that are signed, in the order they are hashed
+#: (after the PIN).
+SIGNED_FIELDS = (
+    "id",
+    "operation_number",
+    "operation_type",
+    "operation_status",
+    "operation_amount",
+    "operation_currency",
+    "operation_withdrawal_amount",
+    "operation_commission_amount",
+    "is_completed",
+    "operation_original_amount",
+    "operation_original_currency",
+    "operation_datetime",
+    "operation_related_number",
+    "control",
+    "description",
+    "email",
+    "p_info",
+    "p_email",
+    "credit_card_issuer_identification_number",
+    "credit_card_masked_number",
+    "credit_card_brand_codename",
+    "credit_card_brand_code",
+    "credit_card_id",
+    "channel",
+    "channel_country",
+    "geoip_country",
+)
+
+
+def get_signature(pin: str, data) -> str:
+    """Return the SHA-256 signature of the callback fields in ``data``."""
+    key = pin + "".join(data.get(field) or "" for field in SIGNED_FIELDS)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def verify_signature(pin: str, data) -> bool:
+    """Check the ``signature`` of a URLC callback in constant time.
+
+    :param data: The callback's POST data, or any mapping of its fields.
+    """
+    signature = data.get("signature") or ""
+    return hmac.compare_digest(
+        get_signature(pin, data).encode("ascii"), signature.encode("utf-8")
+    )
+
 
 class ProcessPaymentForm(forms.Form):
     id = forms.CharField(required=False)
@@ -51,40 +100,7 @@ class ProcessPaymentForm(forms.Form):
     def clean(self):
         cleaned_data = super().clean()
         if not self.errors:
-            key_vars = (
-                self.pin,
-                cleaned_data.get("id", ""),
-                cleaned_data.get("operation_number", ""),
-                cleaned_data.get("operation_type", ""),
-                cleaned_data.get("operation_status", ""),
-                cleaned_data.get("operation_amount", ""),
-                cleaned_data.get("operation_currency", ""),
-                cleaned_data.get("operation_withdrawal_amount", ""),
-                cleaned_data.get("operation_commission_amount", ""),
-                cleaned_data.get("is_completed", ""),
-                cleaned_data.get("operation_original_amount", ""),
-                cleaned_data.get("operation_original_currency", ""),
-                cleaned_data.get("operation_datetime", ""),
-                cleaned_data.get("operation_related_number", ""),
-                cleaned_data.get("control", ""),
-                cleaned_data.get("description", ""),
-                cleaned_data.get("email", ""),
-                cleaned_data.get("p_info", ""),
-                cleaned_data.get("p_email", ""),
-                cleaned_data.get("credit_card_issuer_identification_number", ""),
-                cleaned_data.get("credit_card_masked_number", ""),
-                cleaned_data.get("credit_card_brand_codename", ""),
-                cleaned_data.get("credit_card_brand_code", ""),
-                cleaned_data.get("credit_card_id", ""),
-                cleaned_data.get("channel", ""),
-                cleaned_data.get("channel_country", ""),
-                cleaned_data.get("geoip_country", ""),
-            )
-            key = "".join(key_vars)
-            sha256 = hashlib.sha256()
-            sha256.update(key.encode("utf-8"))
-            key_hash = sha256.hexdigest()
-            if key_hash != self.cleaned_data["signature"]:
+            if not verify_signature(self.pin, cleaned_data):
                 self._errors["signature"] = self.error_class(["Bad hash"])
             if int(cleaned_data["control"]) != self.payment.id:
                 self._errors["control"] = self.error_class(["Bad payment id"])
@@ -3,6 +3,7 @@ from __future__ import annotations
 import hashlib
 from unittest.mock import MagicMock
 from unittest.mock import Mock
+from unittest.mock import patch
 
 import pytest
 from django.http import HttpResponse
@@ -13,6 +14,7 @@ from payments import PaymentStatus
 from . import DotpayProvider
 from .forms import COMPLETED
 from .forms import REJECTED
+from .forms import verify_signature
 
 VARIANT = "dotpay"
 PIN = "123"
@@ -135,6 +137,28 @@ def test_incorrect_process_data(payment: Payment) -> None:
     assert isinstance(response, HttpResponseForbidden)
 
 
+@pytest.mark.parametrize("signature", ["", "0" * 64, "ż" * 64])
+def test_bad_signature_is_rejected_before_form(
+    payment: Payment, signature: str
+) -> None:
+    request = MagicMock()
+    request.POST = {**get_post_with_sha256(PROCESS_POST), "signature": signature}
+    provider = DotpayProvider(seller_id="123", pin=PIN)
+    with patch("payments.dotpay.ProcessPaymentForm") as form:
+        response = provider.process_data(payment, request)
+    assert isinstance(response, HttpResponseForbidden)
+    form.assert_not_called()
+    assert payment.status == PaymentStatus.WAITING
+
+
+def test_verify_signature() -> None:
+    post = get_post_with_sha256(PROCESS_POST)
+    assert verify_signature(PIN, post)
+    assert not verify_signature("456", post)
+    assert not verify_signature(PIN, {**post, "operation_amount": "1.00"})
+    assert not verify_signature(PIN, {**post, "operation_commission_amount": "1"})
+
+
 def test_uses_channel_groups_when_set(payment: Payment) -> None:
     channel_groups = "K,T"
     provider = DotpayProvider(
@@ -8,7 +8,7 @@ from django import forms
 from django.core import validators
 from django.utils.translation import gettext_lazy as _
 
-from .core import CARD_TYPES
+from .cards import get_card_issuer_index
 from .core import get_credit_card_issuer
 from .utils import get_month_choices
 from .utils import get_year_choices
@@ -42,7 +42,7 @@ class CreditCardNumberField(forms.CharField):
         if value and not self.cart_number_checksum_validation(self, value):
             raise forms.ValidationError(self.error_messages["invalid"])
         if value and self.valid_types is not None and card_type not in self.valid_types:
-            card_type_names = {ct: name for _, ct, name in CARD_TYPES}
+            card_type_names = get_card_issuer_index().names
             valid_type_names = [card_type_names.get(t, t) for t in self.valid_types]
             error_message = self.error_messages["invalid_type"] % {
                 "valid_types": ", ".join(valid_type_names)
@@ -0,0 +1,18 @@
+"""
+Deferred processing of webhooks.
+
+When this app is installed and ``PAYMENT_WEBHOOK_DEFERRED`` is enabled, the
+static callback view only verifies and stores incoming webhooks, and responds
+with ``202 Accepted``. They are processed later by the
+``payments_process_webhooks`` command or by ``PAYMENT_WEBHOOK_EXECUTOR``.
+"""
+
+from __future__ import annotations
+
+from django.apps import apps as django_apps
+from django.conf import settings
+
+
+def inbox_enabled() -> bool:
+    enabled = getattr(settings, "PAYMENT_WEBHOOK_DEFERRED", False)
+    return enabled and django_apps.is_installed("payments.inbox")
@@ -0,0 +1,9 @@
+from __future__ import annotations
+
+from django.apps import AppConfig
+
+
+class InboxConfig(AppConfig):
+    name = "payments.inbox"
+    label = "payments_inbox"
+    default_auto_field = "django.db.models.BigAutoField"
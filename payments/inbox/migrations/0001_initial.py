@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-16 12:00
+from __future__ import annotations
+
+import django.utils.timezone
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("variant", models.CharField(max_length=255)),
+                ("token", models.CharField(db_index=True, max_length=36)),
+                ("received", models.DateTimeField(auto_now_add=True)),
+                ("method", models.CharField(max_length=10)),
+                ("path", models.TextField()),
+                ("query_string", models.TextField(blank=True, default="")),
+                ("meta", models.JSONField(default=dict)),
+                ("body", models.BinaryField()),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                (
+                    "next_attempt",
+                    models.DateTimeField(default=django.utils.timezone.now, null=True),
+                ),
+                ("last_error", models.TextField(blank=True, default="")),
+            ],
+            options={
+                "ordering": ["pk"],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:30
+from __future__ import annotations
+
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payments_inbox", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="webhookevent",
+            name="verified",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import models
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from payments.utils import is_webhook_verified
+from payments.utils import mark_webhook_verified
+
+if TYPE_CHECKING:
+    from django.http import HttpRequest
+
+#: Request metadata that is kept along with the webhook body. Other headers,
+#: such as ``Cookie`` or ``Authorization``, are not stored; list any that a
+#: custom provider needs in ``PAYMENT_WEBHOOK_STORED_HEADERS``.
+STORED_META = (
+    "CONTENT_TYPE",
+    "CONTENT_LENGTH",
+    "REMOTE_ADDR",
+    "HTTP_HOST",
+    "HTTP_USER_AGENT",
+    "HTTP_STRIPE_SIGNATURE",
+)
+
+
+def _get_stored_meta() -> set[str]:
+    extra = getattr(settings, "PAYMENT_WEBHOOK_STORED_HEADERS", ())
+    return {*STORED_META, *(f"HTTP_{header}" for header in extra)}
+
+
+class WebhookEvent(models.Model):
+    """A webhook waiting to be processed."""
+
+    variant = models.CharField(max_length=255)
+    #: Token of the payment the webhook is meant for
+    token = models.CharField(max_length=36, db_index=True)
+    received = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    query_string = models.TextField(blank=True, default="")
+    meta = models.JSONField(default=dict)
+    body = models.BinaryField()
+    attempts = models.PositiveIntegerField(default=0)
+    #: When to process the event next; ``None`` once it has been given up on
+    next_attempt = models.DateTimeField(default=timezone.now, null=True)
+    last_error = models.TextField(blank=True, default="")
+    #: Whether the provider verified the webhook's signature when it arrived
+    verified = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ["pk"]
+
+    def __str__(self) -> str:
+        return f"{self.variant}:{self.token} #{self.pk}"
+
+    @classmethod
+    def store(cls, request: HttpRequest, variant: str, token: str) -> WebhookEvent:
+        """Store a webhook and hand it to ``PAYMENT_WEBHOOK_EXECUTOR`` on commit.
+
+        The provider is expected to have verified the webhook while extracting
+        its token; see :func:`payments.utils.mark_webhook_verified`.
+        """
+        stored_meta = _get_stored_meta()
+        event = cls.objects.create(
+            variant=variant,
+            token=token,
+            method=request.method,
+            path=request.path,
+            query_string=request.META.get("QUERY_STRING", ""),
+            meta={
+                key: value for key, value in request.META.items() if key in stored_meta
+            },
+            body=request.body,
+            verified=is_webhook_verified(request),
+        )
+        executor = getattr(settings, "PAYMENT_WEBHOOK_EXECUTOR", None)
+        if executor:
+            executor = import_string(executor)
+            transaction.on_commit(lambda: executor(event))
+        return event
+
+    def as_request(self) -> HttpRequest:
+        """Rebuild the request the webhook was received with.
+
+        Like incoming requests, ``POST`` and ``FILES`` are parsed from the body
+        on first access, according to the stored ``CONTENT_TYPE``.
+        """
+        body = bytes(self.body)
+        request = WSGIRequest(
+            {
+                **self.meta,
+                "REQUEST_METHOD": self.method,
+                # The path is set as received below, rather than decoded again.
+                "SCRIPT_NAME": "",
+                "PATH_INFO": "/",
+                "QUERY_STRING": self.query_string,
+                "CONTENT_LENGTH": str(len(body)),
+                "wsgi.input": BytesIO(body),
+            }
+        )
+        request.path = request.path_info = self.path
+        if self.verified:
+            mark_webhook_verified(request)
+        return request
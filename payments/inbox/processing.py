@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+
+from django.http import Http404
+from django.utils import timezone
+
+from payments.core import provider_factory
+from payments.urls import process_data
+
+from .models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+#: How long a worker may take to process an event before it is tried again.
+LEASE = timedelta(minutes=5)
+
+#: Longest delay between two attempts to process an event.
+MAX_RETRY_DELAY = timedelta(hours=1)
+
+#: Number of attempts after which an event is given up on.
+MAX_ATTEMPTS = 10
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return min(timedelta(seconds=30 * 2 ** (attempts - 1)), MAX_RETRY_DELAY)
+
+
+def process_webhook_events(
+    limit: int = 100,
+    token: str | None = None,
+) -> tuple[int, int]:
+    """Process stored webhooks, oldest first.
+
+    The webhooks of each payment are processed in order: while one of them is
+    being processed or waits to be retried, later ones for the same payment are
+    held back. Several workers may run at once.
+
+    :param token: Only process webhooks for the payment with this token.
+    :returns: the number of processed and of failed webhooks.
+    """
+    now = timezone.now()
+    events = WebhookEvent.objects.exclude(next_attempt=None)
+    if token is not None:
+        events = events.filter(token=token)
+    blocked: set[str] = set()
+    processed = failed = 0
+    last_pk = 0
+    while processed + failed < limit:
+        batch = list(events.filter(pk__gt=last_pk)[:limit])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        for event in batch:
+            if processed + failed >= limit:
+                break
+            if event.token in blocked:
+                continue
+            if (
+                event.next_attempt is None
+                or event.next_attempt > now
+                or not _claim(event, now)
+            ):
+                blocked.add(event.token)
+                continue
+            if _process(event, now):
+                processed += 1
+            else:
+                blocked.add(event.token)
+                failed += 1
+    return processed, failed
+
+
+def _claim(event: WebhookEvent, now) -> bool:
+    # Only one worker can move the event's next attempt past its lease.
+    lease = now + LEASE
+    claimed = WebhookEvent.objects.filter(
+        pk=event.pk, next_attempt=event.next_attempt
+    ).update(next_attempt=lease)
+    event.next_attempt = lease
+    return bool(claimed)
+
+
+def _process(event: WebhookEvent, now) -> bool:
+    try:
+        provider = provider_factory(event.variant)
+        response = process_data(event.as_request(), event.token, provider)
+    except Http404:
+        logger.warning("Dropping webhook %s for a missing payment", event)
+        event.delete()
+        return True
+    except Exception as e:
+        logger.exception("Could not process webhook %s", event)
+        error = repr(e)
+    else:
+        if response.status_code < 500:
+            if response.status_code >= 400:
+                logger.warning(
+                    "Webhook %s was rejected with status %s",
+                    event,
+                    response.status_code,
+                )
+            event.delete()
+            return True
+        error = f"HTTP {response.status_code}"
+
+    event.attempts += 1
+    event.last_error = error
+    if event.attempts >= MAX_ATTEMPTS:
+        logger.error("Giving up on webhook %s", event)
+        event.next_attempt = None
+    else:
+        event.next_attempt = now + retry_delay(event.attempts)
+    event.save(update_fields=["attempts", "last_error", "next_attempt"])
+    return False
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import json
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import Mock
+from unittest.mock import patch
+
+import pytest
+import stripe
+from django.core.management import CommandError
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test.client import MULTIPART_CONTENT
+from django.utils import timezone
+
+from payments.stripe import StripeProviderV3
+from payments.test_core import Payment
+
+from .models import WebhookEvent
+from .processing import process_webhook_events
+
+executed: list[int] = []
+
+
+def executor(event: WebhookEvent) -> None:
+    executed.append(event.pk)
+
+
+@pytest.fixture
+def deferred(settings):
+    settings.PAYMENT_WEBHOOK_DEFERRED = True
+    provider = Mock()
+    provider.get_token_from_request.side_effect = lambda request, payment: request.GET[
+        "token"
+    ]
+    with (
+        patch("payments.urls.provider_factory", return_value=provider),
+        patch("payments.inbox.processing.provider_factory", return_value=provider),
+        patch("payments.inbox.processing.process_data") as process_data,
+    ):
+        yield process_data
+
+
+def post(client, token, body=b'{"event": 1}', **headers):
+    return client.post(
+        f"/payments/process/dummy/?token={token}",
+        body,
+        content_type="application/json",
+        HTTP_STRIPE_SIGNATURE="signature",
+        **headers,
+    )
+
+
+@pytest.mark.django_db
+def test_webhook_is_stored_and_accepted(client, deferred) -> None:
+    response = post(client, "token1")
+    assert response.status_code == 202
+    deferred.assert_not_called()
+
+    deferred.return_value = HttpResponse("OK")
+    assert process_webhook_events() == (1, 0)
+    ((request, token, _provider), _) = deferred.call_args
+    assert token == "token1"
+    assert request.method == "POST"
+    assert request.body == b'{"event": 1}'
+    assert request.headers["Stripe-Signature"] == "signature"
+    assert request.GET["token"] == "token1"
+    assert not WebhookEvent.objects.exists()
+
+
+@pytest.mark.django_db
+def test_failed_webhook_holds_back_later_ones(client, deferred) -> None:
+    post(client, "token1", b"first")
+    post(client, "token2", b"other")
+    post(client, "token1", b"second")
+
+    bodies = []
+
+    def process(request, token, provider):
+        bodies.append(request.body)
+        if request.body == b"first" and len(bodies) == 1:
+            return HttpResponse(status=503)
+        return HttpResponse("OK")
+
+    deferred.side_effect = process
+    assert process_webhook_events() == (1, 1)
+    first, second = WebhookEvent.objects.all()
+    assert first.attempts == 1
+    assert first.last_error == "HTTP 503"
+    assert first.next_attempt is not None
+    assert second.attempts == 0
+
+    # Neither is processed before the first one is due again.
+    assert process_webhook_events() == (0, 0)
+    WebhookEvent.objects.update(next_attempt=timezone.now() - timedelta(seconds=1))
+    assert process_webhook_events() == (2, 0)
+    assert bodies == [b"first", b"other", b"first", b"second"]
+
+
+@pytest.mark.django_db
+def test_executor_is_called_on_commit(
+    client,
+    deferred,
+    settings,
+    django_capture_on_commit_callbacks,
+) -> None:
+    settings.PAYMENT_WEBHOOK_EXECUTOR = "payments.inbox.test_inbox.executor"
+    executed.clear()
+    with django_capture_on_commit_callbacks(execute=True):
+        post(client, "token1")
+    assert executed == [WebhookEvent.objects.get().pk]
+
+
+@pytest.mark.django_db
+def test_only_listed_headers_are_stored(client, deferred, settings) -> None:
+    settings.PAYMENT_WEBHOOK_STORED_HEADERS = ["X_GATEWAY_SIGNATURE"]
+    post(
+        client,
+        "token1",
+        HTTP_COOKIE="sessionid=secret",
+        HTTP_AUTHORIZATION="Bearer secret",
+        HTTP_X_GATEWAY_SIGNATURE="gateway",
+    )
+    meta = WebhookEvent.objects.get().meta
+    assert meta["HTTP_STRIPE_SIGNATURE"] == "signature"
+    assert meta["HTTP_X_GATEWAY_SIGNATURE"] == "gateway"
+    assert meta["CONTENT_TYPE"] == "application/json"
+    assert "HTTP_COOKIE" not in meta
+    assert "HTTP_AUTHORIZATION" not in meta
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    ("body", "content_type"),
+    [
+        ("status=OK&amount=10.00", "application/x-www-form-urlencoded"),
+        ({"status": "OK", "amount": "10.00"}, MULTIPART_CONTENT),
+    ],
+)
+def test_form_webhook_is_processed_with_its_data(
+    client, deferred, body, content_type
+) -> None:
+    response = client.post(
+        "/payments/process/dummy/?token=token1", body, content_type=content_type
+    )
+    assert response.status_code == 202
+    posted = []
+
+    def process_data(request, token, provider):
+        posted.append((request.path, request.GET.dict(), request.POST.dict()))
+        return HttpResponse("OK")
+
+    deferred.side_effect = process_data
+    assert process_webhook_events() == (1, 0)
+    assert posted == [
+        (
+            "/payments/process/dummy/",
+            {"token": "token1"},
+            {"status": "OK", "amount": "10.00"},
+        )
+    ]
+
+
+@pytest.mark.django_db
+def test_verified_stripe_webhook_is_processed_late(client, settings) -> None:
+    settings.PAYMENT_WEBHOOK_DEFERRED = True
+    secret = "whsec_test"
+    provider = StripeProviderV3(api_key="sk_test", endpoint_secret=secret)
+    payment = Payment.objects.create(variant="stripe")
+    body = json.dumps(
+        {
+            "id": "evt_1",
+            "type": "checkout.session.completed",
+            "data": {"object": {"client_reference_id": payment.token}},
+        }
+    )
+    timestamp = int(time.time())
+    signature = stripe.WebhookSignature._compute_signature(
+        f"{timestamp}.{body}", secret
+    )
+    events = []
+
+    def process_data(payment, request):
+        events.append(provider.return_event_payload(request)["id"])
+        return HttpResponse("OK")
+
+    with (
+        patch("payments.urls.provider_factory", return_value=provider),
+        patch("payments.urls.get_payment_model", return_value=Payment),
+        patch("payments.inbox.processing.provider_factory", return_value=provider),
+        patch.object(provider, "process_data", side_effect=process_data),
+    ):
+        response = client.post(
+            "/payments/process/stripe/",
+            body,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=f"t={timestamp},v1={signature}",
+        )
+        assert response.status_code == 202
+        assert WebhookEvent.objects.get().verified
+
+        # Processed an hour later, past Stripe's five minute tolerance.
+        with patch("stripe._webhook.time.time", return_value=timestamp + 3600):
+            assert process_webhook_events() == (1, 0)
+    assert events == ["evt_1"]
+
+
+@pytest.mark.django_db
+def test_process_webhooks_command(client, deferred) -> None:
+    post(client, "token1")
+    deferred.return_value = HttpResponse("OK")
+    out = StringIO()
+    call_command("payments_process_webhooks", stdout=out)
+    assert out.getvalue() == "Processed 1 webhooks, 0 failed.\n"
+    assert not WebhookEvent.objects.exists()
+
+    out = StringIO()
+    call_command("payments_process_webhooks", stdout=out)
+    assert out.getvalue() == ""
+
+
+@pytest.mark.django_db
+def test_process_webhooks_command_keeps_running(client, deferred) -> None:
+    post(client, "token1")
+    deferred.return_value = HttpResponse("OK")
+    with (
+        patch("time.sleep", side_effect=[None, KeyboardInterrupt]) as sleep,
+        pytest.raises(KeyboardInterrupt),
+    ):
+        call_command("payments_process_webhooks", "--interval", "5", stdout=StringIO())
+    assert sleep.call_count == 2
+    sleep.assert_called_with(5.0)
+    assert not WebhookEvent.objects.exists()
+
+
+def test_process_webhooks_command_requires_inbox(settings) -> None:
+    settings.PAYMENT_WEBHOOK_DEFERRED = False
+    with pytest.raises(CommandError, match="PAYMENT_WEBHOOK_DEFERRED"):
+        call_command("payments_process_webhooks")
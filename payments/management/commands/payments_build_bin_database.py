@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import csv
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from payments.cards import write_bin_database
+
+FIELDS = ("country", "funding", "level", "bank")
+
+
+class Command(BaseCommand):
+    help = (
+        "Build a BIN database for PAYMENT_BIN_DATABASE from a CSV file with "
+        "start, end, country, funding, level and bank columns."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="CSV file of IIN ranges.")
+        parser.add_argument("output", help="Path of the database to write.")
+        parser.add_argument(
+            "--width",
+            type=int,
+            default=8,
+            help="Number of leading digits of card numbers to compare.",
+        )
+
+    def handle(self, *args, source, output, width, **options):
+        with open(source, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            if "start" not in (reader.fieldnames or ()):
+                raise CommandError(f"{source} has no 'start' column")
+            ranges = (
+                (
+                    row["start"],
+                    row.get("end") or row["start"],
+                    *(row.get(field) or "" for field in FIELDS),
+                )
+                for row in reader
+            )
+            try:
+                count = write_bin_database(output, ranges, width=width)
+            except ValueError as e:
+                raise CommandError(str(e)) from e
+        self.stdout.write(f"Wrote {count} ranges to {output}")
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from payments.outbox import outbox_enabled
+
+
+class Command(BaseCommand):
+    help = "Send status_changed for status changes recorded in the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=100,
+            help="Maximum number of status changes to send per run.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Keep running, waiting this many seconds between runs.",
+        )
+
+    def handle(self, *args, limit, interval, **options):
+        if not outbox_enabled():
+            raise CommandError(
+                "Add payments.outbox to INSTALLED_APPS and set PAYMENT_STATUS_OUTBOX."
+            )
+        from payments.outbox.dispatch import dispatch_status_changes
+
+        while True:
+            sent, failed = dispatch_status_changes(limit)
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} status changes, {failed} failed.")
+            if interval is None:
+                break
+            if sent < limit:
+                time.sleep(interval)
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from payments.inbox import inbox_enabled
+
+
+class Command(BaseCommand):
+    help = "Process webhooks stored by the deferred webhook mode."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=100,
+            help="Maximum number of webhooks to process per run.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Keep running, waiting this many seconds between runs.",
+        )
+
+    def handle(self, *args, limit, interval, **options):
+        if not inbox_enabled():
+            raise CommandError(
+                "Add payments.inbox to INSTALLED_APPS and set PAYMENT_WEBHOOK_DEFERRED."
+            )
+        from payments.inbox.processing import process_webhook_events
+
+        while True:
+            processed, failed = process_webhook_events(limit)
+            if processed or failed:
+                self.stdout.write(f"Processed {processed} webhooks, {failed} failed.")
+            if interval is None:
+                break
+            if processed < limit:
+                time.sleep(interval)
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from payments.reconcile import reconcile_payments
+
+
+class Command(BaseCommand):
+    help = "Poll gateways for waiting payments and save status changes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "variants",
+            nargs="*",
+            help="Variants to reconcile. Defaults to all of them.",
+        )
+        parser.add_argument(
+            "--older-than",
+            type=float,
+            default=None,
+            help="Skip payments modified less than this many seconds ago.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of gateway requests to make at once.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Keep running, waiting this many seconds between runs.",
+        )
+
+    def handle(self, *args, variants, older_than, workers, interval, **options):
+        while True:
+            updated = reconcile_payments(
+                variants=variants or None,
+                older_than=None
+                if older_than is None
+                else timedelta(seconds=older_than),
+                max_workers=workers,
+            )
+            for variant, count in sorted(updated.items()):
+                self.stdout.write(f"{variant}: updated {count} payments")
+            if interval is None:
+                break
+            time.sleep(interval)
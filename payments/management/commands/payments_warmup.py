@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from payments.core import provider_registry
+
+
+class Command(BaseCommand):
+    help = (
+        "Build payment providers and report how long each one took. This is a "
+        "diagnostic: providers are only cached in this command's own process, "
+        "not in running server workers (see PAYMENT_PRELOAD_VARIANTS)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "variants",
+            nargs="*",
+            help="Variants to build. Defaults to all of PAYMENT_VARIANTS.",
+        )
+
+    def handle(self, *args, variants, **options):
+        variants = variants or provider_registry.variants()
+        failed = []
+        for variant in variants:
+            try:
+                timings = provider_registry.warm_up([variant])
+            except (ImportError, ImproperlyConfigured, TypeError, ValueError) as e:
+                failed.append(variant)
+                self.stderr.write(f"{variant}: {type(e).__name__}: {e}")
+            else:
+                self.stdout.write(f"{variant}: {timings[variant] * 1000:.1f} ms")
+        if failed:
+            raise CommandError(f"Could not build variants: {', '.join(failed)}")
@@ -3,6 +3,8 @@ from __future__ import annotations
 import json
 import logging
 import re
+import time
+from datetime import timedelta
 from typing import TYPE_CHECKING
 from typing import NoReturn
 from uuid import uuid4
@@ -10,12 +12,14 @@ from uuid import uuid4
 from django.http import HttpRequest
 from django.http import HttpResponse
 from django.shortcuts import redirect
+from django.utils import timezone
 from mercadopago import SDK
 
 from payments import PaymentError
 from payments import PaymentStatus
 from payments import RedirectNeeded
 from payments.core import BasicProvider
+from payments.core import StatusUpdate
 
 if TYPE_CHECKING:
     from payments.models import BasePayment
@@ -34,6 +38,16 @@ STATUS_MAP = {
     "charged_back": PaymentStatus.REFUNDED,
 }
 
+#: Number of results per payment search request.
+SEARCH_PAGE_SIZE = 100
+#: Payments created longer ago than this, in seconds, are searched for one by
+#: one rather than among all recent payments.
+SEARCH_WINDOW = 24 * 60 * 60
+#: Batches with fewer recent payments are searched for one by one.
+SEARCH_MIN_PAYMENTS = 5
+#: Maximum number of result pages searched for a batch.
+SEARCH_MAX_PAGES = 10
+
 
 class MercadoPagoProvider(BasicProvider):
     """This backend implements payments using `MercadoPago <https://www.mercadopago.com.ar/>`_.
@@ -42,18 +56,35 @@ class MercadoPagoProvider(BasicProvider):
 
         pip install "django-payments[mercadopago]"
 
+    The checkout URLs of each payment's preference are stored in its ``attrs``,
+    so rendering the payment form again redirects without calling MercadoPago.
+    They are fetched again once they are older than ``preference_ttl``.
+
     :param access_token: The access token provided by MP.
     :param sandbox: Whether to use sandbox mode.
+    :param preference_ttl: Seconds after which stored checkout URLs are
+        refreshed from the preference. ``None`` means never.
     """
 
-    def __init__(self, access_token: str, sandbox: bool) -> None:
+    def __init__(
+        self,
+        access_token: str,
+        sandbox: bool,
+        preference_ttl: float | None = 3600,
+    ) -> None:
         self.client = SDK(access_token)
         self.is_sandbox = sandbox
+        self.preference_ttl = preference_ttl
 
     def get_or_create_preference(self, payment: BasePayment):
+        """Fetch the preference for a payment, creating it if it has none.
+
+        :returns: A ``(preference, created)`` tuple, where ``created`` tells
+            whether the preference was just created (and stored).
+        """
         if payment.transaction_id:
-            return self.get_preference(payment)
-        return self.create_preference(payment)
+            return self.get_preference(payment), False
+        return self.create_preference(payment), True
 
     def get_preference(self, payment: BasePayment):
         """Fetch the preference for a payment."""
@@ -117,14 +148,47 @@ class MercadoPagoProvider(BasicProvider):
             )
 
         payment.transaction_id = result["response"]["id"]
+        self._store_init_points(payment, result["response"])
         payment.save()
 
         return result["response"]
 
+    def _get_init_point_key(self) -> str:
+        return "sandbox_init_point" if self.is_sandbox else "init_point"
+
+    def _get_stored_init_point(self, payment: BasePayment) -> str | None:
+        """Return the stored checkout URL of the payment, unless it is stale."""
+        stored = getattr(payment.attrs, "mercadopago_init_points", None)
+        if not stored or stored.get("preference_id") != payment.transaction_id:
+            return None
+        age = time.time() - stored["fetched_at"]
+        if self.preference_ttl is not None and age >= self.preference_ttl:
+            return None
+        return stored.get(self._get_init_point_key())
+
+    def _store_init_points(self, payment: BasePayment, preference) -> None:
+        payment.attrs.mercadopago_init_points = {
+            "preference_id": payment.transaction_id,
+            "init_point": preference.get("init_point"),
+            "sandbox_init_point": preference.get("sandbox_init_point"),
+            "fetched_at": time.time(),
+        }
+
     def get_action(self, payment: BasePayment):
         # MercadoPago does not use form actions
         raise NotImplementedError
 
+    def get_webhook_event_id(self, request: HttpRequest) -> str | None:
+        # IPN notifications only name the resource that changed, and the same
+        # notification is sent again for each change; always process those.
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return ""
+        if isinstance(data, dict) and data.get("id") and data.get("action"):
+            return str(data["id"])
+        return ""
+
     def process_notification(self, payment: BasePayment, request: HttpRequest):
         data = json.loads(request.body)
 
@@ -187,13 +251,15 @@ class MercadoPagoProvider(BasicProvider):
         return None
 
     def get_form(self, payment: BasePayment, data=None) -> NoReturn:
-        preference = self.get_or_create_preference(payment)
-        logger.debug("Got preference: %s", preference)
-
-        if self.is_sandbox:
-            url = preference["sandbox_init_point"]
-        else:
-            url = preference["init_point"]
+        url = self._get_stored_init_point(payment)
+        if url is None:
+            preference, created = self.get_or_create_preference(payment)
+            logger.debug("Got preference: %s", preference)
+            if not created:
+                # create_preference() already stored and saved the URLs.
+                self._store_init_points(payment, preference)
+                payment.save()
+            url = preference[self._get_init_point_key()]
 
         raise RedirectNeeded(url)
 
@@ -216,3 +282,90 @@ class MercadoPagoProvider(BasicProvider):
 
         if data["results"]:
             self.process_collection(payment, data["results"][-1]["id"])
+
+    def poll_statuses(self, payments):
+        """Find the payments in MercadoPago's payment search.
+
+        Recent payments are found among all payments created since the oldest
+        of them, newest first and 100 per request. Older payments, those of
+        batches with few recent payments, and those not found within
+        :data:`SEARCH_MAX_PAGES` pages are searched for one by one.
+        """
+        references = {
+            payment.attrs.external_reference: payment
+            for payment in payments
+            if getattr(payment.attrs, "external_reference", None)
+        }
+        if not references:
+            return {}
+        updates = {}
+        now = timezone.now()
+        recent = {
+            reference: payment
+            for reference, payment in references.items()
+            if payment.created >= now - timedelta(seconds=SEARCH_WINDOW)
+        }
+        if len(recent) >= SEARCH_MIN_PAYMENTS:
+            for reference in self._search_payments(recent, now, updates):
+                del references[reference]
+        for reference, payment in references.items():
+            results = self._search(
+                {
+                    "external_reference": reference,
+                    "sort": "date_created",
+                    "criteria": "desc",
+                    "limit": 1,
+                }
+            )["results"]
+            if results:
+                self._add_status_update(updates, payment, results[0])
+        return updates
+
+    def _search_payments(self, payments, until, updates) -> set:
+        """Search for ``payments`` among all recent ones, adding status updates.
+
+        :returns: References that need not be searched for one by one: those
+            found and, if the search was exhausted, those that don't exist.
+        """
+        since = min(payment.created for payment in payments.values())
+        found = set()
+        offset = 0
+        pages = 1
+        while True:
+            results = self._search(
+                {
+                    "sort": "date_created",
+                    "criteria": "desc",
+                    "range": "date_created",
+                    "begin_date": since.isoformat(timespec="milliseconds"),
+                    "end_date": until.isoformat(timespec="milliseconds"),
+                    "limit": SEARCH_PAGE_SIZE,
+                    "offset": offset,
+                }
+            )["results"]
+            for data in results:
+                # Results are newest first, so the latest attempt wins.
+                reference = data.get("external_reference")
+                if reference in payments and reference not in found:
+                    found.add(reference)
+                    self._add_status_update(updates, payments[reference], data)
+            if len(results) < SEARCH_PAGE_SIZE:
+                return set(payments)
+            if len(found) == len(payments) or pages == SEARCH_MAX_PAGES:
+                return found
+            offset += len(results)
+            pages += 1
+
+    def _search(self, filters: dict) -> dict:
+        result = self.client.payment().search(filters)
+        if result["status"] >= 300:
+            raise PaymentError(
+                message="Failed to search MercadoPago payments.",
+                code=result["status"],
+                gateway_message=result["response"],
+            )
+        return result["response"]
+
+    def _add_status_update(self, updates, payment, data) -> None:
+        if data["status"] in STATUS_MAP:
+            updates[payment.pk] = StatusUpdate(STATUS_MAP[data["status"]])
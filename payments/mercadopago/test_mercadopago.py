@@ -1,16 +1,22 @@
 from __future__ import annotations
 
+from datetime import timedelta
+from types import SimpleNamespace
 from typing import TYPE_CHECKING
 from unittest.mock import Mock
 from unittest.mock import call
 from unittest.mock import patch
 
 import pytest
+from django.utils import timezone as django_timezone
 
 from payments import PaymentError
 from payments import PaymentStatus
 from payments import PurchasedItem
 from payments import RedirectNeeded
+from payments.core import StatusUpdate
+from payments.mercadopago import SEARCH_MAX_PAGES
+from payments.mercadopago import SEARCH_PAGE_SIZE
 from payments.mercadopago import MercadoPagoProvider
 
 if TYPE_CHECKING:
@@ -431,6 +437,117 @@ def test_get_form_for_inexistent_preference(mp_provider: MercadoPagoProvider) ->
     assert str(exc_info.value) == "https://example.com/pay"
 
 
+def test_get_form_reuses_created_preference(mp_provider: MercadoPagoProvider) -> None:
+    payment = Payment()
+    payment.attrs = SimpleNamespace()
+    with (
+        patch(
+            "mercadopago.resources.preference.Preference.create",
+            spec=True,
+            return_value={
+                "status": 201,
+                "response": {
+                    "id": "AZ12",
+                    "init_point": "https://example.com/live",
+                    "sandbox_init_point": "https://example.com/pay",
+                },
+            },
+        ) as create_preference,
+        patch(
+            "mercadopago.resources.preference.Preference.get", spec=True
+        ) as get_preference,
+    ):
+        for _i in range(2):
+            with pytest.raises(RedirectNeeded) as exc_info:
+                mp_provider.get_form(payment)
+            assert str(exc_info.value) == "https://example.com/pay"
+
+    assert create_preference.call_count == 1
+    assert get_preference.call_count == 0
+    assert payment.save.call_count == 1
+    assert payment.attrs.mercadopago_init_points["preference_id"] == "AZ12"
+
+
+def test_get_form_saves_created_preference_once(
+    mp_provider: MercadoPagoProvider,
+) -> None:
+    mp_provider.preference_ttl = 0
+    payment = Payment()
+    payment.attrs = SimpleNamespace()
+    with (
+        patch(
+            "mercadopago.resources.preference.Preference.create",
+            spec=True,
+            return_value={
+                "status": 201,
+                "response": {
+                    "id": "AZ12",
+                    "sandbox_init_point": "https://example.com/pay",
+                },
+            },
+        ) as create_preference,
+        patch(
+            "mercadopago.resources.preference.Preference.get", spec=True
+        ) as get_preference,
+        pytest.raises(RedirectNeeded) as exc_info,
+    ):
+        mp_provider.get_form(payment)
+
+    assert str(exc_info.value) == "https://example.com/pay"
+    assert create_preference.call_count == 1
+    assert get_preference.call_count == 0
+    assert payment.save.call_count == 1
+
+
+def test_get_form_refreshes_stale_init_points(
+    mp_provider: MercadoPagoProvider,
+) -> None:
+    mp_provider.preference_ttl = 60
+    payment = Payment()
+    payment.transaction_id = "ABJ122"
+    payment.attrs = SimpleNamespace(
+        mercadopago_init_points={
+            "preference_id": "ABJ122",
+            "init_point": None,
+            "sandbox_init_point": "https://example.com/old",
+            "fetched_at": 1000,
+        }
+    )
+    with (
+        patch(
+            "mercadopago.resources.preference.Preference.get",
+            spec=True,
+            return_value={
+                "status": 200,
+                "response": {"sandbox_init_point": "https://example.com/new"},
+            },
+        ) as get_preference,
+        patch("time.time", return_value=1059),
+        pytest.raises(RedirectNeeded) as exc_info,
+    ):
+        mp_provider.get_form(payment)
+    assert str(exc_info.value) == "https://example.com/old"
+    assert get_preference.call_count == 0
+
+    with (
+        patch(
+            "mercadopago.resources.preference.Preference.get",
+            spec=True,
+            return_value={
+                "status": 200,
+                "response": {"sandbox_init_point": "https://example.com/new"},
+            },
+        ) as get_preference,
+        patch("time.time", return_value=1060),
+        pytest.raises(RedirectNeeded) as exc_info,
+    ):
+        mp_provider.get_form(payment)
+    assert str(exc_info.value) == "https://example.com/new"
+    assert get_preference.call_count == 1
+    assert payment.attrs.mercadopago_init_points["fetched_at"] == 1060
+    assert payment.save.call_count == 1
+
+
 def test_process_notification_ignores_merchant_orders(
     mp_provider: MercadoPagoProvider,
     rf: RequestFactory,
@@ -467,3 +584,99 @@ def test_process_notification_processes_payment_collection(
     assert response.content.decode() == "Thanks"
     assert process_collection.call_count == 1
     assert process_collection.call_args == call(payment, "123")
+
+
+def make_referenced_payments(references, age=timedelta(hours=1)) -> list[Payment]:
+    payments = []
+    for pk, reference in enumerate(references, start=1):
+        payment = Payment()
+        payment.pk = pk
+        payment.created = django_timezone.now() - age
+        payment.attrs = SimpleNamespace(external_reference=reference)
+        payments.append(payment)
+    return payments
+
+
+def test_poll_statuses_searches_once_per_page(mp_provider: MercadoPagoProvider) -> None:
+    payments = make_referenced_payments(["ref-a", "ref-b", "ref-c", "ref-d", "ref-e"])
+    search_response = {
+        "status": 200,
+        "response": {
+            "results": [
+                {"external_reference": "ref-a", "status": "approved"},
+                {"external_reference": "other", "status": "approved"},
+                {"external_reference": "ref-b", "status": "rejected"},
+                {"external_reference": "ref-a", "status": "rejected"},
+            ],
+        },
+    }
+
+    with patch(
+        "mercadopago.resources.payment.Payment.search",
+        spec=True,
+        return_value=search_response,
+    ) as search:
+        updates = mp_provider.poll_statuses(payments)
+
+    assert search.call_count == 1
+    filters = search.call_args.args[0]
+    assert filters["begin_date"] == payments[0].created.isoformat(
+        timespec="milliseconds"
+    )
+    assert filters["end_date"] != "NOW"
+    assert updates == {
+        1: StatusUpdate(PaymentStatus.CONFIRMED),
+        2: StatusUpdate(PaymentStatus.REJECTED),
+    }
+
+
+def test_poll_statuses_caps_searched_pages(mp_provider: MercadoPagoProvider) -> None:
+    payments = make_referenced_payments(["ref-a", "ref-b", "ref-c", "ref-d", "ref-e"])
+    page = {
+        "status": 200,
+        "response": {
+            "results": [{"external_reference": "other", "status": "approved"}]
+            * SEARCH_PAGE_SIZE,
+        },
+    }
+    single = {
+        "status": 200,
+        "response": {"results": [{"external_reference": "ref", "status": "pending"}]},
+    }
+
+    with patch(
+        "mercadopago.resources.payment.Payment.search",
+        spec=True,
+        side_effect=[page] * SEARCH_MAX_PAGES + [single] * 5,
+    ) as search:
+        updates = mp_provider.poll_statuses(payments)
+
+    assert search.call_count == SEARCH_MAX_PAGES + 5
+    assert search.call_args.args[0]["external_reference"] == "ref-e"
+    assert updates == dict.fromkeys(range(1, 6), StatusUpdate(PaymentStatus.WAITING))
+
+
+@pytest.mark.parametrize(
+    ("references", "age"),
+    [
+        (["ref-a", "ref-b"], timedelta(hours=1)),
+        (["ref-a", "ref-b", "ref-c", "ref-d", "ref-e"], timedelta(days=2)),
+    ],
+)
+def test_poll_statuses_searches_sparse_and_old_payments_one_by_one(
+    mp_provider: MercadoPagoProvider, references, age
+) -> None:
+    payments = make_referenced_payments(references, age=age)
+
+    def search(filters):
+        found = filters["external_reference"] == "ref-a"
+        results = [{"external_reference": "ref-a", "status": "approved"}]
+        return {"status": 200, "response": {"results": results if found else []}}
+
+    with patch(
+        "mercadopago.resources.payment.Payment.search", side_effect=search
+    ) as search_:
+        updates = mp_provider.poll_statuses(payments)
+
+    assert search_.call_count == len(references)
+    assert updates == {1: StatusUpdate(PaymentStatus.CONFIRMED)}
@@ -3,24 +3,109 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
+    from collections.abc import AsyncIterator
+    from collections.abc import Callable
     from collections.abc import Iterable
+    from collections.abc import Iterator
 
 import json
 import logging
+from contextlib import asynccontextmanager
+from contextlib import contextmanager
+from contextlib import nullcontext
+from copy import deepcopy
+from decimal import Decimal
+from functools import lru_cache
+from functools import partial
 from uuid import uuid4
 
+from asgiref.sync import sync_to_async
+from django.core.signals import setting_changed
+from django.db import IntegrityError
+from django.db import connections
 from django.db import models
+from django.db import router
+from django.db import transaction
+from django.dispatch import receiver
+from django.urls import get_script_prefix
+from django.urls import get_urlconf
 from django.urls import reverse
+from django.utils.translation import get_language
 from django.utils.translation import gettext_lazy as _
 from phonenumber_field.modelfields import PhoneNumberField
 
 from . import FraudStatus
+from . import PaymentError
 from . import PaymentStatus
 from . import PurchasedItem
+from . import RedirectNeeded
 from .core import provider_factory
 
 logger = logging.getLogger(__name__)
 
+#: How many tokens are tried before giving up on inserting a payment.
+TOKEN_ATTEMPTS = 3
+
+# Reversed in place of a payment's token to build the template of process URLs.
+_TOKEN_PLACEHOLDER = "00000000-0000-0000-0000-000000000000"
+
+
+@lru_cache(maxsize=32)
+def _get_process_url_template(
+    script_prefix: str, urlconf: str | None, language: str | None
+):
+    """Return the parts of the ``process_payment`` URL around the token.
+
+    Cached by script prefix, URLconf and active language (for URLs in
+    ``i18n_patterns()``), which ``reverse()`` depends on.
+    """
+    url = reverse(
+        "process_payment", kwargs={"token": _TOKEN_PLACEHOLDER}, urlconf=urlconf
+    )
+    prefix, suffix = url.split(_TOKEN_PLACEHOLDER)
+    return prefix, suffix
+
+
+@receiver(setting_changed)
+def _invalidate_process_url_template(setting, **kwargs) -> None:
+    if setting == "ROOT_URLCONF":
+        _get_process_url_template.cache_clear()
+
+
+def _load_attrs(payment) -> dict:
+    """Return the parsed ``extra_data`` of a payment, parsing it at most once.
+
+    The parsed value is cached on the payment together with the text it was
+    parsed from, so assigning ``extra_data`` directly invalidates it.
+    """
+    raw = payment.extra_data
+    if not isinstance(raw, str):
+        # ``extra_data`` was redefined as a JSONField: use the value as is.
+        if raw is None:
+            raw = payment.extra_data = {}
+        return raw
+    cached = payment.__dict__.get("_attrs_cache")
+    if cached is not None and cached[0] is raw:
+        return cached[1]
+    try:
+        data = json.loads(raw or "{}")
+    except ValueError:
+        data = {}
+    payment.__dict__["_attrs_cache"] = (raw, data)
+    payment.__dict__["_attrs_dirty"] = False
+    return data
+
+
+def _flush_attrs(payment) -> None:
+    """Serialise pending ``attrs`` changes into ``extra_data``."""
+    if not payment.__dict__.get("_attrs_dirty"):
+        return
+    raw, data = payment.__dict__["_attrs_cache"]
+    if payment.extra_data is raw:
+        raw = payment.extra_data = json.dumps(data)
+        payment.__dict__["_attrs_cache"] = (raw, data)
+    payment.__dict__["_attrs_dirty"] = False
+
 
 class PaymentAttributeProxy:
     def __init__(self, payment) -> None:
@@ -28,24 +113,70 @@ class PaymentAttributeProxy:
         super().__init__()
 
     def __getattr__(self, item):
-        data = json.loads(self._payment.extra_data or "{}")
+        data = _load_attrs(self._payment)
         try:
-            return data[item]
+            value = data[item]
         except KeyError as e:
             raise AttributeError(*e.args) from e
+        if isinstance(value, (dict, list)) and isinstance(
+            self._payment.extra_data, str
+        ):
+            # The value may be changed in place, so serialise it again on save.
+            self._payment.__dict__["_attrs_dirty"] = True
+        return value
 
     def __setattr__(self, key, value) -> None:
         if key == "_payment":
             return super().__setattr__(key, value)
-        try:
-            data = json.loads(self._payment.extra_data)
-        except ValueError:
-            data = {}
+        data = _load_attrs(self._payment)
         data[key] = value
-        self._payment.extra_data = json.dumps(data)
+        if isinstance(self._payment.extra_data, str):
+            # Keep extra_data current, including any changes made in place.
+            self._payment.__dict__["_attrs_dirty"] = True
+            _flush_attrs(self._payment)
         return None
 
 
+class PaymentQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """Insert payments with ``bulk_create()``, preparing them like ``save()``.
+
+        Tokens are unique, so payments without one are assigned one first (see
+        :meth:`~BasePayment.assign_tokens`).
+        """
+        return super().bulk_create(BasePayment.assign_tokens(objs), *args, **kwargs)
+
+    def bulk_create_payments(self, payments, batch_size=None, **kwargs):
+        """Insert many payments at once.
+
+        Like :meth:`bulk_create`, this assigns tokens and serialises
+        :attr:`~BasePayment.attrs` like :meth:`~BasePayment.save` does. The
+        variant of each payment is checked with the provider factory (see
+        ``PAYMENT_VARIANT_FACTORY``) before anything is inserted, once per
+        variant. A single ``payments_created`` signal is sent with all created
+        payments, even if ``batch_size`` splits the insert into several queries.
+
+        :raises ValueError: if any payment uses an unknown variant.
+        """
+        from .signals import payments_created
+
+        payments = list(payments)
+        checked = set()
+        for payment in payments:
+            if payment.variant not in checked:
+                provider_factory(payment.variant, payment)
+                checked.add(payment.variant)
+        created = self.bulk_create(payments, batch_size=batch_size, **kwargs)
+        for payment in created:
+            payment._store_loaded_values()
+        payments_created.send(sender=self.model, instances=created)
+        return created
+
+
+class PaymentManager(models.Manager.from_queryset(PaymentQuerySet)):  # type: ignore[misc]
+    pass
+
+
 class BasePayment(models.Model):
     """
     Represents a single transaction. Each instance has one or more PaymentItem.
@@ -89,9 +220,11 @@ class BasePayment(models.Model):
     customer_ip_address = models.GenericIPAddressField(blank=True, null=True)
     extra_data = models.TextField(blank=True, default="")
     message = models.TextField(blank=True, default="")
-    token = models.CharField(max_length=36, blank=True, default="")
+    token = models.CharField(max_length=36, blank=True, default="", unique=True)
     captured_amount = models.DecimalField(max_digits=9, decimal_places=2, default="0.0")
 
+    objects = PaymentManager()
+
     class Meta:
         abstract = True
 
@@ -99,31 +232,302 @@ class BasePayment(models.Model):
         return self.variant
 
     def save(self, **kwargs):
-        if not self.token:
-            tries = {}  # Stores a set of tried values
-            while True:
-                token = str(uuid4())
+        new_token = not self.token
+        if new_token:
+            self.token = str(uuid4())
+
+        _flush_attrs(self)
+        batch = self.__dict__.get("_save_batch")
+        if batch is not None and not self._state.adding:
+            batch["pending"] = True
+            return
+        # The changed fields are only collected in _save_table(), once pre_save
+        # receivers had a chance to modify the payment.
+        self.__dict__["_save_dirty_fields"] = (
+            kwargs.get("update_fields") is None
+            and not kwargs.get("force_insert")
+            and not self._state.adding
+            and "_loaded_values" in self.__dict__
+        )
+        attempts = TOKEN_ATTEMPTS if new_token else 1
+        while True:
+            attempts -= 1
+            try:
+                super().save(**kwargs)
+                break
+            except IntegrityError:
+                # UUID4 collisions are practically impossible, so the unique index
+                # is only consulted after a failed write. Within a transaction the
+                # failed statement cannot be retried.
+                using = kwargs.get("using") or router.db_for_write(
+                    type(self), instance=self
+                )
+                manager = type(self)._default_manager.db_manager(using)
                 if (
-                    token in tries and len(tries) >= 100
-                ):  # After 100 tries we are impliying an infinite loop
-                    raise SystemExit("A possible infinite loop was detected")
-                if not self.__class__._default_manager.filter(token=token).exists():
-                    self.token = token
-                    break
-                tries.add(token)
+                    not attempts
+                    or connections[using].in_atomic_block
+                    or not manager.filter(token=self.token).exists()
+                ):
+                    raise
+                self.token = str(uuid4())
+            finally:
+                self.__dict__.pop("_save_dirty_fields", None)
+        self._store_loaded_values(kwargs.get("update_fields"))
+
+    def _save_table(
+        self,
+        raw=False,
+        cls=None,
+        force_insert=False,
+        force_update=False,
+        using=None,
+        update_fields=None,
+    ):
+        if update_fields is None and self.__dict__.get("_save_dirty_fields"):
+            update_fields = self.get_dirty_fields() | {"modified"}
+        return super()._save_table(
+            raw, cls, force_insert, force_update, using, update_fields
+        )
+
+    @staticmethod
+    def assign_tokens(payments: Iterable[BasePayment]) -> list[BasePayment]:
+        """Prepare payments to be inserted with ``bulk_create()``.
+
+        Assigns a new token to every payment without one and serialises pending
+        :attr:`attrs` changes, which :meth:`save` would otherwise do.
+        """
+        payments = list(payments)
+        for payment in payments:
+            if not payment.token:
+                payment.token = str(uuid4())
+            _flush_attrs(payment)
+        return payments
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._store_loaded_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None) -> None:
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._store_loaded_values(fields)
+
+    def _store_loaded_values(self, fields: Iterable[str] | None = None) -> None:
+        loaded = self.__dict__.setdefault("_loaded_values", {})
+        fields = None if fields is None else set(fields)
+        for field in self._meta.concrete_fields:
+            if fields is not None and not {field.name, field.attname} & fields:
+                continue
+            if field.attname in self.__dict__:
+                value = self.__dict__[field.attname]
+                # JSONField values may be modified in place.
+                if isinstance(value, (dict, list)):
+                    value = deepcopy(value)
+                loaded[field.attname] = value
+
+    def get_dirty_fields(self) -> set[str]:
+        """Return the names of fields changed since the payment was loaded or saved.
+
+        A payment that has never been loaded from or saved to the database
+        reports all of its fields.
+        """
+        _flush_attrs(self)
+        loaded = self.__dict__.get("_loaded_values", {})
+        return {
+            field.name
+            for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.attname in self.__dict__
+            and (
+                field.attname not in loaded
+                or loaded[field.attname] != self.__dict__[field.attname]
+            )
+        }
+
+    @contextmanager
+    def batch_saves(self) -> Iterator[None]:
+        """Merge all saves of this payment within the block into a single UPDATE.
+
+        Calls to :meth:`save` are recorded and, if there were any, the payment
+        is written once when the block exits. All fields changed by then are
+        written, including any modified after the last call to :meth:`save`, in
+        a short transaction that first locks the payment's row. Changes stored
+        since the payment was loaded are merged: ``captured_amount`` changes are
+        added up, and a status change conflicting with a stored one raises
+        :class:`~.PaymentError` with code ``409`` instead of overwriting it.
+        ``status_changed`` signals are sent after that write. Saves that insert
+        a new payment are not delayed.
+
+        The payment is also written if the block raises :class:`~.PaymentError`
+        or :class:`~.RedirectNeeded`, with which providers report the outcome of
+        a call, or any other exception after :meth:`change_status` was called,
+        as the status change would have been written right away without the
+        block. Otherwise, an exception discards the recorded saves.
+        """
+        if "_save_batch" in self.__dict__:
+            yield
+            return
+        batch = self._start_batch()
+        try:
+            yield
+        except (PaymentError, RedirectNeeded):
+            self._flush_batch(batch)
+            raise
+        except Exception:
+            if batch["status_changed"]:
+                self._flush_batch(batch)
+            else:
+                del self.__dict__["_save_batch"]
+            raise
+        except BaseException:
+            del self.__dict__["_save_batch"]
+            raise
+        else:
+            self._flush_batch(batch)
+
+    @asynccontextmanager
+    async def abatch_saves(self) -> AsyncIterator[None]:
+        """Asynchronous version of :meth:`batch_saves`.
+
+        The payment is written from a worker thread when the block exits.
+        """
+        if "_save_batch" in self.__dict__:
+            yield
+            return
+        batch = self._start_batch()
+        try:
+            yield
+        except (PaymentError, RedirectNeeded):
+            await sync_to_async(self._flush_batch)(batch)
+            raise
+        except Exception:
+            if batch["status_changed"]:
+                await sync_to_async(self._flush_batch)(batch)
+            else:
+                del self.__dict__["_save_batch"]
+            raise
+        except BaseException:
+            del self.__dict__["_save_batch"]
+            raise
+        else:
+            await sync_to_async(self._flush_batch)(batch)
+
+    def _start_batch(self) -> dict:
+        batch: dict = {
+            "pending": False,
+            "status_changed": False,
+            "records": [],
+            "callbacks": [],
+        }
+        self.__dict__["_save_batch"] = batch
+        return batch
+
+    def _flush_batch(self, batch: dict) -> None:
+        del self.__dict__["_save_batch"]
+        records = batch["records"]
+        pending = batch["pending"]
+        with (
+            transaction.atomic(using=self._state.db)
+            if pending or records
+            else nullcontext()
+        ):
+            if pending:
+                # Concurrent writers (e.g.: two webhooks for this payment)
+                # wait for each other here, but not during their gateway
+                # calls.
+                self.lock()
+                self._merge_stored_changes()
+                self.save()
+            for record in records:
+                record()
+        for callback in batch["callbacks"]:
+            callback()
+
+    def lock(self) -> None:
+        """Lock the payment's row until the end of the current transaction."""
+        manager = type(self)._default_manager.db_manager(self._state.db)
+        list(manager.select_for_update().filter(pk=self.pk).values_list("pk"))
+
+    def _merge_stored_changes(self) -> None:
+        """Apply this payment's changes on top of those stored since it was loaded.
+
+        Must be called with the payment's row locked. A change of
+        ``captured_amount`` is applied to the stored amount, so that concurrent
+        partial refunds all count. A status change that was decided from a
+        status that has changed since (e.g.: confirming a payment that was
+        cancelled meanwhile) raises :class:`~.PaymentError`, which rolls back
+        the write. If the status was not changed here, it is updated to the
+        stored one.
+        """
+        loaded = self.__dict__.get("_loaded_values", {})
+        if "status" not in loaded or "captured_amount" not in loaded:
+            return
+        manager = type(self)._default_manager.db_manager(self._state.db)
+        stored_status, stored_amount = (
+            manager.filter(pk=self.pk).values_list("status", "captured_amount").get()
+        )
+        if stored_status != loaded["status"]:
+            if self.status == loaded["status"]:
+                self.status = loaded["status"] = stored_status
+            elif self.status != stored_status:
+                raise PaymentError(
+                    f"Payment status was changed to {stored_status} concurrently",
+                    code=409,
+                )
+        loaded_amount = Decimal(str(loaded["captured_amount"]))
+        if stored_amount != loaded_amount:
+            amount = Decimal(str(self.captured_amount))
+            self.captured_amount = stored_amount + amount - loaded_amount
+            loaded["captured_amount"] = stored_amount
 
-        return super().save(**kwargs)
+    def _after_save(
+        self,
+        callback: Callable[[], object],
+        in_transaction: bool = False,
+    ) -> None:
+        batch = self.__dict__.get("_save_batch")
+        if batch is not None:
+            batch["records" if in_transaction else "callbacks"].append(callback)
+        else:
+            callback()
 
     def change_status(self, status: PaymentStatus | str, message="") -> None:
         """
         Updates the Payment status and sends the status_changed signal.
+
+        With the :ref:`status outbox <status-outbox>` enabled, the change is
+        recorded in the same transaction instead, and the signal is sent later
+        by the ``payments_dispatch_outbox`` command.
         """
+        from .outbox import outbox_enabled
         from .signals import status_changed
 
         self.status = status  # type: ignore[assignment]
         self.message = message
-        self.save(update_fields=["status", "message"])
-        status_changed.send(sender=type(self), instance=self)
+        batch = self.__dict__.get("_save_batch")
+        if batch is not None:
+            batch["status_changed"] = True
+        if not outbox_enabled():
+            self.save(update_fields=["status", "message"])
+            self._after_save(
+                lambda: status_changed.send(
+                    sender=type(self), instance=self, status=status, message=message
+                )
+            )
+            return
+
+        from .outbox.models import StatusChange
+
+        using = router.db_for_write(type(self), instance=self)
+        record = partial(StatusChange.record, self, status, message, using=using)
+        if batch is not None:
+            self.save(update_fields=["status", "message"])
+            self._after_save(record, in_transaction=True)
+            return
+        with transaction.atomic(using=using):
+            self.save(update_fields=["status", "message"])
+            record()
 
     def change_fraud_status(
         self,
@@ -153,7 +557,8 @@ class BasePayment(models.Model):
         immediately raise ``RedirectNeeded``.
         """
         provider = provider_factory(self.variant, self)
-        return provider.get_form(self, data=data)
+        with self.batch_saves():
+            return provider.get_form(self, data=data)
 
     def get_purchased_items(self) -> Iterable[PurchasedItem]:
         """Return an iterable of purchased items.
@@ -195,7 +600,12 @@ class BasePayment(models.Model):
         raise NotImplementedError
 
     def get_process_url(self) -> str:
-        return reverse("process_payment", kwargs={"token": self.token})
+        if not self.token:
+            return reverse("process_payment", kwargs={"token": self.token})
+        prefix, suffix = _get_process_url_template(
+            get_script_prefix(), get_urlconf(), get_language()
+        )
+        return f"{prefix}{self.token}{suffix}"
 
     def capture(self, amount=None) -> None:
         """Capture a pre-authorized payment.
@@ -205,10 +615,11 @@ class BasePayment(models.Model):
         if self.status != PaymentStatus.PREAUTH:
             raise ValueError("Only pre-authorized payments can be captured.")
         provider = provider_factory(self.variant, self)
-        amount = provider.capture(self, amount)
-        if amount:
-            self.captured_amount = amount
-            self.change_status(PaymentStatus.CONFIRMED)
+        with self.batch_saves():
+            amount = provider.capture(self, amount)
+            if amount:
+                self.captured_amount = amount
+                self.change_status(PaymentStatus.CONFIRMED)
 
     def release(self) -> None:
         """Release a pre-authorized payment.
@@ -218,8 +629,9 @@ class BasePayment(models.Model):
         if self.status != PaymentStatus.PREAUTH:
             raise ValueError("Only pre-authorized payments can be released.")
         provider = provider_factory(self.variant, self)
-        provider.release(self)
-        self.change_status(PaymentStatus.REFUNDED)
+        with self.batch_saves():
+            provider.release(self)
+            self.change_status(PaymentStatus.REFUNDED)
 
     def refund(self, amount=None) -> None:
         if self.status != PaymentStatus.CONFIRMED:
@@ -227,22 +639,24 @@ class BasePayment(models.Model):
         if amount and amount > self.captured_amount:
             raise ValueError("Refund amount can not be greater then captured amount")
         provider = provider_factory(self.variant, self)
-        amount = provider.refund(self, amount)
-        # If the initial amount is None, the code above has no chance to check whether
-        # the actual amount is greater than the captured amount before actually
-        # performing the refund. But since the refund has been performed already,
-        # raising an exception would just cause inconsistencies. Thus, logging an error.
-        if amount > self.captured_amount:
-            logger.error(
-                "Refund amount of payment %s greater than captured amount: %f > %f",
-                self.pk,
-                amount,
-                self.captured_amount,
-            )
-        self.captured_amount -= amount
-        if self.captured_amount <= 0 and self.status != PaymentStatus.REFUNDED:
-            self.change_status(PaymentStatus.REFUNDED)
-        self.save()
+        with self.batch_saves():
+            amount = provider.refund(self, amount)
+            # If the initial amount is None, the code above has no chance to check
+            # whether the actual amount is greater than the captured amount before
+            # actually performing the refund. But since the refund has been performed
+            # already, raising an exception would just cause inconsistencies. Thus,
+            # logging an error.
+            if amount > self.captured_amount:
+                logger.error(
+                    "Refund amount of payment %s greater than captured amount: %f > %f",
+                    self.pk,
+                    amount,
+                    self.captured_amount,
+                )
+            self.captured_amount -= amount
+            if self.captured_amount <= 0 and self.status != PaymentStatus.REFUNDED:
+                self.change_status(PaymentStatus.REFUNDED)
+            self.save()
 
     def cancel(self):
         """Cancel a payment.
@@ -256,19 +670,27 @@ class BasePayment(models.Model):
         if self.status not in [PaymentStatus.WAITING, PaymentStatus.INPUT]:
             raise ValueError("Only waiting or input payments can be cancelled.")
         provider = provider_factory(self.variant, self)
-        provider.cancel(self)
-        self.change_status(PaymentStatus.CANCELLED)
+        with self.batch_saves():
+            provider.cancel(self)
+            self.change_status(PaymentStatus.CANCELLED)
 
     @property
     def attrs(self):
         """A JSON-serialised wrapper around `extra_data`.
 
-        This property exposes a a dict or list which is serialised into the `extra_data`
+        This property exposes a dict which is serialised into the `extra_data`
         text field. Usage of this wrapper is preferred over accessing the underlying
         field directly.
 
-        You may think of this as a `JSONField` which is saved to the `extra_data`
-        column.
+        The field is parsed once, and each value set through this wrapper is
+        serialised back into `extra_data` right away. Values read from it
+        (dictionaries or lists) may be changed in place; such changes are only
+        serialised by :meth:`save` or the next value set. Assigning
+        `extra_data` directly replaces all values, including any changed in
+        place.
+
+        Subclasses may redefine `extra_data` as a `JSONField` with
+        ``default=dict``, in which case the wrapper reads and writes the field's
+        value directly without any serialisation.
         """
-        # TODO: Deprecate in favour of JSONField when we drop support for django 2.2.
         return PaymentAttributeProxy(self)
@@ -0,0 +1,17 @@
+"""
+A transactional outbox for ``status_changed``.
+
+When this app is installed and ``PAYMENT_STATUS_OUTBOX`` is enabled, status
+changes are recorded in the same transaction as the payment update, and the
+``payments_dispatch_outbox`` command sends the signals after commit.
+"""
+
+from __future__ import annotations
+
+from django.apps import apps as django_apps
+from django.conf import settings
+
+
+def outbox_enabled() -> bool:
+    enabled = getattr(settings, "PAYMENT_STATUS_OUTBOX", False)
+    return enabled and django_apps.is_installed("payments.outbox")
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+
+from payments.signals import status_changed
+
+from .models import StatusChange
+
+logger = logging.getLogger(__name__)
+
+#: Longest delay between two attempts to deliver a status change.
+MAX_RETRY_DELAY = timedelta(hours=1)
+
+#: How long a worker may take to deliver a status change it claimed before
+#: other workers consider it abandoned and deliver it again.
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+#: Number of failed attempts after which a status change is given up on.
+MAX_ATTEMPTS = 10
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return min(timedelta(seconds=30 * 2 ** (attempts - 1)), MAX_RETRY_DELAY)
+
+
+def dispatch_status_changes(limit: int = 100) -> tuple[int, int]:
+    """Send ``status_changed`` for recorded status changes, oldest first.
+
+    The changes of each payment are delivered in order: while one of them waits
+    to be retried, later ones for the same payment are held back. A change is
+    retried if any receiver raises, so receivers may see it more than once.
+    After :data:`MAX_ATTEMPTS` failed attempts the change is given up on: it is
+    kept with its ``next_attempt`` cleared, and no longer holds back later
+    changes of its payment.
+
+    Receivers are passed the payment as currently stored, with its ``status``
+    and ``message`` set to those of the change, as well as ``status`` and
+    ``message`` arguments.
+
+    Several workers may run at once. Each change is claimed before it is
+    delivered by moving its ``next_attempt`` forward with a conditional
+    ``UPDATE``, so other workers skip it, and the later changes of its payment,
+    until it is delivered or the claim times out.
+
+    :returns: the number of delivered and of failed status changes.
+    """
+    now = timezone.now()
+    pending = StatusChange.objects.exclude(next_attempt=None)
+    blocked: set[tuple[str, str]] = set()
+    sent = failed = 0
+    last_pk = 0
+    while sent + failed < limit:
+        changes = list(pending.filter(pk__gt=last_pk)[:limit])
+        if not changes:
+            break
+        last_pk = changes[-1].pk
+        for change in changes:
+            if sent + failed >= limit:
+                break
+            key = (change.payment_model, change.payment_pk)
+            if key in blocked:
+                continue
+            if (
+                change.next_attempt is None
+                or change.next_attempt > now
+                or not _claim(change)
+            ):
+                blocked.add(key)
+                continue
+            error = _dispatch(change)
+            if error is None:
+                change.delete()
+                sent += 1
+                continue
+            blocked.add(key)
+            change.attempts += 1
+            change.last_error = error
+            if change.attempts >= MAX_ATTEMPTS:
+                logger.error("Giving up on status change %s", change)
+                change.next_attempt = None
+            else:
+                change.next_attempt = now + retry_delay(change.attempts)
+            change.save(update_fields=["attempts", "last_error", "next_attempt"])
+            failed += 1
+    return sent, failed
+
+
+def _claim(change: StatusChange) -> bool:
+    """Claim a change for this worker, unless another worker got it first."""
+    next_attempt = timezone.now() + CLAIM_TIMEOUT
+    claimed = StatusChange.objects.filter(
+        pk=change.pk, next_attempt=change.next_attempt
+    ).update(next_attempt=next_attempt)
+    change.next_attempt = next_attempt
+    return bool(claimed)
+
+
+def _dispatch(change: StatusChange) -> str | None:
+    try:
+        model = apps.get_model(change.payment_model)
+        payment = model._default_manager.get(pk=change.payment_pk)
+    except (LookupError, ObjectDoesNotExist):
+        logger.warning("Dropping status change for missing payment %s", change)
+        return None
+    # Receivers may read the status from the payment, which may have changed
+    # again since.
+    payment.status = change.status
+    payment.message = change.message
+    responses = status_changed.send_robust(
+        sender=model,
+        instance=payment,
+        status=change.status,
+        message=change.message,
+    )
+    errors = []
+    for receiver, response in responses:
+        if isinstance(response, Exception):
+            logger.error(
+                "Receiver %r failed for %s",
+                receiver,
+                change,
+                exc_info=response,
+            )
+            errors.append(f"{receiver!r}: {response!r}")
+    return "\n".join(errors) or None
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:00
+from __future__ import annotations
+
+import django.utils.timezone
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payments_outbox", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="statuschange",
+            name="next_attempt",
+            field=models.DateTimeField(default=django.utils.timezone.now, null=True),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from django.db import models
+from django.utils import timezone
+
+
+class StatusChange(models.Model):
+    """A status transition waiting to be sent as ``status_changed``."""
+
+    #: Label of the payment model, e.g.: ``shop.Payment``
+    payment_model = models.CharField(max_length=255)
+    payment_pk = models.CharField(max_length=255)
+    status = models.CharField(max_length=10)
+    message = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    #: When to deliver the change next; ``None`` once it has been given up on
+    next_attempt = models.DateTimeField(default=timezone.now, null=True)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        ordering = ["pk"]
+
+    def __str__(self) -> str:
+        return f"{self.payment_model}:{self.payment_pk} -> {self.status}"
+
+    @classmethod
+    def record(cls, payment, status, message="", using=None) -> StatusChange:
+        return cls.objects.using(using).create(
+            payment_model=payment._meta.label,
+            payment_pk=str(payment.pk),
+            status=status,
+            message=message,
+        )
+
+    @classmethod
+    def record_current(cls, payments, using=None) -> list[StatusChange]:
+        """Record the current status of each of ``payments`` in one query."""
+        return StatusChange.objects.using(using).bulk_create(
+            StatusChange(
+                payment_model=payment._meta.label,
+                payment_pk=str(payment.pk),
+                status=payment.status,
+                message=payment.message,
+            )
+            for payment in payments
+        )
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from payments import PaymentStatus
+from payments.signals import status_changed
+from payments.test_core import Payment
+
+from .dispatch import MAX_ATTEMPTS
+from .dispatch import dispatch_status_changes
+from .models import StatusChange
+
+
+@pytest.fixture
+def outbox(settings):
+    settings.PAYMENT_STATUS_OUTBOX = True
+
+
+@pytest.fixture
+def received():
+    received = []
+
+    def handler(sender, instance, status, **kwargs):
+        received.append((instance.pk, status))
+
+    status_changed.connect(handler, sender=Payment)
+    yield received
+    status_changed.disconnect(handler, sender=Payment)
+
+
+@pytest.mark.django_db
+def test_change_status_records_status_change(outbox, received) -> None:
+    payment = Payment.objects.create(variant="default")
+    payment.change_status(PaymentStatus.CONFIRMED, "message")
+    assert received == []
+    (change,) = StatusChange.objects.all()
+    assert change.payment_model == "payments.Payment"
+    assert change.payment_pk == str(payment.pk)
+    assert change.message == "message"
+
+    assert dispatch_status_changes() == (1, 0)
+    assert received == [(payment.pk, PaymentStatus.CONFIRMED)]
+    assert not StatusChange.objects.exists()
+
+
+@pytest.mark.django_db
+def test_batch_saves_records_every_status_change(outbox, received) -> None:
+    payment = Payment.objects.create(variant="default")
+    with payment.batch_saves():
+        payment.change_status(PaymentStatus.CONFIRMED)
+        payment.change_status(PaymentStatus.REFUNDED)
+        assert not StatusChange.objects.exists()
+    assert [change.status for change in StatusChange.objects.all()] == [
+        PaymentStatus.CONFIRMED,
+        PaymentStatus.REFUNDED,
+    ]
+    payment.refresh_from_db()
+    assert payment.status == PaymentStatus.REFUNDED
+
+
+@pytest.mark.django_db
+def test_dispatch_passes_each_change_on_the_instance(outbox) -> None:
+    payment = Payment.objects.create(variant="default")
+    payment.change_status(PaymentStatus.CONFIRMED, "paid")
+    payment.change_status(PaymentStatus.REFUNDED, "refunded")
+    received = []
+
+    def handler(sender, instance, status, message, **kwargs):
+        received.append((instance.status, instance.message, status, message))
+
+    status_changed.connect(handler, sender=Payment)
+    try:
+        assert dispatch_status_changes() == (2, 0)
+    finally:
+        status_changed.disconnect(handler, sender=Payment)
+    assert received == [
+        (PaymentStatus.CONFIRMED, "paid", PaymentStatus.CONFIRMED, "paid"),
+        (PaymentStatus.REFUNDED, "refunded", PaymentStatus.REFUNDED, "refunded"),
+    ]
+
+
+@pytest.mark.django_db
+def test_change_status_sends_status_without_outbox(received) -> None:
+    payment = Payment.objects.create(variant="default")
+    payment.change_status(PaymentStatus.CONFIRMED)
+    assert received == [(payment.pk, PaymentStatus.CONFIRMED)]
+    assert not StatusChange.objects.exists()
+
+
+@pytest.mark.django_db
+def test_dispatch_retries_in_order(outbox, received) -> None:
+    failing = Payment.objects.create(variant="default")
+    other = Payment.objects.create(variant="default")
+    failing.change_status(PaymentStatus.CONFIRMED)
+    other.change_status(PaymentStatus.CONFIRMED)
+    failing.change_status(PaymentStatus.REFUNDED)
+
+    def fail(sender, instance, **kwargs):
+        if instance.pk == failing.pk:
+            raise RuntimeError("receiver is down")
+
+    status_changed.connect(fail, sender=Payment)
+    try:
+        assert dispatch_status_changes() == (1, 1)
+    finally:
+        status_changed.disconnect(fail, sender=Payment)
+    first, _second = StatusChange.objects.all()
+    assert first.attempts == 1
+    assert "receiver is down" in first.last_error
+
+    # The failed change is not due yet, and holds back the later one.
+    assert dispatch_status_changes() == (0, 0)
+    StatusChange.objects.update(next_attempt=timezone.now() - timedelta(seconds=1))
+    assert dispatch_status_changes() == (2, 0)
+    assert received[-2:] == [
+        (failing.pk, PaymentStatus.CONFIRMED),
+        (failing.pk, PaymentStatus.REFUNDED),
+    ]
+
+
+@pytest.mark.django_db
+def test_dispatch_gives_up_after_max_attempts(outbox, received) -> None:
+    payment = Payment.objects.create(variant="default")
+    payment.change_status(PaymentStatus.CONFIRMED)
+    payment.change_status(PaymentStatus.REFUNDED)
+
+    def fail(sender, instance, status, **kwargs):
+        if status == PaymentStatus.CONFIRMED:
+            raise RuntimeError("receiver is down")
+
+    status_changed.connect(fail, sender=Payment)
+    try:
+        for _attempt in range(MAX_ATTEMPTS):
+            StatusChange.objects.exclude(next_attempt=None).update(
+                next_attempt=timezone.now() - timedelta(seconds=1)
+            )
+            assert dispatch_status_changes() == (0, 1)
+        # The later change is no longer held back.
+        assert dispatch_status_changes() == (1, 0)
+    finally:
+        status_changed.disconnect(fail, sender=Payment)
+    (change,) = StatusChange.objects.all()
+    assert change.status == PaymentStatus.CONFIRMED
+    assert change.attempts == MAX_ATTEMPTS
+    assert change.next_attempt is None
+    assert received[-1] == (payment.pk, PaymentStatus.REFUNDED)
+
+
+@pytest.mark.django_db
+def test_concurrent_dispatch_delivers_once_in_order(outbox, received) -> None:
+    payment = Payment.objects.create(variant="default")
+    other = Payment.objects.create(variant="default")
+    payment.change_status(PaymentStatus.CONFIRMED)
+    payment.change_status(PaymentStatus.REFUNDED)
+    other.change_status(PaymentStatus.CONFIRMED)
+    concurrent: list[tuple[int, int]] = []
+
+    def dispatch_concurrently(sender, instance, **kwargs):
+        # Another worker runs while the first change is being delivered.
+        if not concurrent:
+            concurrent.append((0, 0))
+            concurrent[0] = dispatch_status_changes()
+
+    status_changed.connect(dispatch_concurrently, sender=Payment)
+    try:
+        assert dispatch_status_changes() == (2, 0)
+    finally:
+        status_changed.disconnect(dispatch_concurrently, sender=Payment)
+    assert concurrent == [(1, 0)]
+    assert sorted(received) == sorted(
+        [
+            (payment.pk, PaymentStatus.CONFIRMED),
+            (payment.pk, PaymentStatus.REFUNDED),
+            (other.pk, PaymentStatus.CONFIRMED),
+        ]
+    )
+    assert [status for pk, status in received if pk == payment.pk] == [
+        PaymentStatus.CONFIRMED,
+        PaymentStatus.REFUNDED,
+    ]
+    assert not StatusChange.objects.exists()
+
+
+@pytest.mark.django_db
+def test_dispatch_retries_abandoned_claims(outbox, received) -> None:
+    payment = Payment.objects.create(variant="default")
+    payment.change_status(PaymentStatus.CONFIRMED)
+    # A worker claimed the change and died before delivering it.
+    StatusChange.objects.update(next_attempt=timezone.now() + timedelta(minutes=1))
+    assert dispatch_status_changes() == (0, 0)
+    StatusChange.objects.update(next_attempt=timezone.now() - timedelta(seconds=1))
+    assert dispatch_status_changes() == (1, 0)
+    assert received == [(payment.pk, PaymentStatus.CONFIRMED)]
+
+
+@pytest.mark.django_db
+def test_dispatch_command(outbox, received) -> None:
+    payment = Payment.objects.create(variant="default")
+    payment.change_status(PaymentStatus.CONFIRMED)
+    out = StringIO()
+    call_command("payments_dispatch_outbox", stdout=out)
+    assert "Sent 1 status changes, 0 failed." in out.getvalue()
+    assert received == [(payment.pk, PaymentStatus.CONFIRMED)]
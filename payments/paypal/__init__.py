@@ -1,18 +1,22 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import json
 import logging
-from datetime import timedelta
+import threading
+import time
+import weakref
+from copy import deepcopy
 from decimal import ROUND_HALF_UP
 from decimal import Decimal
-from functools import wraps
 from typing import NoReturn
 
-import requests
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
 from django.http import HttpResponseBadRequest
 from django.http import HttpResponseForbidden
 from django.shortcuts import redirect
-from django.utils import timezone
 from requests.exceptions import HTTPError
 
 from payments import PaymentError
@@ -29,36 +33,6 @@ logger = logging.getLogger(__name__)
 CENTS = Decimal("0.01")
 
 
-class UnauthorizedRequest(Exception):
-    pass
-
-
-def authorize(fun):
-    @wraps(fun)
-    def wrapper(*args, **kwargs):
-        self = args[0]
-        payment = args[1]
-        self.access_token = self.get_access_token(payment)
-        try:
-            response = fun(*args, **kwargs)
-        except HTTPError as e:
-            if e.response.status_code == 401:
-                if payment is not None:
-                    last_auth_response = self.get_last_response(payment, is_auth=True)
-                    if "access_token" in last_auth_response:
-                        del last_auth_response["access_token"]
-                        self.set_response_data(
-                            payment, last_auth_response, is_auth=True
-                        )
-                self.access_token = self.get_access_token(payment)
-                response = fun(*args, **kwargs)
-            else:
-                raise
-        return response
-
-    return wrapper
-
-
 class PaypalProvider(BasicProvider):
     """Payment provider for Paypal, redirection-based.
 
@@ -70,18 +44,34 @@ class PaypalProvider(BasicProvider):
         use ``'https://api.paypal.com'`` instead
     :param capture: Whether to capture the payment automatically.
         See :ref:`capture-payments` for more details.
+    :param token_cache: Alias of the Django cache where OAuth access tokens are
+        shared between processes. Use ``None`` to only keep them in memory.
     """
 
+    #: Seconds before expiry at which an access token is renewed.
+    token_refresh_margin = 60
+
     def __init__(
         self,
         client_id,
         secret,
         endpoint="https://api.sandbox.paypal.com",
         capture=True,
+        token_cache="default",
     ) -> None:
         self.secret = secret
         self.client_id = client_id
         self.endpoint = endpoint
+        self.token_cache = token_cache
+        self._token: tuple[str, float] | None = None
+        self._token_lock = threading.Lock()
+        self._async_token_locks: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, asyncio.Lock
+        ] = weakref.WeakKeyDictionary()
+        self._token_cache_key = (
+            "payments:paypal:token:"
+            + hashlib.sha256(f"{endpoint}:{client_id}".encode()).hexdigest()
+        )
         self.oauth2_url = self.endpoint + "/v1/oauth2/token"
         self.payments_url = self.endpoint + "/v1/payments/payment"
         self.payment_execute_url = self.payments_url + "/%(id)s/execute/"
@@ -91,14 +81,12 @@ class PaypalProvider(BasicProvider):
         super().__init__(capture=capture)
 
     def set_response_data(self, payment, response, is_auth=False) -> None:
-        extra_data = json.loads(payment.extra_data or "{}")
         if is_auth:
-            extra_data["auth_response"] = response
+            payment.attrs.auth_response = response
         else:
-            extra_data["response"] = response
+            payment.attrs.response = response
             if "links" in response:
-                extra_data["links"] = {link["rel"]: link for link in response["links"]}
-        payment.extra_data = json.dumps(extra_data)
+                payment.attrs.links = {link["rel"]: link for link in response["links"]}
         payment.save()
 
     def set_response_links(self, payment, response) -> None:
@@ -106,40 +94,72 @@ class PaypalProvider(BasicProvider):
         related_resources = transaction["related_resources"][0]
         resource_key = "sale" if self._capture else "authorization"
         links = related_resources[resource_key]["links"]
-        extra_data = json.loads(payment.extra_data or "{}")
-        extra_data["links"] = {link["rel"]: link for link in links}
-        payment.extra_data = json.dumps(extra_data)
+        payment.attrs.links = {link["rel"]: link for link in links}
         payment.save()
 
     def set_error_data(self, payment, error) -> None:
-        extra_data = json.loads(payment.extra_data or "{}")
-        extra_data["error"] = error
-        payment.extra_data = json.dumps(extra_data)
+        payment.attrs.error = error
         payment.save()
 
     def _get_links(self, payment):
-        extra_data = json.loads(payment.extra_data or "{}")
-        return extra_data.get("links", {})
+        return getattr(payment.attrs, "links", {})
 
-    @authorize
     def http_request(self, payment, *args, method: str = "get", **kwargs) -> dict:
         """Perform an authorized request to the PayPal API.
 
+        If the access token is rejected, it is renewed and the request is sent
+        once more.
+
         :param payment: Payment instance (can be None for requests not tied
             to a payment)
-        :param args: positional arguments passed to :func:`requests.request`
+        :param args: positional arguments passed to :meth:`requests.Session.request`
         :param method: HTTP method name, e.g. ``"get"`` or ``"post"``
-        :param kwargs: keyword arguments passed to :func:`requests.request`
+        :param kwargs: keyword arguments passed to :meth:`requests.Session.request`
         :returns: JSON response data from the PayPal API
         :raises PaymentError: if the API returns an error status code
         """
+        for retry in (True, False):
+            request_kwargs = self._get_request_kwargs(self.get_access_token(), kwargs)
+            response = self.http_session.request(method, *args, **request_kwargs)
+            if response.status_code != 401 or not retry:
+                break
+            self.invalidate_access_token()
+        return self._handle_response(payment, response)
+
+    async def ahttp_request(
+        self, payment, *args, method: str = "get", **kwargs
+    ) -> dict:
+        """Asynchronous version of :meth:`http_request`.
+
+        :param args: positional arguments passed to
+            :meth:`httpx.AsyncClient.request`
+        :param kwargs: keyword arguments passed to
+            :meth:`httpx.AsyncClient.request`
+        """
+        client = self.get_async_http_client()
+        for retry in (True, False):
+            request_kwargs = self._get_request_kwargs(
+                await self.aget_access_token(), kwargs
+            )
+            if "data" in request_kwargs:
+                request_kwargs["content"] = request_kwargs.pop("data")
+            response = await client.request(method, *args, **request_kwargs)
+            if response.status_code != 401 or not retry:
+                break
+            await self.ainvalidate_access_token()
+        return await sync_to_async(self._handle_response)(payment, response)
+
+    def _get_request_kwargs(self, access_token: str, kwargs: dict) -> dict:
+        kwargs = dict(kwargs)
         kwargs["headers"] = {
             "Content-Type": "application/json",
-            "Authorization": self.access_token,
+            "Authorization": access_token,
         }
         if "data" in kwargs:
             kwargs["data"] = json.dumps(kwargs["data"])
-        response = requests.request(method, *args, **kwargs)
+        return kwargs
+
+    def _handle_response(self, payment, response) -> dict:
         try:
             data = response.json()
         except ValueError:
@@ -170,8 +190,8 @@ class PaypalProvider(BasicProvider):
 
         :param payment: Payment instance (can be None for requests not tied
             to a payment)
-        :param args: positional arguments passed to :func:`requests.request`
-        :param kwargs: keyword arguments passed to :func:`requests.request`
+        :param args: positional arguments passed to :meth:`requests.Session.request`
+        :param kwargs: keyword arguments passed to :meth:`requests.Session.request`
         :returns: JSON response data from the PayPal API
         :raises PaymentError: if the API returns an error status code
         """
@@ -182,47 +202,140 @@ class PaypalProvider(BasicProvider):
 
         :param payment: Payment instance (can be None for requests not tied
             to a payment)
-        :param args: positional arguments passed to :func:`requests.request`
-        :param kwargs: keyword arguments passed to :func:`requests.request`
+        :param args: positional arguments passed to :meth:`requests.Session.request`
+        :param kwargs: keyword arguments passed to :meth:`requests.Session.request`
         :returns: JSON response data from the PayPal API
         :raises PaymentError: if the API returns an error status code
         """
         return self.http_request(payment, *args, method="get", **kwargs)
 
+    async def apost(self, payment, *args, **kwargs) -> dict:
+        """Asynchronous version of :meth:`post`."""
+        return await self.ahttp_request(payment, *args, method="post", **kwargs)
+
+    async def aget(self, payment, *args, **kwargs) -> dict:
+        """Asynchronous version of :meth:`get`."""
+        return await self.ahttp_request(payment, *args, method="get", **kwargs)
+
     def get_last_response(self, payment, is_auth=False):
-        extra_data = json.loads(payment.extra_data or "{}")
         if is_auth:
-            return extra_data.get("auth_response", {})
-        return extra_data.get("response", {})
+            return deepcopy(getattr(payment.attrs, "auth_response", {}))
+        return deepcopy(getattr(payment.attrs, "response", {}))
 
-    def get_access_token(self, payment):
-        if payment is not None:
-            last_auth_response = self.get_last_response(payment, is_auth=True)
-            created = payment.created
-            now = timezone.now()
-            expires_in = last_auth_response.get("expires_in")
-            if (
-                "access_token" in last_auth_response
-                and expires_in is not None
-                and (created + timedelta(seconds=expires_in)) > now
-            ):
-                return "{} {}".format(
-                    last_auth_response["token_type"], last_auth_response["access_token"]
-                )
-        headers = {"Accept": "application/json", "Accept-Language": "en_US"}
-        post = {"grant_type": "client_credentials"}
-        response = requests.post(
-            self.oauth2_url,
-            data=post,
-            headers=headers,
-            auth=(self.client_id, self.secret),
+    def get_access_token(self, payment=None) -> str:
+        """Return an ``Authorization`` header value for the PayPal API.
+
+        Tokens are shared by all payments and, through ``token_cache``, by all
+        processes. They are renewed shortly before they expire; concurrent
+        renewals within a process result in a single OAuth request.
+
+        :param payment: Unused; kept for backwards compatibility.
+        """
+        token = self._get_cached_access_token()
+        if token is None:
+            with self._token_lock:
+                token = self._get_cached_access_token()
+                if token is None:
+                    token = self._request_access_token()
+        return token
+
+    async def aget_access_token(self) -> str:
+        """Asynchronous version of :meth:`get_access_token`.
+
+        Concurrent renewals within an event loop result in a single OAuth
+        request.
+        """
+        token = await self._aget_cached_access_token()
+        if token is None:
+            async with self._get_async_token_lock():
+                token = await self._aget_cached_access_token()
+                if token is None:
+                    token = await self._arequest_access_token()
+        return token
+
+    def invalidate_access_token(self) -> None:
+        """Discard the current access token, e.g.: after it has been rejected."""
+        self._token = None
+        if self.token_cache is not None:
+            caches[self.token_cache].delete(self._token_cache_key)
+
+    async def ainvalidate_access_token(self) -> None:
+        """Asynchronous version of :meth:`invalidate_access_token`."""
+        self._token = None
+        if self.token_cache is not None:
+            await caches[self.token_cache].adelete(self._token_cache_key)
+
+    def _get_cached_access_token(self) -> str | None:
+        token = self._get_memory_access_token()
+        if token is None and self.token_cache is not None:
+            cached = caches[self.token_cache].get(self._token_cache_key)
+            token = self._use_cached_access_token(cached)
+        return token
+
+    async def _aget_cached_access_token(self) -> str | None:
+        token = self._get_memory_access_token()
+        if token is None and self.token_cache is not None:
+            cached = await caches[self.token_cache].aget(self._token_cache_key)
+            token = self._use_cached_access_token(cached)
+        return token
+
+    def _get_async_token_lock(self) -> asyncio.Lock:
+        # asyncio locks are bound to the event loop they are first used in.
+        loop = asyncio.get_running_loop()
+        lock = self._async_token_locks.get(loop)
+        if lock is None:
+            lock = self._async_token_locks[loop] = asyncio.Lock()
+        return lock
+
+    def _get_memory_access_token(self) -> str | None:
+        if self._token is not None and self._token[1] > time.time():
+            return self._token[0]
+        return None
+
+    def _use_cached_access_token(self, cached) -> str | None:
+        if cached is not None and cached[1] > time.time():
+            self._token = cached
+            return cached[0]
+        return None
+
+    def _request_access_token(self) -> str:
+        response = self.http_session.post(
+            self.oauth2_url, **self._get_access_token_request()
         )
         response.raise_for_status()
-        data = response.json()
-        if payment is not None:
-            last_auth_response.update(data)
-            self.set_response_data(payment, last_auth_response, is_auth=True)
-        return "{} {}".format(data["token_type"], data["access_token"])
+        token, lifetime = self._parse_access_token(response.json())
+        if lifetime > 0 and self.token_cache is not None:
+            caches[self.token_cache].set(
+                self._token_cache_key, self._token, timeout=lifetime
+            )
+        return token
+
+    async def _arequest_access_token(self) -> str:
+        response = await self.get_async_http_client().post(
+            self.oauth2_url, **self._get_access_token_request()
+        )
+        response.raise_for_status()
+        token, lifetime = self._parse_access_token(response.json())
+        if lifetime > 0 and self.token_cache is not None:
+            await caches[self.token_cache].aset(
+                self._token_cache_key, self._token, timeout=lifetime
+            )
+        return token
+
+    def _get_access_token_request(self) -> dict:
+        return {
+            "data": {"grant_type": "client_credentials"},
+            "headers": {"Accept": "application/json", "Accept-Language": "en_US"},
+            "auth": (self.client_id, self.secret),
+        }
+
+    def _parse_access_token(self, data: dict) -> tuple[str, float]:
+        """Keep the token from an OAuth response in memory; return its lifetime."""
+        token = "{} {}".format(data["token_type"], data["access_token"])
+        lifetime = data.get("expires_in", 0) - self.token_refresh_margin
+        if lifetime > 0:
+            self._token = (token, time.time() + lifetime)
+        return token, lifetime
 
     def get_transactions_items(self, payment):
         for purchased_item in payment.get_purchased_items():
@@ -279,27 +392,78 @@ class PaypalProvider(BasicProvider):
             payment.transaction_id = payment_data["id"]
             links = self._get_links(payment)
             redirect_to = links["approval_url"]
+        self._set_waiting(payment)
+        raise RedirectNeeded(redirect_to["href"])
+
+    async def aget_form(self, payment, data=None):
+        if self._overrides("get_form", PaypalProvider) or self._overrides(
+            "create_payment", PaypalProvider
+        ):
+            return await super().aget_form(payment, data)
+        if not payment.id:
+            await sync_to_async(payment.save)()
+        links = self._get_links(payment)
+        redirect_to = links.get("approval_url")
+        if not redirect_to:
+            product_data = await sync_to_async(self.get_product_data)(payment)
+            payment_data = await self.apost(
+                payment, self.payments_url, data=product_data
+            )
+            payment.transaction_id = payment_data["id"]
+            links = self._get_links(payment)
+            redirect_to = links["approval_url"]
+        await sync_to_async(self._set_waiting)(payment)
+        raise RedirectNeeded(redirect_to["href"])
+
+    def _set_waiting(self, payment) -> None:
         payment.change_status(PaymentStatus.WAITING)
         payment.save()
-        raise RedirectNeeded(redirect_to["href"])
 
     def process_data(self, payment, request):
-        success_url = payment.get_success_url()
         failure_url = payment.get_failure_url()
         if "token" not in request.GET:
             return HttpResponseForbidden("FAILED")
         payer_id = request.GET.get("PayerID")
         if not payer_id:
-            if payment.status != PaymentStatus.CONFIRMED:
-                payment.change_status(PaymentStatus.REJECTED)
-                return redirect(failure_url)
-            return redirect(success_url)
+            return self._payment_not_approved(payment)
         try:
             executed_payment = self.execute_payment(payment, payer_id)
         except PaymentError:
             return redirect(failure_url)
         except KeyError:
             return HttpResponseBadRequest()
+        return self._payment_executed(payment, executed_payment)
+
+    async def aprocess_data(self, payment, request):
+        if self._overrides("process_data", PaypalProvider) or self._overrides(
+            "execute_payment", PaypalProvider
+        ):
+            return await super().aprocess_data(payment, request)
+        failure_url = payment.get_failure_url()
+        if "token" not in request.GET:
+            return HttpResponseForbidden("FAILED")
+        payer_id = request.GET.get("PayerID")
+        if not payer_id:
+            return await sync_to_async(self._payment_not_approved)(payment)
+        try:
+            links = self._get_links(payment)
+            executed_payment = await self.apost(
+                payment, links["execute"]["href"], data={"payer_id": payer_id}
+            )
+        except PaymentError:
+            return redirect(failure_url)
+        except KeyError:
+            return HttpResponseBadRequest()
+        return await sync_to_async(self._payment_executed)(payment, executed_payment)
+
+    def _payment_not_approved(self, payment):
+        if payment.status != PaymentStatus.CONFIRMED:
+            payment.change_status(PaymentStatus.REJECTED)
+            return redirect(payment.get_failure_url())
+        return redirect(payment.get_success_url())
+
+    def _payment_executed(self, payment, executed_payment):
+        success_url = payment.get_success_url()
         self.set_response_links(payment, executed_payment)
         payment.attrs.payer_info = executed_payment["payer"]["payer_info"]
         if self._capture:
@@ -331,21 +495,53 @@ class PaypalProvider(BasicProvider):
     def capture(self, payment, amount=None):
         if amount is None:
             amount = payment.total
-        amount_data = self.get_amount_data(payment, amount)
-        capture_data = {"amount": amount_data, "is_final_capture": True}
-        links = self._get_links(payment)
-        url = links["capture"]["href"]
+        url, capture_data = self._get_capture_request(payment, amount)
         try:
             capture = self.post(payment, url, data=capture_data)
         except HTTPError as e:
-            try:
-                error = e.response.json()
-            except ValueError:
-                error = {}
-            if error.get("name") != "AUTHORIZATION_ALREADY_COMPLETED":
-                raise e
+            if not self._is_already_captured(e.response):
+                raise
+            capture = {"state": "completed"}
+        return self._set_capture_state(payment, amount, capture["state"])
+
+    async def acapture(self, payment, amount=None):
+        if self._overrides("capture", PaypalProvider):
+            return await super().acapture(payment, amount)
+        import httpx
+
+        if amount is None:
+            amount = payment.total
+        url, capture_data = self._get_capture_request(payment, amount)
+        try:
+            capture = await self.apost(payment, url, data=capture_data)
+        except httpx.HTTPStatusError as e:
+            if not self._is_already_captured(e.response):
+                raise
             capture = {"state": "completed"}
-        state = capture["state"]
+        return await sync_to_async(self._set_capture_state)(
+            payment, amount, capture["state"]
+        )
+
+    def _is_already_captured(self, response) -> bool:
+        """Whether an error response says the authorization was captured already.
+
+        Works with both ``requests`` and ``httpx`` responses.
+        """
+        try:
+            error = response.json()
+        except ValueError:
+            error = {}
+        return error.get("name") == "AUTHORIZATION_ALREADY_COMPLETED"
+
+    def _get_capture_request(self, payment, amount) -> tuple[str, dict]:
+        amount_data = self.get_amount_data(payment, amount)
+        links = self._get_links(payment)
+        return links["capture"]["href"], {
+            "amount": amount_data,
+            "is_final_capture": True,
+        }
+
+    def _set_capture_state(self, payment, amount, state):
         if state == "completed":
             payment.change_status(PaymentStatus.CONFIRMED)
             return amount
@@ -364,13 +560,33 @@ class PaypalProvider(BasicProvider):
         url = links["void"]["href"]
         self.post(payment, url)
 
+    async def arelease(self, payment) -> None:
+        if self._overrides("release", PaypalProvider):
+            return await super().arelease(payment)
+        links = self._get_links(payment)
+        await self.apost(payment, links["void"]["href"])
+        return None
+
     def refund(self, payment, amount=None):
+        url, refund_data = self._get_refund_request(payment, amount)
+        response = self.post(payment, url, data=refund_data)
+        return self._set_refunded(payment, response)
+
+    async def arefund(self, payment, amount=None):
+        if self._overrides("refund", PaypalProvider):
+            return await super().arefund(payment, amount)
+        url, refund_data = self._get_refund_request(payment, amount)
+        response = await self.apost(payment, url, data=refund_data)
+        return await sync_to_async(self._set_refunded)(payment, response)
+
+    def _get_refund_request(self, payment, amount) -> tuple[str, dict]:
         refund_data = {}
         if amount is not None:
             refund_data["amount"] = self.get_amount_data(payment, amount)
         links = self._get_links(payment)
-        url = links["refund"]["href"]
-        response = self.post(payment, url, data=refund_data)
+        return links["refund"]["href"], refund_data
+
+    def _set_refunded(self, payment, response) -> Decimal:
         payment.change_status(PaymentStatus.REFUNDED)
         if response["amount"]["currency"] != payment.currency:
             raise NotImplementedError(
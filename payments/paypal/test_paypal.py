@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import json
 from copy import deepcopy
 from datetime import date
@@ -9,13 +10,15 @@ from unittest.mock import Mock
 from unittest.mock import patch
 
 import pytest
-from django.utils import timezone
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
 from requests import HTTPError
 
 from payments import PaymentError
 from payments import PaymentStatus
 from payments import PurchasedItem
 from payments import RedirectNeeded
+from payments.models import PaymentAttributeProxy
 
 from . import PaypalCardProvider
 from . import PaypalProvider
@@ -118,6 +121,10 @@ class Payment(Mock):
     def pk(self) -> int:
         return self.id
 
+    @property
+    def attrs(self) -> PaymentAttributeProxy:
+        return PaymentAttributeProxy(self)
+
     def change_status(self, status: str, message: str = "") -> None:
         self.status = status
         self.message = message
@@ -199,6 +206,11 @@ class Payment(Mock):
 # PaypalProvider tests
 
 
+@pytest.fixture(autouse=True)
+def _clear_token_cache() -> None:
+    cache.clear()
+
+
 @pytest.fixture
 def paypal_payment() -> Payment:
     Payment.objects.delete()
@@ -215,8 +227,8 @@ def test_provider_raises_redirect_needed_on_success(
     paypal_provider: PaypalProvider,
 ) -> None:
     with (
-        patch("requests.post") as mocked_post,
-        patch("requests.request") as mocked_request,
+        patch("requests.Session.post") as mocked_post,
+        patch("requests.Session.request") as mocked_request,
     ):
         transaction_id = "1234"
         data = MagicMock()
@@ -239,8 +251,8 @@ def test_provider_raises_redirect_needed_on_success(
     assert paypal_payment.transaction_id == transaction_id
 
 
-@patch("requests.request")
-@patch("requests.post")
+@patch("requests.Session.request")
+@patch("requests.Session.post")
 def test_provider_captures_payment(
     mocked_post: MagicMock,
     mocked_request: MagicMock,
@@ -262,7 +274,7 @@ def test_provider_captures_payment(
     assert paypal_payment.status == PaymentStatus.CONFIRMED
 
 
-@patch("requests.post")
+@patch("requests.Session.post")
 def test_provider_handles_captured_payment(
     mocked_post: MagicMock, paypal_payment: Payment, paypal_provider: PaypalProvider
 ) -> None:
@@ -275,8 +287,8 @@ def test_provider_handles_captured_payment(
     assert paypal_payment.status == PaymentStatus.CONFIRMED
 
 
-@patch("requests.request")
-@patch("requests.post")
+@patch("requests.Session.request")
+@patch("requests.Session.post")
 def test_provider_refunds_payment_fully(
     mocked_post: MagicMock,
     mocked_request: MagicMock,
@@ -307,8 +319,8 @@ def test_provider_refunds_payment_fully(
     assert paypal_payment.status == PaymentStatus.REFUNDED
 
 
-@patch("requests.request")
-@patch("requests.post")
+@patch("requests.Session.request")
+@patch("requests.Session.post")
 def test_provider_refunds_payment_partially(
     mocked_post: MagicMock,
     mocked_request: MagicMock,
@@ -339,8 +351,8 @@ def test_provider_refunds_payment_partially(
     assert paypal_payment.status == PaymentStatus.REFUNDED
 
 
-@patch("requests.request")
-@patch("requests.post")
+@patch("requests.Session.request")
+@patch("requests.Session.post")
 @patch("payments.paypal.redirect")
 def test_provider_redirects_on_success_captured_payment(
     mocked_redirect: MagicMock,
@@ -379,8 +391,8 @@ def test_provider_redirects_on_success_captured_payment(
     assert paypal_payment.captured_amount == paypal_payment.total
 
 
-@patch("requests.request")
-@patch("requests.post")
+@patch("requests.Session.request")
+@patch("requests.Session.post")
 @patch("payments.paypal.redirect")
 def test_provider_redirects_on_success_preauth_payment(
     mocked_redirect: MagicMock,
@@ -431,39 +443,237 @@ def test_provider_request_without_payerid_redirects_on_failure(
     assert paypal_payment.status == PaymentStatus.REJECTED
 
 
-@patch("requests.request")
-@patch("requests.post")
+@patch("requests.Session.request")
+@patch("requests.Session.post")
 def test_provider_renews_access_token(
     mocked_post: MagicMock,
     mocked_request: MagicMock,
     paypal_payment: Payment,
     paypal_provider: PaypalProvider,
 ) -> None:
-    new_token = "new_test_token"
+    expired = MagicMock()
+    expired.json.return_value = {
+        "access_token": "expired_token",
+        "token_type": "type",
+        "expires_in": 99999,
+    }
+    renewed = MagicMock()
+    renewed.json.return_value = {
+        "access_token": "new_test_token",
+        "token_type": "type",
+        "expires_in": 99999,
+    }
     response401 = MagicMock()
     response401.status_code = 401
-    data = MagicMock()
-    data.return_value = {"access_token": new_token, "token_type": "type"}
+    response401.json.return_value = {"error": "invalid_token"}
     response = MagicMock()
-    response.json = data
-    response.status_code = 200
-    # The API call 401s, @authorize renews the token via oauth and retries.
-    mocked_request.side_effect = [HTTPError(response=response401), response]
-    mocked_post.return_value = response
+    response.status_code = 201
+    response.json.return_value = {"id": "1234", "links": []}
+    # The API call 401s, the shared token is dropped, renewed and retried once.
+    mocked_request.side_effect = [response401, response]
+    mocked_post.side_effect = [expired, renewed]
 
-    paypal_payment.created = timezone.now()
-    paypal_payment.extra_data = json.dumps(
-        {
-            "auth_response": {
-                "access_token": "expired_token",
-                "token_type": "token type",
-                "expires_in": 99999,
-            }
-        }
-    )
     paypal_provider.create_payment(paypal_payment)
-    payment_response = json.loads(paypal_payment.extra_data)["auth_response"]
-    assert payment_response["access_token"] == new_token
+    assert mocked_request.call_count == 2
+    assert [
+        call.kwargs["headers"]["Authorization"]
+        for call in mocked_request.call_args_list
+    ] == ["type expired_token", "type new_test_token"]
+    assert paypal_provider.get_access_token() == "type new_test_token"
+    assert cache.get(paypal_provider._token_cache_key)[0] == "type new_test_token"
+    assert mocked_post.call_count == 2
+    assert paypal_payment.status != PaymentStatus.ERROR
+
+
+@patch("requests.Session.request")
+@patch("requests.Session.post")
+def test_provider_retries_rejected_access_token_once(
+    mocked_post: MagicMock,
+    mocked_request: MagicMock,
+    paypal_payment: Payment,
+    paypal_provider: PaypalProvider,
+) -> None:
+    mocked_post.return_value.json.return_value = {
+        "access_token": "revoked_token",
+        "token_type": "type",
+        "expires_in": 99999,
+    }
+    mocked_request.return_value.status_code = 401
+    mocked_request.return_value.json.return_value = {}
+
+    with pytest.raises(PaymentError):
+        paypal_provider.create_payment(paypal_payment)
+    assert mocked_request.call_count == 2
+    assert mocked_post.call_count == 2
+    assert paypal_payment.status == PaymentStatus.ERROR
+
+
+@patch("requests.Session.post")
+def test_provider_shares_access_token(mocked_post: MagicMock) -> None:
+    mocked_post.return_value.json.return_value = {
+        "access_token": "shared_token",
+        "token_type": "Bearer",
+        "expires_in": 3600,
+    }
+    provider = PaypalProvider(secret=SECRET, client_id=CLIENT_ID)
+    assert provider.get_access_token() == "Bearer shared_token"
+    assert provider.get_access_token(Payment()) == "Bearer shared_token"
+    # Another process (or a rebuilt provider) reads it from the Django cache.
+    other = PaypalProvider(secret=SECRET, client_id=CLIENT_ID)
+    assert other.get_access_token() == "Bearer shared_token"
+    assert mocked_post.call_count == 1
+
+    other.invalidate_access_token()
+    provider.invalidate_access_token()
+    provider.get_access_token()
+    assert mocked_post.call_count == 2
+
+
+@patch("requests.Session.post")
+def test_provider_renews_access_token_before_expiry(mocked_post: MagicMock) -> None:
+    mocked_post.return_value.json.return_value = {
+        "access_token": "short_lived_token",
+        "token_type": "Bearer",
+        "expires_in": PaypalProvider.token_refresh_margin,
+    }
+    provider = PaypalProvider(secret=SECRET, client_id=CLIENT_ID, token_cache=None)
+    provider.get_access_token()
+    provider.get_access_token()
+    assert mocked_post.call_count == 2
+
+
+def mock_async_client(handler):
+    httpx = pytest.importorskip("httpx")
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_provider_requests_access_token_once_async() -> None:
+    httpx = pytest.importorskip("httpx")
+    requests = []
+
+    async def handler(request):
+        requests.append(request.url.path)
+        # Let the other callers run while the token is being requested.
+        await asyncio.sleep(0.01)
+        return httpx.Response(
+            200,
+            json={"token_type": "Bearer", "access_token": "token", "expires_in": 3600},
+        )
+
+    async def get_tokens(provider):
+        return await asyncio.gather(*(provider.aget_access_token() for _i in range(5)))
+
+    provider = PaypalProvider(secret=SECRET, client_id=CLIENT_ID, token_cache=None)
+    client = mock_async_client(handler)
+    with patch.object(PaypalProvider, "get_async_http_client", return_value=client):
+        tokens = async_to_sync(get_tokens)(provider)
+
+    assert tokens == ["Bearer token"] * 5
+    assert requests == ["/v1/oauth2/token"]
+
+
+def test_provider_raises_redirect_needed_on_success_async(
+    paypal_payment: Payment,
+    paypal_provider: PaypalProvider,
+) -> None:
+    httpx = pytest.importorskip("httpx")
+    paths = []
+
+    def handler(request):
+        paths.append(request.url.path)
+        if request.url.path == "/v1/oauth2/token":
+            return httpx.Response(
+                200,
+                json={
+                    "token_type": "Bearer",
+                    "access_token": "token",
+                    "expires_in": 60,
+                },
+            )
+        assert request.headers["Authorization"] == "Bearer token"
+        assert json.loads(request.content)["intent"] == "sale"
+        return httpx.Response(
+            201,
+            json={
+                "id": "1234",
+                "links": [{"rel": "approval_url", "href": "http://approval_url.com"}],
+            },
+        )
+
+    client = mock_async_client(handler)
+    with (
+        patch.object(PaypalProvider, "get_async_http_client", return_value=client),
+        pytest.raises(RedirectNeeded),
+    ):
+        async_to_sync(paypal_provider.aget_form)(paypal_payment)
+
+    assert paths == ["/v1/oauth2/token", "/v1/payments/payment"]
+    assert paypal_payment.status == PaymentStatus.WAITING
+    assert paypal_payment.transaction_id == "1234"
+
+
+def test_provider_renews_access_token_async(
+    paypal_payment: Payment,
+    paypal_provider: PaypalProvider,
+) -> None:
+    httpx = pytest.importorskip("httpx")
+    tokens = iter(["expired_token", "new_test_token"])
+
+    def handler(request):
+        if request.url.path == "/v1/oauth2/token":
+            return httpx.Response(
+                200,
+                json={
+                    "token_type": "Bearer",
+                    "access_token": next(tokens),
+                    "expires_in": 99999,
+                },
+            )
+        if request.headers["Authorization"] != "Bearer new_test_token":
+            return httpx.Response(401)
+        return httpx.Response(200, json={"state": "completed"})
+
+    client = mock_async_client(handler)
+    with patch.object(PaypalProvider, "get_async_http_client", return_value=client):
+        amount = async_to_sync(paypal_provider.acapture)(paypal_payment)
+
+    assert amount == paypal_payment.total
+    assert paypal_payment.status == PaymentStatus.CONFIRMED
+    assert paypal_provider.get_access_token() == "Bearer new_test_token"
+
+
+def test_provider_handles_captured_payment_async(
+    paypal_payment: Payment, paypal_provider: PaypalProvider
+) -> None:
+    httpx = pytest.importorskip("httpx")
+
+    def handler(request):
+        return httpx.Response(400, json={"name": "AUTHORIZATION_ALREADY_COMPLETED"})
+
+    client = mock_async_client(handler)
+    with patch.object(PaypalProvider, "get_async_http_client", return_value=client):
+        amount = async_to_sync(paypal_provider.acapture)(paypal_payment)
+
+    assert amount == paypal_payment.total
+    assert paypal_payment.status == PaymentStatus.CONFIRMED
+
+
+def test_provider_raises_other_capture_errors_async(
+    paypal_payment: Payment, paypal_provider: PaypalProvider
+) -> None:
+    httpx = pytest.importorskip("httpx")
+
+    def handler(request):
+        return httpx.Response(400, json={"name": "INVALID_CLIENT"})
+
+    client = mock_async_client(handler)
+    with (
+        patch.object(PaypalProvider, "get_async_http_client", return_value=client),
+        pytest.raises(httpx.HTTPStatusError),
+    ):
+        async_to_sync(paypal_provider.acapture)(paypal_payment)
+
+    assert paypal_payment.status != PaymentStatus.CONFIRMED
 
 
 # PaypalCardProvider tests
@@ -483,8 +693,8 @@ def test_provider_raises_redirect_needed_on_success_captured_payment_card(
     paypal_card_payment: Payment, paypal_card_provider: PaypalCardProvider
 ) -> None:
     with (
-        patch("requests.post") as mocked_post,
-        patch("requests.request") as mocked_request,
+        patch("requests.Session.post") as mocked_post,
+        patch("requests.Session.request") as mocked_request,
     ):
         transaction_id = "1234"
         data = MagicMock()
@@ -529,8 +739,8 @@ def test_provider_raises_redirect_needed_on_success_preauth_payment_card(
 ) -> None:
     provider = PaypalCardProvider(secret=SECRET, client_id=CLIENT_ID, capture=False)
     with (
-        patch("requests.post") as mocked_post,
-        patch("requests.request") as mocked_request,
+        patch("requests.Session.post") as mocked_post,
+        patch("requests.Session.request") as mocked_request,
     ):
         transaction_id = "1234"
         data = MagicMock()
@@ -574,7 +784,7 @@ def test_form_shows_validation_error_message(
     paypal_card_payment: Payment,
     paypal_card_provider: PaypalCardProvider,
 ) -> None:
-    with patch("requests.post") as mocked_post:
+    with patch("requests.Session.post") as mocked_post:
         error_message = "error message"
         data = MagicMock()
         data.return_value = {"details": [{"issue": error_message}]}
@@ -597,8 +807,8 @@ def test_provider_get_with_none_payment(paypal_provider: PaypalProvider) -> None
     expected_token_type = "Bearer"
 
     with (
-        patch("requests.post") as mocked_post,
-        patch("requests.request") as mocked_request,
+        patch("requests.Session.post") as mocked_post,
+        patch("requests.Session.request") as mocked_request,
     ):
         # Mock for token acquisition
         token_response_mock = MagicMock()
@@ -642,8 +852,8 @@ def test_form_shows_internal_error_message(
     paypal_card_provider: PaypalCardProvider,
 ) -> None:
     with (
-        patch("requests.post") as mocked_post,
-        patch("requests.request") as mocked_request,
+        patch("requests.Session.post") as mocked_post,
+        patch("requests.Session.request") as mocked_request,
     ):
         error_message = "error message"
         data = MagicMock()
@@ -675,8 +885,8 @@ def test_provider_get_with_none_payment_handles_401(
     expected_token_type = "Bearer"
 
     with (
-        patch("requests.post") as mocked_post,
-        patch("requests.request") as mocked_request,
+        patch("requests.Session.post") as mocked_post,
+        patch("requests.Session.request") as mocked_request,
     ):
         # Mock for token acquisition (called twice due to 401 retry)
         token_response_mock = MagicMock()
@@ -696,10 +906,7 @@ def test_provider_get_with_none_payment_handles_401(
         get_response_200.status_code = 200
 
         mocked_post.return_value = token_response_mock
-        mocked_request.side_effect = [
-            HTTPError(response=get_response_401),
-            get_response_200,
-        ]
+        mocked_request.side_effect = [get_response_401, get_response_200]
 
         response_data = paypal_provider.get(None, test_url)
 
@@ -708,3 +915,13 @@ def test_provider_get_with_none_payment_handles_401(
         # Should have called the API twice (initial 401 + retry)
         assert mocked_request.call_count == 2
         assert response_data == expected_get_response_data
+
+
+def test_card_provider_async_form_uses_sync_form(
+    paypal_card_payment: Payment,
+    paypal_card_provider: PaypalCardProvider,
+) -> None:
+    with patch.object(PaypalCardProvider, "get_form") as get_form:
+        form = async_to_sync(paypal_card_provider.aget_form)(paypal_card_payment)
+    assert form is get_form.return_value
+    get_form.assert_called_once_with(paypal_card_payment, data=None)
@@ -0,0 +1,242 @@
+"""
+Reconciliation of payments whose webhooks may have been missed.
+
+Payments that are still waiting (or pre-authorized) are grouped by variant and
+their providers are asked for the current state of each batch with
+:meth:`~payments.core.BasicProvider.poll_statuses`. Gateways are polled from a
+bounded thread pool, while all database access happens in the calling thread.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.db import router
+from django.db import transaction
+from django.utils import timezone
+
+from . import PaymentStatus
+from . import get_payment_model
+from .core import BasicProvider
+from .core import provider_factory
+from .outbox import outbox_enabled
+from .signals import status_changed
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from datetime import timedelta
+    from decimal import Decimal
+
+    from django.db.models import QuerySet
+
+    from .core import StatusUpdate
+    from .models import BasePayment
+
+logger = logging.getLogger(__name__)
+
+#: Statuses of payments that are waiting for news from their gateway.
+RECONCILE_STATUSES = (PaymentStatus.WAITING, PaymentStatus.PREAUTH)
+
+#: Calls to ``poll_statuses`` per second for variants without a configured limit.
+DEFAULT_RATE_LIMIT = 5
+
+
+class RateLimiter:
+    """Spaces calls out so that at most ``rate`` of them start each second.
+
+    ``None`` (or ``0``) means no limit. Safe to share between threads.
+    """
+
+    def __init__(self, rate: float | None) -> None:
+        self.interval = 1 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def reconcile_payments(
+    queryset: QuerySet | None = None,
+    variants: list[str] | None = None,
+    older_than: timedelta | None = None,
+    max_workers: int = 4,
+    rate_limits: dict[str, float | None] | None = None,
+) -> dict[str, int]:
+    """Poll gateways for waiting payments and save the changes they report.
+
+    Batches of payments are polled on ``max_workers`` threads. Each variant's
+    provider is called at most ``rate_limits[variant]`` times per second, which
+    defaults to the ``PAYMENT_RECONCILE_RATE_LIMITS`` setting and then
+    :data:`DEFAULT_RATE_LIMIT`. The changes in each batch are written with a
+    single query, skipping payments that changed in the meantime (e.g.: due to
+    a webhook), and ``status_changed`` is sent for each of them (or recorded in
+    the :ref:`status outbox <status-outbox>`).
+
+    Variants whose provider does not implement
+    :meth:`~payments.core.BasicProvider.poll_statuses` are skipped.
+
+    :param queryset: The payments to consider. Defaults to all payments of
+        ``PAYMENT_MODEL``.
+    :param variants: Only reconcile payments of these variants.
+    :param older_than: Only reconcile payments that have not been modified for
+        this long, leaving recent ones to their webhooks.
+    :returns: The number of updated payments of each variant.
+    """
+    if queryset is None:
+        queryset = get_payment_model()._default_manager.all()
+    queryset = queryset.filter(status__in=RECONCILE_STATUSES)
+    if variants is not None:
+        queryset = queryset.filter(variant__in=variants)
+    if older_than is not None:
+        queryset = queryset.filter(modified__lte=timezone.now() - older_than)
+    limits = {
+        **getattr(settings, "PAYMENT_RECONCILE_RATE_LIMITS", {}),
+        **(rate_limits or {}),
+    }
+
+    limiters: dict[str, RateLimiter] = {}
+    updated: dict[str, int] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: dict = {}
+
+        def collect(return_when) -> None:
+            done, _not_done = wait(pending, return_when=return_when)
+            for future in done:
+                variant, batch = pending.pop(future)
+                try:
+                    updates = future.result()
+                except Exception:
+                    logger.exception("Could not poll payments of %r", variant)
+                    continue
+                count = _apply_updates(queryset.model, batch, updates)
+                updated[variant] = updated.get(variant, 0) + count
+
+        for variant, provider, batch in _get_batches(queryset):
+            if variant not in limiters:
+                limiters[variant] = RateLimiter(limits.get(variant, DEFAULT_RATE_LIMIT))
+            limiter = limiters[variant]
+            future = executor.submit(_poll, provider, limiter, batch)
+            pending[future] = (variant, batch)
+            # Don't load more payments than the pool can work on.
+            if len(pending) >= 2 * max_workers:
+                collect(FIRST_COMPLETED)
+        if pending:
+            collect(ALL_COMPLETED)
+    return updated
+
+
+def _get_batches(
+    queryset: QuerySet,
+) -> Iterator[tuple[str, BasicProvider, list[BasePayment]]]:
+    variant_names = queryset.order_by().values_list("variant", flat=True).distinct()
+    for variant in sorted(variant_names):
+        try:
+            provider = provider_factory(variant)
+        except ValueError:
+            logger.warning("Skipping payments of unknown variant %r", variant)
+            continue
+        if not provider._overrides("poll_statuses", BasicProvider):
+            logger.debug("Provider of %r does not support polling", variant)
+            continue
+        last_pk = None
+        while True:
+            batch_queryset = queryset.filter(variant=variant).order_by("pk")
+            if last_pk is not None:
+                batch_queryset = batch_queryset.filter(pk__gt=last_pk)
+            batch = list(batch_queryset[: provider.poll_batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            yield variant, provider, batch
+
+
+def _poll(
+    provider: BasicProvider,
+    limiter: RateLimiter,
+    batch: list[BasePayment],
+) -> dict:
+    limiter.wait()
+    return provider.poll_statuses(batch)
+
+
+def _apply_updates(model, batch: list[BasePayment], updates: dict) -> int:
+    changes: list[tuple[BasePayment, StatusUpdate, Decimal]] = []
+    for payment in batch:
+        update = updates.get(payment.pk)
+        if update is None:
+            continue
+        captured_amount = (
+            payment.captured_amount
+            if update.captured_amount is None
+            else update.captured_amount
+        )
+        if (
+            update.status != payment.status
+            or captured_amount != payment.captured_amount
+        ):
+            changes.append((payment, update, captured_amount))
+    if not changes:
+        return 0
+
+    using = router.db_for_write(model)
+    manager = model._default_manager.db_manager(using)
+    with transaction.atomic(using=using):
+        current = dict(
+            manager.select_for_update()
+            .filter(pk__in=[payment.pk for payment, _update, _amount in changes])
+            .values_list("pk", "status")
+        )
+        now = timezone.now()
+        changed = []
+        fields = ["status", "message", "captured_amount", "modified"]
+        for payment, update, captured_amount in changes:
+            if current.get(payment.pk) != payment.status:
+                continue
+            payment.status = update.status
+            payment.message = update.message
+            payment.captured_amount = captured_amount
+            payment.modified = now
+            if update.extra_data is not None:
+                payment.extra_data = update.extra_data
+                if "extra_data" not in fields:
+                    fields.append("extra_data")
+            changed.append(payment)
+        manager.bulk_update(changed, fields)
+        for payment in changed:
+            payment._store_loaded_values(fields)
+
+        if outbox_enabled():
+            from .outbox.models import StatusChange
+
+            StatusChange.record_current(changed, using=using)
+        else:
+            transaction.on_commit(
+                lambda: _send_status_changed(model, changed), using=using
+            )
+    return len(changed)
+
+
+def _send_status_changed(model, payments: list[BasePayment]) -> None:
+    for payment in payments:
+        status_changed.send(
+            sender=model,
+            instance=payment,
+            status=payment.status,
+            message=payment.message,
+        )
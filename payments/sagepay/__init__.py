@@ -1,9 +1,5 @@
 from __future__ import annotations
 
-import binascii
-
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers import Cipher
 from cryptography.hazmat.primitives.ciphers import algorithms
 from cryptography.hazmat.primitives.ciphers import modes
@@ -13,6 +9,63 @@ from django.shortcuts import redirect
 from payments import PaymentStatus
 from payments.core import BasicProvider
 
+BLOCK_SIZE = 16
+
+
+class SagepayCrypt:
+    """Encodes and decodes the ``Crypt`` field of the Sage Pay Form protocol.
+
+    Fields are joined as ``key=value`` pairs, padded with PKCS#7 and encrypted
+    with AES-CBC, using the encryption key as the IV as well. The cipher is
+    built once; each call gets its own encryption context, so a codec may be
+    shared between threads.
+
+    :param key: Encryption key assigned by Sage Pay.
+    """
+
+    def __init__(self, key: bytes) -> None:
+        self._cipher = Cipher(algorithms.AES(key), modes.CBC(key))
+
+    def encrypt(self, text: str) -> bytes:
+        data = text.encode("utf-8")
+        pad = BLOCK_SIZE - len(data) % BLOCK_SIZE
+        encryptor = self._cipher.encryptor()
+        encrypted = encryptor.update(data + bytes((pad,)) * pad) + encryptor.finalize()
+        return b"@" + encrypted.hex().encode("ascii")
+
+    def decrypt(self, crypt: str | bytes) -> str:
+        """Return the text of a ``Crypt`` value.
+
+        :raises ValueError: if ``crypt`` is not valid hex or is badly padded.
+        """
+        if isinstance(crypt, bytes):
+            crypt = crypt.decode("ascii")
+        encrypted = bytes.fromhex(crypt.removeprefix("@"))
+        if not encrypted or len(encrypted) % BLOCK_SIZE:
+            raise ValueError("Invalid Sage Pay crypt length")
+        decryptor = self._cipher.decryptor()
+        data = decryptor.update(encrypted) + decryptor.finalize()
+        pad = data[-1]
+        if not 0 < pad <= BLOCK_SIZE or data[-pad:] != bytes((pad,)) * pad:
+            raise ValueError("Invalid Sage Pay crypt padding")
+        return data[:-pad].decode("utf-8")
+
+    def encode(self, fields: dict) -> bytes:
+        """Return the ``Crypt`` value of a mapping of fields."""
+        return self.encrypt("&".join(f"{key}={value}" for key, value in fields.items()))
+
+    def decode(self, crypt: str | bytes) -> dict[str, str]:
+        """Return the fields of a ``Crypt`` value.
+
+        Values may contain ``=``; fields without one are ignored.
+        """
+        fields = {}
+        for pair in self.decrypt(crypt).split("&"):
+            key, sep, value = pair.partition("=")
+            if sep:
+                fields[key] = value
+        return fields
+
 
 class SagepayProvider(BasicProvider):
     """
@@ -37,33 +90,16 @@ class SagepayProvider(BasicProvider):
         self._vendor = vendor
         self._enckey = encryption_key.encode("utf-8")
         self._action = endpoint
+        self.crypt = SagepayCrypt(self._enckey)
         super().__init__(**kwargs)
         if not self._capture:
             raise ImproperlyConfigured("Sagepay does not support pre-authorization.")
 
-    def _get_cipher(self):
-        backend = default_backend()
-        return Cipher(
-            algorithms.AES(self._enckey), modes.CBC(self._enckey), backend=backend
-        )
-
-    def _get_padding(self):
-        return padding.PKCS7(128)
-
     def aes_enc(self, data):
-        data = data.encode("utf-8")
-        padder = self._get_padding().padder()
-        data = padder.update(data) + padder.finalize()
-        encryptor = self._get_cipher().encryptor()
-        enc = encryptor.update(data) + encryptor.finalize()
-        return b"@" + binascii.hexlify(enc)
+        return self.crypt.encrypt(data)
 
     def aes_dec(self, data):
-        data = data.lstrip(b"@")
-        data = binascii.unhexlify(data)
-        decryptor = self._get_cipher().decryptor()
-        data = decryptor.update(data) + decryptor.finalize()
-        return data.decode("utf-8")
+        return self.crypt.decrypt(data)
 
     def get_hidden_fields(self, payment):
         payment.save()
@@ -93,8 +129,7 @@ class SagepayProvider(BasicProvider):
         if payment.billing_country_code == "US":
             data["BillingState"] = payment.billing_country_area
             data["DeliveryState"] = payment.billing_country_area
-        udata = "&".join("{}={}".format(*kv) for kv in data.items())
-        crypt = self.aes_enc(udata)
+        crypt = self.crypt.encode(data)
         return {
             "VPSProtocol": self._version,
             "TxType": "PAYMENT",
@@ -103,11 +138,7 @@ class SagepayProvider(BasicProvider):
         }
 
     def process_data(self, payment, request):
-        udata = self.aes_dec(request.GET["crypt"])
-        data = {}
-        for kv in udata.split("&"):
-            k, v = kv.split("=")
-            data[k] = v
+        data = self.crypt.decode(request.GET["crypt"])
         success_url = payment.get_success_url()
         if payment.status == PaymentStatus.WAITING:
             # If the payment is not in waiting state, we probably have a page reload.
@@ -53,12 +53,11 @@ def test_provider_raises_redirect_needed_on_success(
     payment: Payment,
     provider: SagepayProvider,
 ) -> None:
-    raw_data = {"Status": "OK"}
-    data = "&".join("{}={}".format(*kv) for kv in raw_data.items())
-    with patch.object(SagepayProvider, "aes_dec", return_value=data):
-        provider.process_data(payment, MagicMock())
-        assert payment.status == PaymentStatus.CONFIRMED
-        assert payment.captured_amount == payment.total
+    request = MagicMock()
+    request.GET = {"crypt": provider.crypt.encode({"Status": "OK"}).decode()}
+    provider.process_data(payment, request)
+    assert payment.status == PaymentStatus.CONFIRMED
+    assert payment.captured_amount == payment.total
 
 
 @patch("payments.sagepay.redirect")
@@ -67,12 +66,11 @@ def test_provider_raises_redirect_needed_on_failure(
     payment: Payment,
     provider: SagepayProvider,
 ) -> None:
-    raw_data = {"Status": ""}
-    data = "&".join("{}={}".format(*kv) for kv in raw_data.items())
-    with patch.object(SagepayProvider, "aes_dec", return_value=data):
-        provider.process_data(payment, MagicMock())
-        assert payment.status == PaymentStatus.REJECTED
-        assert payment.captured_amount == 0
+    request = MagicMock()
+    request.GET = {"crypt": provider.crypt.encode({"Status": ""}).decode()}
+    provider.process_data(payment, request)
+    assert payment.status == PaymentStatus.REJECTED
+    assert payment.captured_amount == 0
 
 
 def test_provider_encrypts_data(payment: Payment, provider: SagepayProvider) -> None:
@@ -84,3 +82,32 @@ def test_provider_encrypts_data(payment: Payment, provider: SagepayProvider) ->
 def test_encrypt_method_returns_valid_data(provider: SagepayProvider) -> None:
     encrypted = provider.aes_enc("mirumee")
     assert encrypted == b"@e63c293672f50b9c8e291831facb4e4f"
+
+
+def test_crypt_round_trip(provider: SagepayProvider) -> None:
+    fields = {
+        "Status": "OK",
+        "StatusDetail": "0000 : The Authorisation was Successful.",
+        "VPSTxId": "{AB12=CD34}",
+        "Surname": "Ünicode",
+    }
+    crypt = provider.crypt.encode(fields)
+    assert provider.crypt.decode(crypt) == fields
+    assert provider.crypt.decode(crypt.decode()) == fields
+    assert provider.aes_dec(crypt) == "&".join(f"{k}={v}" for k, v in fields.items())
+
+
+@pytest.mark.parametrize(
+    ("crypt", "message"),
+    [
+        ("@zz", "non-hexadecimal"),
+        ("@", "length"),
+        ("@e63c293672f50b9c", "length"),
+        ("@" + bytes(16).hex(), "padding"),
+    ],
+)
+def test_decrypt_rejects_invalid_crypt(
+    provider: SagepayProvider, crypt: str, message: str
+) -> None:
+    with pytest.raises(ValueError, match=message):
+        provider.crypt.decode(crypt)
@@ -5,3 +5,7 @@ from django.dispatch import Signal
 # Signal sent whenever status is changed for a Payment. This usually happens
 # when a transaction is either accepted or rejected.
 status_changed = Signal()
+
+# Signal sent once for each call to ``bulk_create_payments()``, with all the
+# created payments as ``instances``, even if they were inserted in batches.
+payments_created = Signal()
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 import json
+from typing import TYPE_CHECKING
 
-import requests
 import xmltodict
+from asgiref.sync import sync_to_async
 from django.http import HttpResponseForbidden
 from django.shortcuts import redirect
 from django.template.loader import render_to_string
@@ -13,6 +14,21 @@ from payments import PaymentError
 from payments import PaymentStatus
 from payments import RedirectNeeded
 from payments.core import BasicProvider
+from payments.core import StatusUpdate
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from collections.abc import Iterator
+
+#: Maximum number of transactions in one transaction request.
+TRANSACTION_REQUEST_LIMIT = 100
+
+#: Payment statuses for Sofort transaction statuses. Transactions in any other
+#: status (e.g.: ``pending`` or ``untraceable``) have been paid.
+STATUS_MAP = {
+    "loss": PaymentStatus.REJECTED,
+    "refunded": PaymentStatus.REFUNDED,
+}
 
 
 class SofortProvider(BasicProvider):
@@ -38,7 +54,7 @@ class SofortProvider(BasicProvider):
         super().__init__(**kwargs)
 
     def post_request(self, xml_request):
-        response = requests.post(
+        response = self.http_session.post(
             self.endpoint,
             data=xml_request.encode("utf-8"),
             headers={"Content-Type": "application/xml; charset=UTF-8"},
@@ -47,10 +63,98 @@ class SofortProvider(BasicProvider):
         doc = xmltodict.parse(response.content)
         return doc, response
 
+    def fetch_transactions(self, transaction_ids: Iterable[str]) -> Iterator[dict]:
+        """Fetch the details of many transactions with few requests.
+
+        Up to :data:`TRANSACTION_REQUEST_LIMIT` transactions are requested at
+        once. Each response is parsed as it is read, and the details of each
+        transaction (the ``transaction_details`` element, as a dict) are
+        yielded in turn. Unknown transactions are left out.
+
+        :raises PaymentError: if Sofort reports an error.
+        """
+        transaction_ids = list(transaction_ids)
+        for start in range(0, len(transaction_ids), TRANSACTION_REQUEST_LIMIT):
+            xml_request = self._get_transaction_request(
+                transaction_ids[start : start + TRANSACTION_REQUEST_LIMIT]
+            )
+            response = self.http_session.post(
+                self.endpoint,
+                data=xml_request.encode("utf-8"),
+                headers={"Content-Type": "application/xml; charset=UTF-8"},
+                auth=(self.client_id, self.secret),
+                stream=True,
+            )
+            with response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                details: list[dict] = []
+                errors: list[dict] = []
+
+                def collect(path, item, details=details, errors=errors) -> bool:
+                    (errors if path[0][0] == "errors" else details).append(item)
+                    return True
+
+                xmltodict.parse(response.raw, item_depth=2, item_callback=collect)
+            if errors:
+                raise PaymentError(
+                    "Error in {}: {}".format(
+                        errors[0].get("field"), errors[0].get("message")
+                    )
+                )
+            yield from details
+
+    def poll_statuses(self, payments):
+        payments_by_transaction = {
+            payment.transaction_id: payment
+            for payment in payments
+            if payment.transaction_id
+        }
+        updates = {}
+        for details in self.fetch_transactions(payments_by_transaction):
+            payment = payments_by_transaction.get(details.get("transaction"))
+            if payment is None:
+                continue
+            status = STATUS_MAP.get(details.get("status"), PaymentStatus.CONFIRMED)
+            captured_amount = (
+                payment.total if status == PaymentStatus.CONFIRMED else None
+            )
+            # Stored like process_data() does, for refunds to find the sender.
+            extra_data = json.dumps({"transactions": {"transaction_details": details}})
+            updates[payment.pk] = StatusUpdate(
+                status, captured_amount=captured_amount, extra_data=extra_data
+            )
+        return updates
+
+    async def apost_request(self, xml_request):
+        """Asynchronous version of :meth:`post_request`."""
+        response = await self.get_async_http_client().post(
+            self.endpoint,
+            content=xml_request.encode("utf-8"),
+            headers={"Content-Type": "application/xml; charset=UTF-8"},
+            auth=(self.client_id, self.secret),
+        )
+        doc = xmltodict.parse(response.content)
+        return doc, response
+
     def get_form(self, payment, data=None) -> None:
         if not payment.id:
             payment.save()
-        xml_request = render_to_string(
+        doc, response = self.post_request(self._get_new_transaction_request(payment))
+        self._redirect_to_payment_url(payment, doc, response)
+
+    async def aget_form(self, payment, data=None) -> None:
+        if self._overrides("get_form", SofortProvider):
+            return await super().aget_form(payment, data)
+        if not payment.id:
+            await sync_to_async(payment.save)()
+        xml_request = await sync_to_async(self._get_new_transaction_request)(payment)
+        doc, response = await self.apost_request(xml_request)
+        await sync_to_async(self._redirect_to_payment_url)(payment, doc, response)
+        return None
+
+    def _get_new_transaction_request(self, payment) -> str:
+        return render_to_string(
             "payments/sofort/new_transaction.xml",
             {
                 "project_id": self.project_id,
@@ -68,8 +172,15 @@ class SofortProvider(BasicProvider):
                 "customer_protection": "0",
             },
         )
-        doc, response = self.post_request(xml_request)
+
+    def _redirect_to_payment_url(self, payment, doc, response) -> None:
         if response.status_code == 200:
+            transaction_id = doc.get("new_transaction", {}).get("transaction")
+            if transaction_id:
+                # Remembered so that the payment can be reconciled if the
+                # customer never returns.
+                payment.transaction_id = transaction_id
+                payment.save()
             try:
                 raise RedirectNeeded(doc["new_transaction"]["payment_url"])
             except KeyError as e:
@@ -85,11 +196,30 @@ class SofortProvider(BasicProvider):
             return HttpResponseForbidden("FAILED")
         transaction_id = request.GET.get("trans")
         payment.transaction_id = transaction_id
-        transaction_request = render_to_string(
+        doc, _response = self.post_request(
+            self._get_transaction_request([transaction_id])
+        )
+        return self._set_transaction_status(payment, doc)
+
+    async def aprocess_data(self, payment, request):
+        if self._overrides("process_data", SofortProvider):
+            return await super().aprocess_data(payment, request)
+        if "trans" not in request.GET:
+            return HttpResponseForbidden("FAILED")
+        transaction_id = request.GET.get("trans")
+        payment.transaction_id = transaction_id
+        doc, _response = await self.apost_request(
+            self._get_transaction_request([transaction_id])
+        )
+        return await sync_to_async(self._set_transaction_status)(payment, doc)
+
+    def _get_transaction_request(self, transaction_ids) -> str:
+        return render_to_string(
             "payments/sofort/transaction_request.xml",
-            {"transactions": [transaction_id]},
+            {"transactions": transaction_ids},
         )
-        doc, _response = self.post_request(transaction_request)
+
+    def _set_transaction_status(self, payment, doc):
         try:
             # If there is a transaction and status returned,
             # the payment was successful
@@ -114,9 +244,23 @@ class SofortProvider(BasicProvider):
     def refund(self, payment, amount=None):
         if amount is None:
             amount = payment.captured_amount
+        doc, _response = self.post_request(self._get_refund_request(payment, amount))
+        return self._set_refunded(payment, doc, amount)
+
+    async def arefund(self, payment, amount=None):
+        if self._overrides("refund", SofortProvider):
+            return await super().arefund(payment, amount)
+        if amount is None:
+            amount = payment.captured_amount
+        doc, _response = await self.apost_request(
+            self._get_refund_request(payment, amount)
+        )
+        return await sync_to_async(self._set_refunded)(payment, doc, amount)
+
+    def _get_refund_request(self, payment, amount) -> str:
         doc = json.loads(payment.extra_data)
         sender_data = doc["transactions"]["transaction_details"]["sender"]
-        refund_request = render_to_string(
+        return render_to_string(
             "payments/sofort/refund_transaction.xml",
             {
                 "holder": sender_data["holder"],
@@ -128,7 +272,8 @@ class SofortProvider(BasicProvider):
                 "comment": "User requested a refund",
             },
         )
-        doc, _response = self.post_request(refund_request)
+
+    def _set_refunded(self, payment, doc, amount):
         # save the response msg in "message" field
         # to start a online transaction one needs to upload the "pain"
         # data to his bank account
@@ -1,15 +1,24 @@
 from __future__ import annotations
 
 import json
+import re
+from io import BytesIO
 from unittest.mock import MagicMock
 from unittest.mock import Mock
 from unittest.mock import patch
 
 import pytest
+import requests
+from asgiref.sync import async_to_sync
 
+from payments import PaymentError
 from payments import PaymentStatus
 from payments import RedirectNeeded
+from payments.core import provider_registry
+from payments.reconcile import reconcile_payments
+from payments.test_core import Payment as PaymentModel
 
+from . import TRANSACTION_REQUEST_LIMIT
 from . import SofortProvider
 
 SECRET = "abcd1234"
@@ -52,7 +61,7 @@ def provider() -> SofortProvider:
 
 
 @patch("xmltodict.parse")
-@patch("requests.post")
+@patch("requests.Session.post")
 def test_provider_raises_redirect_needed_on_success(
     mocked_post: MagicMock,
     mocked_parser: MagicMock,
@@ -63,14 +72,15 @@ def test_provider_raises_redirect_needed_on_success(
     response.status_code = 200
     mocked_post.return_value = response
     mocked_parser.return_value = {
-        "new_transaction": {"payment_url": "http://payment.com"}
+        "new_transaction": {"payment_url": "http://payment.com", "transaction": "123"}
     }
     with pytest.raises(RedirectNeeded):
         provider.get_form(payment)
+    assert payment.transaction_id == "123"
 
 
 @patch("xmltodict.parse")
-@patch("requests.post")
+@patch("requests.Session.post")
 @patch("payments.sofort.redirect")
 def test_provider_redirects_on_success(
     mocked_redirect: MagicMock,
@@ -97,7 +107,7 @@ def test_provider_redirects_on_success(
 
 
 @patch("xmltodict.parse")
-@patch("requests.post")
+@patch("requests.Session.post")
 @patch("payments.sofort.redirect")
 def test_provider_redirects_on_failure(
     mocked_redirect: MagicMock,
@@ -117,7 +127,7 @@ def test_provider_redirects_on_failure(
 
 
 @patch("xmltodict.parse")
-@patch("requests.post")
+@patch("requests.Session.post")
 def test_provider_refunds_payment(
     mocked_post: MagicMock,
     mocked_parser: MagicMock,
@@ -142,3 +152,151 @@ def test_provider_refunds_payment(
     mocked_parser.return_value = {}
     provider.refund(payment)
     assert payment.status == PaymentStatus.REFUNDED
+
+
+@patch("xmltodict.parse")
+@patch("payments.sofort.redirect")
+def test_provider_redirects_on_success_async(
+    mocked_redirect: MagicMock,
+    mocked_parser: MagicMock,
+    payment: Payment,
+    provider: SofortProvider,
+) -> None:
+    httpx = pytest.importorskip("httpx")
+    bodies = []
+
+    def handler(request):
+        bodies.append(request.content.decode())
+        return httpx.Response(200, content=b"<transactions />")
+
+    mocked_parser.return_value = {
+        "transactions": {
+            "transaction_details": {
+                "status": "ok",
+                "sender": {"holder": "John Doe", "country_code": "EN"},
+            }
+        }
+    }
+    request = MagicMock()
+    request.GET = {"trans": "1234"}
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    with patch.object(SofortProvider, "get_async_http_client", return_value=client):
+        async_to_sync(provider.aprocess_data)(payment, request)
+    assert "<transaction>1234</transaction>" in bodies[0]
+    mocked_parser.assert_called_once_with(b"<transactions />")
+    assert payment.status == PaymentStatus.CONFIRMED
+    assert payment.transaction_id == "1234"
+
+
+def xml_response(content: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = BytesIO(content)
+    return response
+
+
+@patch("requests.Session.post")
+def test_provider_fetches_transactions_in_batches(
+    mocked_post: MagicMock,
+    provider: SofortProvider,
+) -> None:
+    def post(url, data, **kwargs):
+        ids = re.findall(rb"<transaction>(\d+)</transaction>", data)
+        details = b"".join(
+            b"<transaction_details><transaction>%s</transaction>"
+            b"<status>received</status></transaction_details>" % id_
+            for id_ in ids
+            if int(id_) % 2
+        )
+        return xml_response(b"<transactions>%s</transactions>" % details)
+
+    mocked_post.side_effect = post
+    ids = [str(i) for i in range(TRANSACTION_REQUEST_LIMIT + 50)]
+
+    transactions = list(provider.fetch_transactions(ids))
+
+    assert mocked_post.call_count == 2
+    assert mocked_post.call_args.kwargs["stream"] is True
+    assert [t["transaction"] for t in transactions] == ids[1::2]
+    assert transactions[0]["status"] == "received"
+
+
+@patch("requests.Session.post")
+def test_provider_fetch_transactions_raises_errors(
+    mocked_post: MagicMock,
+    provider: SofortProvider,
+) -> None:
+    mocked_post.return_value = xml_response(
+        b"<errors><error><field>transaction</field>"
+        b"<message>Invalid</message></error></errors>"
+    )
+    with pytest.raises(PaymentError, match="Error in transaction: Invalid"):
+        list(provider.fetch_transactions(["1"]))
+
+
+@patch("requests.Session.post")
+def test_provider_poll_statuses(
+    mocked_post: MagicMock,
+    provider: SofortProvider,
+) -> None:
+    mocked_post.return_value = xml_response(
+        b"<transactions>"
+        b"<transaction_details><transaction>1</transaction>"
+        b"<status>received</status></transaction_details>"
+        b"<transaction_details><transaction>2</transaction>"
+        b"<status>loss</status></transaction_details>"
+        b"</transactions>"
+    )
+    payments = [Payment(pk=pk, transaction_id=str(pk)) for pk in (1, 2, 3)]
+
+    updates = provider.poll_statuses(payments)
+
+    assert {pk: update[:3] for pk, update in updates.items()} == {
+        1: (PaymentStatus.CONFIRMED, "", 100),
+        2: (PaymentStatus.REJECTED, "", None),
+    }
+    assert json.loads(updates[1].extra_data) == {
+        "transactions": {
+            "transaction_details": {"transaction": "1", "status": "received"}
+        }
+    }
+    assert mocked_post.call_count == 1
+
+
+@pytest.mark.django_db
+@patch("requests.Session.post")
+def test_provider_refunds_reconciled_payment(
+    mocked_post: MagicMock,
+    settings,
+) -> None:
+    settings.PAYMENT_VARIANTS = {
+        "sofort": (
+            "payments.sofort.SofortProvider",
+            {"id": CLIENT_ID, "project_id": PROJECT_ID, "key": SECRET},
+        )
+    }
+    mocked_post.side_effect = [
+        xml_response(
+            b"<transactions><transaction_details>"
+            b"<transaction>1234</transaction><status>received</status>"
+            b"<sender><holder>John Doe</holder><country_code>DE</country_code>"
+            b"<bic>ABCDDEFF</bic><iban>DE00123456780000000000</iban></sender>"
+            b"</transaction_details></transactions>"
+        ),
+        xml_response(b"<refunds />"),
+    ]
+    payment = PaymentModel.objects.create(
+        variant="sofort", total=100, transaction_id="1234"
+    )
+
+    try:
+        assert reconcile_payments(PaymentModel.objects.all()) == {"sofort": 1}
+        payment.refresh_from_db()
+        assert payment.status == PaymentStatus.CONFIRMED
+        payment.refund()
+    finally:
+        provider_registry.invalidate()
+
+    assert payment.status == PaymentStatus.REFUNDED
+    refund_request = mocked_post.call_args.kwargs["data"].decode()
+    assert "DE00123456780000000000" in refund_request
@@ -4,17 +4,23 @@ import json
 from dataclasses import asdict
 from dataclasses import dataclass
 from dataclasses import field
+from datetime import timedelta
 from typing import Any
 from typing import NoReturn
 
 import stripe
 from django.http import JsonResponse
+from django.utils import timezone
 
 from payments import PaymentError
 from payments import PaymentStatus
 from payments import RedirectNeeded
 from payments.core import BasicProvider
+from payments.core import StatusUpdate
 from payments.forms import PaymentForm as BasePaymentForm
+from payments.utils import get_request_cache
+from payments.utils import is_webhook_verified
+from payments.utils import mark_webhook_verified
 
 
 @dataclass
@@ -69,6 +75,17 @@ stripe_enabled_events: list = [
     "checkout.session.completed",
 ]
 
+#: Seconds before a payment's creation, and after its last change, within which
+#: its session is looked up.
+SESSION_LIST_MARGIN = 300
+#: Payments created longer ago than this, in seconds, have their sessions
+#: retrieved one by one rather than listed.
+SESSION_LIST_WINDOW = 24 * 60 * 60
+#: Batches with fewer recent payments have their sessions retrieved one by one.
+SESSION_LIST_MIN_PAYMENTS = 5
+#: Maximum number of pages of 100 sessions listed for a batch.
+SESSION_LIST_MAX_PAGES = 10
+
 
 class StripeProviderV3(BasicProvider):
     """Provider backend using `Stripe <https://stripe.com/>`_ api version 3.
@@ -189,6 +206,88 @@ class StripeProviderV3(BasicProvider):
 
         return payment
 
+    def poll_statuses(self, payments):
+        """Look the payments' checkout sessions up in Stripe's session list.
+
+        The sessions of recent payments are listed, 100 per request, from the
+        creation of the oldest payment until the last change of the newest one.
+        Sessions of older payments, of batches with few recent payments, and
+        those not found within :data:`SESSION_LIST_MAX_PAGES` pages are
+        retrieved one by one.
+
+        Payments of several variants may be polled at once, from different
+        threads, so the API key is passed to each request rather than set
+        globally.
+        """
+        waiting = {
+            payment.transaction_id: payment
+            for payment in payments
+            if payment.status == PaymentStatus.WAITING and payment.transaction_id
+        }
+        if not waiting:
+            return {}
+
+        updates = {}
+        since = timezone.now() - timedelta(seconds=SESSION_LIST_WINDOW)
+        recent = {
+            session_id: payment
+            for session_id, payment in waiting.items()
+            if payment.created >= since
+        }
+        if len(recent) >= SESSION_LIST_MIN_PAYMENTS:
+            for session_id in self._list_sessions(recent, updates):
+                del waiting[session_id]
+        for session_id, payment in waiting.items():
+            try:
+                session = stripe.checkout.Session.retrieve(
+                    session_id, api_key=self.api_key
+                )
+            except stripe.InvalidRequestError:  # type: ignore[attr-defined]
+                # The session does not exist (anymore).
+                continue
+            self._add_status_update(updates, payment, session)
+        return updates
+
+    def _list_sessions(self, payments, updates) -> set:
+        """List the sessions of ``payments``, adding their status updates.
+
+        :returns: IDs of the sessions that need not be retrieved: the ones
+            found and, if the list was exhausted, those that don't exist.
+        """
+        since = min(payment.created for payment in payments.values())
+        until = max(payment.modified for payment in payments.values())
+        # Allow for clock skew between us and Stripe.
+        sessions = stripe.checkout.Session.list(
+            created={
+                "gte": int(since.timestamp()) - SESSION_LIST_MARGIN,
+                "lte": int(until.timestamp()) + SESSION_LIST_MARGIN,
+            },
+            limit=100,
+            api_key=self.api_key,
+        )
+        found = set()
+        pages = 1
+        while True:
+            for session in sessions.data:
+                payment = payments.get(session["id"])
+                if payment is not None:
+                    found.add(session["id"])
+                    self._add_status_update(updates, payment, session)
+            if not sessions.has_more:
+                return set(payments)
+            if len(found) == len(payments) or pages == SESSION_LIST_MAX_PAGES:
+                return found
+            sessions = sessions.next_page(api_key=self.api_key)
+            pages += 1
+
+    def _add_status_update(self, updates, payment, session) -> None:
+        if session["status"] == "expired":
+            updates[payment.pk] = StatusUpdate(PaymentStatus.REJECTED)
+        elif session["payment_status"] == "paid":
+            updates[payment.pk] = StatusUpdate(
+                PaymentStatus.CONFIRMED, captured_amount=payment.total
+            )
+
     def get_line_items(self, payment) -> list:
         order_no = payment.token if self.use_token else payment.pk
         product_data = StripeProductData(name=f"Order #{order_no}")
@@ -212,26 +311,39 @@ class StripeProviderV3(BasicProvider):
         return int(amount * factor)
 
     def return_event_payload(self, request) -> Any:
-        if self.secure_endpoint:
-            if "STRIPE_SIGNATURE" not in request.headers:
-                raise PaymentError(
-                    code=400, message="STRIPE_SIGNATURE not in request.headers"
-                )
+        """Return the event sent by Stripe, verifying its signature if configured.
 
-            try:
-                return stripe.Webhook.construct_event(
-                    request.body,
-                    request.headers["STRIPE_SIGNATURE"],
-                    self.endpoint_secret,
-                )
-            except ValueError as e:
-                # Invalid payload
-                raise e
-            except stripe.SignatureVerificationError as e:  # type: ignore[attr-defined]
-                # Invalid signature
-                raise e
-        else:
+        The event is only parsed and verified once per request.
+        """
+        cache = get_request_cache(request)
+        key = ("stripe_event", self.endpoint_secret if self.secure_endpoint else None)
+        if key not in cache:
+            cache[key] = self._parse_event_payload(request)
+        return cache[key]
+
+    def _parse_event_payload(self, request) -> Any:
+        if not self.secure_endpoint:
             return json.loads(request.body)
+        if "STRIPE_SIGNATURE" not in request.headers:
+            raise PaymentError(
+                code=400, message="STRIPE_SIGNATURE not in request.headers"
+            )
+
+        # A webhook verified when it was received (and stored to be processed
+        # later) is still checked, but not for its age.
+        tolerance = (
+            0 if is_webhook_verified(request) else stripe.Webhook.DEFAULT_TOLERANCE
+        )
+        # Raises ValueError for an invalid payload, and
+        # stripe.SignatureVerificationError for an invalid signature.
+        event = stripe.Webhook.construct_event(
+            request.body,
+            request.headers["STRIPE_SIGNATURE"],
+            self.endpoint_secret,
+            tolerance=tolerance,
+        )
+        mark_webhook_verified(request)
+        return event
 
     def get_token_from_request(self, payment, request) -> str:
         """Return payment token from provider request."""
@@ -246,6 +358,18 @@ class StripeProviderV3(BasicProvider):
                 message="client_reference_id is not present, check Stripe Dashboard.",
             ) from e
 
+    def get_webhook_event_id(self, request) -> str | None:
+        try:
+            return self.return_event_payload(request)["id"]
+        except (
+            KeyError,
+            ValueError,
+            stripe.SignatureVerificationError,  # type: ignore[attr-defined]
+            PaymentError,
+        ):
+            # Invalid events are rejected when processing them.
+            return None
+
     def process_data(self, payment, request):
         """Processes the event sent by stripe.
 
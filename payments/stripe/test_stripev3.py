@@ -1,17 +1,23 @@
 from __future__ import annotations
 
 import json
+from datetime import timedelta
 from unittest.mock import Mock
 from unittest.mock import patch
 
 import pytest
+import stripe
+from django.utils import timezone as django_timezone
 
 from payments import PaymentError
 from payments import PaymentStatus
 from payments import PurchasedItem
 from payments import RedirectNeeded
+from payments.core import StatusUpdate
+from payments.utils import mark_webhook_verified
 
 from . import StripeProviderV3
+from .providers import SESSION_LIST_MAX_PAGES
 
 # Secret key from https://stripe.com/docs/api/authentication
 API_KEY = "sk_test_4eC39HqLyjWDarjtT1zdp7dc"
@@ -362,3 +368,193 @@ def test_process_data_does_not_overwrite_cancelled_on_expiry():
     provider.process_data(payment, request)
 
     assert payment.status == PaymentStatus.CANCELLED
+
+
+@patch("stripe.Webhook.construct_event")
+def test_webhook_is_verified_once_per_request(construct_event):
+    construct_event.return_value = {
+        "id": "evt_1",
+        "type": "checkout.session.completed",
+        "data": {
+            "object": {
+                "client_reference_id": "token",
+                "status": "complete",
+                "payment_status": "paid",
+            }
+        },
+    }
+    provider = StripeProviderV3(api_key=API_KEY, endpoint_secret="whsec")
+    request = Mock()
+    request.body = b"{}"
+    request.headers = {"STRIPE_SIGNATURE": "signature"}
+
+    assert provider.get_webhook_event_id(request) == "evt_1"
+    assert provider.get_token_from_request(None, request) == "token"
+    provider.process_data(Payment(), request)
+
+    construct_event.assert_called_once_with(
+        b"{}", "signature", "whsec", tolerance=stripe.Webhook.DEFAULT_TOLERANCE
+    )
+
+
+@patch("stripe.Webhook.construct_event")
+def test_verified_webhook_is_not_checked_for_age(construct_event):
+    construct_event.return_value = {"id": "evt_1"}
+    provider = StripeProviderV3(api_key=API_KEY, endpoint_secret="whsec")
+    request = Mock()
+    request.body = b"{}"
+    request.headers = {"STRIPE_SIGNATURE": "signature"}
+    mark_webhook_verified(request)
+
+    assert provider.get_webhook_event_id(request) == "evt_1"
+    construct_event.assert_called_once_with(b"{}", "signature", "whsec", tolerance=0)
+
+
+@pytest.mark.parametrize(
+    ("headers", "side_effect"),
+    [
+        ({}, None),
+        ({"STRIPE_SIGNATURE": "signature"}, ValueError("Invalid payload")),
+        (
+            {"STRIPE_SIGNATURE": "signature"},
+            stripe.SignatureVerificationError(  # type: ignore[attr-defined]
+                "Invalid signature", "signature"
+            ),
+        ),
+        ({"STRIPE_SIGNATURE": "signature"}, [{"type": "checkout.session.expired"}]),
+    ],
+)
+@patch("stripe.Webhook.construct_event")
+def test_invalid_webhook_has_no_event_id(construct_event, headers, side_effect):
+    construct_event.side_effect = side_effect
+    provider = StripeProviderV3(api_key=API_KEY, endpoint_secret="whsec")
+    request = Mock()
+    request.body = b"{}"
+    request.headers = headers
+
+    assert provider.get_webhook_event_id(request) is None
+
+
+@patch("stripe.Webhook.construct_event")
+def test_webhook_event_id_does_not_hide_unexpected_errors(construct_event):
+    construct_event.side_effect = RuntimeError
+    provider = StripeProviderV3(api_key=API_KEY, endpoint_secret="whsec")
+    request = Mock()
+    request.body = b"{}"
+    request.headers = {"STRIPE_SIGNATURE": "signature"}
+
+    with pytest.raises(RuntimeError):
+        provider.get_webhook_event_id(request)
+
+
+def make_waiting_payments(session_ids, age=timedelta(hours=1)):
+    payments = []
+    for pk, session_id in enumerate(session_ids, start=1):
+        payment = Payment()
+        payment.pk = pk
+        payment.transaction_id = session_id
+        payment.created = django_timezone.now() - age
+        payment.modified = payment.created + timedelta(minutes=10)
+        payments.append(payment)
+    return payments
+
+
+def make_session_list(sessions, has_more=False):
+    return Mock(data=sessions, has_more=has_more)
+
+
+def retrieve_session(session_id, **params):
+    if session_id == "cs_missing":
+        raise stripe.InvalidRequestError("No such session", "id")
+    paid = session_id == "cs_paid"
+    return {"status": "complete", "payment_status": "paid" if paid else "unpaid"}
+
+
+def test_provider_poll_statuses_lists_sessions():
+    payments = make_waiting_payments(
+        ["cs_paid", "cs_expired", "cs_open", "cs_1", "cs_2"]
+    )
+    second_page = make_session_list(
+        [{"id": "cs_open", "status": "open", "payment_status": "unpaid"}]
+    )
+    first_page = make_session_list(
+        [
+            {"id": "cs_other", "status": "complete", "payment_status": "paid"},
+            {"id": "cs_paid", "status": "complete", "payment_status": "paid"},
+            {"id": "cs_expired", "status": "expired", "payment_status": "unpaid"},
+        ],
+        has_more=True,
+    )
+    first_page.next_page.return_value = second_page
+    provider = StripeProviderV3(api_key=API_KEY)
+
+    with (
+        patch("stripe.checkout.Session.list", return_value=first_page) as list_,
+        patch("stripe.checkout.Session.retrieve") as retrieve,
+    ):
+        updates = provider.poll_statuses(payments)
+
+    list_.assert_called_once_with(
+        created={
+            "gte": int(payments[0].created.timestamp()) - 300,
+            "lte": int(payments[0].modified.timestamp()) + 300,
+        },
+        limit=100,
+        api_key=API_KEY,
+    )
+    first_page.next_page.assert_called_once_with(api_key=API_KEY)
+    retrieve.assert_not_called()
+    assert updates == {
+        1: StatusUpdate(PaymentStatus.CONFIRMED, captured_amount=100),
+        2: StatusUpdate(PaymentStatus.REJECTED),
+    }
+
+
+def test_provider_poll_statuses_caps_listed_pages():
+    payments = make_waiting_payments(["cs_paid", "cs_1", "cs_2", "cs_3", "cs_4"])
+    sessions = make_session_list(
+        [{"id": "cs_other", "status": "complete", "payment_status": "paid"}],
+        has_more=True,
+    )
+    sessions.next_page.return_value = sessions
+    provider = StripeProviderV3(api_key=API_KEY)
+
+    with (
+        patch("stripe.checkout.Session.list", return_value=sessions),
+        patch(
+            "stripe.checkout.Session.retrieve", side_effect=retrieve_session
+        ) as retrieve,
+    ):
+        updates = provider.poll_statuses(payments)
+
+    assert sessions.next_page.call_count == SESSION_LIST_MAX_PAGES - 1
+    assert retrieve.call_count == 5
+    assert updates == {1: StatusUpdate(PaymentStatus.CONFIRMED, captured_amount=100)}
+
+
+@pytest.mark.parametrize(
+    ("session_ids", "age"),
+    [
+        (["cs_paid", "cs_missing"], timedelta(hours=1)),
+        (["cs_paid", "cs_missing", "cs_1", "cs_2", "cs_3"], timedelta(days=2)),
+    ],
+)
+def test_provider_poll_statuses_retrieves_sparse_and_old_sessions(session_ids, age):
+    payments = make_waiting_payments(session_ids, age=age)
+    provider = StripeProviderV3(api_key=API_KEY)
+
+    with (
+        patch("stripe.api_key", None),
+        patch("stripe.checkout.Session.list") as list_,
+        patch(
+            "stripe.checkout.Session.retrieve", side_effect=retrieve_session
+        ) as retrieve,
+    ):
+        updates = provider.poll_statuses(payments)
+        # Other variants may be polled concurrently, with their own keys.
+        assert stripe.api_key is None
+
+    list_.assert_not_called()
+    assert retrieve.call_count == len(session_ids)
+    retrieve.assert_called_with(session_ids[-1], api_key=API_KEY)
+    assert updates == {1: StatusUpdate(PaymentStatus.CONFIRMED, captured_amount=100)}
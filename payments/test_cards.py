@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import random
+import re
+
+import pytest
+
+from .cards import BIN_MAX_STRINGS
+from .cards import CARD_ISSUERS
+from .cards import BinDatabase
+from .cards import BinRange
+from .cards import CardInfo
+from .cards import CardIssuerIndex
+from .cards import _expand_range
+from .cards import get_card_issuer_index
+from .cards import write_bin_database
+from .core import CARD_TYPES
+from .core import get_card_info
+from .core import get_credit_card_issuer
+
+
+def match_regexes(number: str) -> tuple[str | None, str | None]:
+    for regexp, card_type, name in CARD_TYPES:
+        if re.match(regexp, number):
+            return card_type, name
+    return None, None
+
+
+def test_index_matches_card_type_regexes() -> None:
+    index = CardIssuerIndex(CARD_ISSUERS)
+    numbers = [
+        f"{prefix:04d}".ljust(length, "0")[:length]
+        for prefix in range(10000)
+        for length in range(1, 21)
+    ]
+    rng = random.Random(0)
+    numbers += [
+        "".join(rng.choices("0123456789", k=rng.randint(12, 19))) for _ in range(10000)
+    ]
+    for number in numbers:
+        assert index.lookup(number) == match_regexes(number), number
+
+
+@pytest.mark.parametrize("number", ["", "4111 1111 1111 1111", "411111111111111a"])
+def test_non_digits_have_no_issuer(number) -> None:
+    assert get_credit_card_issuer(number) == (None, None)
+
+
+def test_expand_range() -> None:
+    assert _expand_range("34") == ["34"]
+    assert _expand_range("51-55") == ["51", "52", "53", "54", "55"]
+    assert _expand_range("300-399") == ["3"]
+    assert _expand_range("0-9") == [str(d) for d in range(10)]
+    assert _expand_range("2221-2720") == [
+        *(f"222{d}" for d in range(1, 10)),
+        *(f"22{d}" for d in range(3, 10)),
+        *(f"2{d}" for d in range(3, 7)),
+        "270",
+        "271",
+        "2720",
+    ]
+
+
+@pytest.mark.parametrize("prefix", ["", "4a", "55-51", "51-550"])
+def test_invalid_prefix(prefix) -> None:
+    with pytest.raises(ValueError, match="Invalid card number prefix"):
+        CardIssuerIndex([([prefix], (16,), "test", "Test")])
+
+
+def test_first_entry_wins() -> None:
+    index = CardIssuerIndex(
+        [
+            (["4"], (16,), "visa", "VISA"),
+            (["4571"], (16,), "dankort", "Dankort"),
+        ]
+    )
+    assert index.lookup("4571000000000000") == ("visa", "VISA")
+
+    index = CardIssuerIndex(
+        [
+            (["4571"], (16,), "dankort", "Dankort"),
+            (["4"], (16,), "visa", "VISA"),
+        ]
+    )
+    assert index.lookup("4571000000000000") == ("dankort", "Dankort")
+    assert index.lookup("4572000000000000") == ("visa", "VISA")
+    assert index.lookup("457100000000000") == (None, None)
+
+
+def test_extra_card_issuers_setting(settings) -> None:
+    assert get_credit_card_issuer("6200000000000005") == (None, None)
+
+    settings.PAYMENT_CARD_ISSUERS = [
+        (["62"], range(16, 20), "unionpay", "UnionPay"),
+        (["4571"], (16,), "dankort", "Dankort"),
+    ]
+    assert get_credit_card_issuer("6200000000000005") == ("unionpay", "UnionPay")
+    assert get_credit_card_issuer("4571000000000000") == ("dankort", "Dankort")
+    assert get_credit_card_issuer("4111111111111111") == ("visa", "VISA")
+    assert get_card_issuer_index().names["unionpay"] == "UnionPay"
+
+
+BIN_RANGES = [
+    ("411111", "411111", "US", "credit", "classic", "Example Bank"),
+    ("41111200", "41111299", "US", "debit", "", ""),
+    ("5555", "5555", "GB", "credit", "platinum", "Other Bank"),
+    ("2", "2", "", "prepaid", "", ""),
+]
+
+
+@pytest.fixture
+def bin_database(tmp_path):
+    path = tmp_path / "bins.db"
+    assert write_bin_database(path, BIN_RANGES) == 4
+    database = BinDatabase(path)
+    yield database
+    database.close()
+
+
+def test_bin_database_lookup(bin_database) -> None:
+    assert len(bin_database) == 4
+    assert bin_database.lookup("4111111111111111") == BinRange(
+        "US", "credit", "classic", "Example Bank"
+    )
+    assert bin_database.lookup("4111120000000000") == BinRange(
+        "US", "debit", None, None
+    )
+    assert bin_database.lookup("5555555555554444") == BinRange(
+        "GB", "credit", "platinum", "Other Bank"
+    )
+    assert bin_database.lookup("2223003122003222") == BinRange(
+        None, "prepaid", None, None
+    )
+    assert bin_database.lookup("4111130000000000") is None
+    assert bin_database.lookup("1800000000000000") is None
+    assert bin_database.lookup("9999999999999999") is None
+    assert bin_database.lookup("4111 1111") is None
+
+
+def test_bin_database_lookup_on_big_endian(monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr("sys.byteorder", "big")
+    path = tmp_path / "bins.db"
+    write_bin_database(path, BIN_RANGES)
+    database = BinDatabase(path)
+    assert database.lookup("5555555555554444") == BinRange(
+        "GB", "credit", "platinum", "Other Bank"
+    )
+    assert database.lookup("4111130000000000") is None
+    database.close()
+
+
+@pytest.mark.parametrize(
+    ("ranges", "message"),
+    [
+        ([("4111", "4110", "", "", "", "")], "Invalid BIN range"),
+        ([("4a", "4a", "", "", "", "")], "Invalid IIN"),
+        ([("123456789", "123456789", "", "", "", "")], "Invalid IIN"),
+        (
+            [("41", "41", "", "", "", ""), ("4111", "4112", "", "", "", "")],
+            "Overlapping BIN ranges",
+        ),
+    ],
+)
+def test_write_bin_database_errors(tmp_path, ranges, message) -> None:
+    with pytest.raises(ValueError, match=message):
+        write_bin_database(tmp_path / "bins.db", ranges)
+    assert not list(tmp_path.iterdir())
+
+
+def test_write_bin_database_limits_strings(tmp_path) -> None:
+    path = tmp_path / "bins.db"
+    ranges = [
+        (f"{iin:08d}", f"{iin:08d}", "", "", "", f"Bank {iin}")
+        for iin in range(BIN_MAX_STRINGS)
+    ]
+    with pytest.raises(ValueError, match="Too many distinct BIN strings"):
+        write_bin_database(path, ranges)
+    assert write_bin_database(path, ranges[:-1]) == BIN_MAX_STRINGS - 1
+
+    with pytest.raises(ValueError, match="BIN string too long"):
+        write_bin_database(path, [("4", "4", "", "", "", "x" * 0x10000)])
+
+
+def test_write_bin_database_replaces_file(bin_database, tmp_path) -> None:
+    path = tmp_path / "bins.db"
+    write_bin_database(path, [("5", "5", "FR", "", "", "")])
+    assert [p.name for p in tmp_path.iterdir()] == ["bins.db"]
+    # The open database still reads the file it mapped.
+    assert bin_database.lookup("5555555555554444") == BinRange(
+        "GB", "credit", "platinum", "Other Bank"
+    )
+    database = BinDatabase(path)
+    assert database.lookup("5555555555554444") == BinRange("FR", None, None, None)
+    database.close()
+
+
+@pytest.mark.parametrize("content", [b"", b"PBIN", b"NOPE" + bytes(16)])
+def test_bin_database_rejects_other_files(tmp_path, content) -> None:
+    path = tmp_path / "bins.db"
+    path.write_bytes(content)
+    with pytest.raises(ValueError, match="Not a BIN database"):
+        BinDatabase(path)
+
+
+def test_get_card_info(settings, tmp_path) -> None:
+    assert get_card_info("4111111111111111") == CardInfo(
+        "visa", "VISA", None, None, None, None
+    )
+
+    path = tmp_path / "bins.db"
+    write_bin_database(path, BIN_RANGES)
+    settings.PAYMENT_BIN_DATABASE = str(path)
+    assert get_card_info("4111111111111111") == CardInfo(
+        "visa", "VISA", "US", "credit", "classic", "Example Bank"
+    )
+    assert get_card_info("6011111111111117") == CardInfo(
+        "discover", "Discover", None, None, None, None
+    )
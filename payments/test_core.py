@@ -1,19 +1,46 @@
 from __future__ import annotations
 
+import asyncio
+import gc
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from decimal import Decimal
+from http.client import HTTPMessage
+from io import BytesIO
+from types import SimpleNamespace
 from unittest.mock import MagicMock
 from unittest.mock import NonCallableMock
 from unittest.mock import patch
 
 import pytest
+import requests
+from asgiref.sync import async_to_sync
+from asgiref.sync import sync_to_async
+from django.conf.urls.i18n import i18n_patterns
+from django.db import connection
+from django.db.models.signals import pre_save
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import include
+from django.urls import path
+from django.utils import translation
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
 
 from payments import core
+from payments import urls
 
+from . import PaymentError
 from . import PaymentStatus
+from . import RedirectNeeded
 from .forms import CreditCardPaymentFormWithName
 from .forms import PaymentForm
 from .models import BasePayment
+from .signals import payments_created
+from .signals import status_changed
 
 
 @patch("payments.core.PAYMENT_HOST", new_callable=NonCallableMock)
@@ -28,6 +55,62 @@ def test_callable_get_base_url(host: MagicMock) -> None:
     assert core.get_base_url() == "https://example.com/callable"
 
 
+@pytest.mark.django_db
+@patch("payments.core.PAYMENT_HOST", new="")
+def test_sites_get_base_url_uses_site_cache(settings) -> None:
+    from django.contrib.sites.models import Site
+
+    settings.SITE_ID = Site.objects.get_or_create(domain="shop.example.com")[0].pk
+    Site.objects.clear_cache()
+    with patch.object(core, "Site", Site, create=True):
+        assert core.get_base_url() == "https://shop.example.com"
+        with CaptureQueriesContext(connection) as queries:
+            assert core.get_base_url() == "https://shop.example.com"
+        assert not queries.captured_queries
+
+        site = Site.objects.get(pk=settings.SITE_ID)
+        site.domain = "new.example.com"
+        site.save()
+        assert core.get_base_url() == "https://new.example.com"
+
+
+@pytest.mark.django_db
+@patch("payments.core.PAYMENT_HOST", new="")
+def test_sites_get_base_url_falls_back_to_request_host(settings, rf) -> None:
+    from django.contrib.sites.models import Site
+
+    settings.SITE_ID = None
+    settings.ALLOWED_HOSTS = ["unknown.example.com"]
+    request = rf.get("/", HTTP_HOST="unknown.example.com")
+    with patch.object(core, "Site", Site, create=True):
+        assert core.get_base_url(request) == "https://unknown.example.com"
+
+
+def test_get_process_url_uses_template() -> None:
+    from django.urls import reverse
+
+    payment = Payment(token="d9a8e7c6-5b4a-4321-9876-0123456789ab")
+    with patch("payments.models.reverse", wraps=reverse) as mocked_reverse:
+        assert payment.get_process_url() == reverse(
+            "process_payment", kwargs={"token": payment.token}
+        )
+        assert payment.get_process_url() == payment.get_process_url()
+    assert mocked_reverse.call_count <= 1
+
+
+def test_get_process_url_depends_on_language(settings) -> None:
+    settings.ROOT_URLCONF = "payments.test_core"
+    payment = Payment(token="d9a8e7c6-5b4a-4321-9876-0123456789ab")
+    with translation.override("en"):
+        assert payment.get_process_url() == f"/en/payments/process/{payment.token}/"
+    with translation.override("de"):
+        assert payment.get_process_url() == f"/de/payments/process/{payment.token}/"
+
+
+#: Used by test_get_process_url_depends_on_language().
+urlpatterns = i18n_patterns(path("payments/", include("payments.urls")))
+
+
 def test_provider_factory() -> None:
     core.provider_factory("default")
 
@@ -40,6 +123,14 @@ def test_provider_does_not_exist() -> None:
         core.provider_factory("fake_provider")
 
 
+def test_registry_keeps_no_lock_for_unknown_variants() -> None:
+    registry = core.ProviderRegistry()
+    for variant in ("fake1", "fake2"):
+        with pytest.raises(ValueError, match="Payment variant does not exist"):
+            registry.get(variant)
+    assert registry._variant_locks == {}
+
+
 class Payment(BasePayment):
     """
     Concrete model class for testing.
@@ -55,6 +146,63 @@ def test_payment_attributes() -> None:
     assert not hasattr(payment.attrs, "attr7")
 
 
+def test_payment_attributes_parsed_once() -> None:
+    payment = Payment(extra_data='{"attr1": "test1"}', token="token")
+    with patch("payments.models.json.loads", wraps=json.loads) as loads:
+        assert payment.attrs.attr1 == "test1"
+        payment.attrs.attr2 = "test2"
+        assert payment.attrs.attr2 == "test2"
+    assert loads.call_count == 1
+    assert json.loads(payment.extra_data) == {"attr1": "test1", "attr2": "test2"}
+
+
+def test_payment_attributes_then_extra_data_assigned() -> None:
+    payment = Payment(extra_data='{"attr1": "test1"}')
+    payment.attrs.attr2 = "test2"
+    payment.extra_data = '{"attr3": "test3"}'
+    assert not hasattr(payment.attrs, "attr1")
+    assert not hasattr(payment.attrs, "attr2")
+    assert payment.attrs.attr3 == "test3"
+    assert json.loads(payment.extra_data) == {"attr3": "test3"}
+
+
+def test_extra_data_assigned_then_payment_attributes() -> None:
+    payment = Payment(extra_data='{"attr1": "test1"}')
+    assert payment.attrs.attr1 == "test1"
+    payment.extra_data = json.dumps({**json.loads(payment.extra_data), "attr2": 2})
+    payment.attrs.attr3 = "test3"
+    assert json.loads(payment.extra_data) == {
+        "attr1": "test1",
+        "attr2": 2,
+        "attr3": "test3",
+    }
+
+
+@pytest.mark.django_db
+def test_payment_attributes_nested_changes_are_saved() -> None:
+    payment = Payment.objects.create(
+        variant="default", extra_data='{"session": {"a": 1}, "items": [1]}'
+    )
+    payment = Payment.objects.get(pk=payment.pk)
+    assert payment.attrs.session == {"a": 1}
+    assert payment.get_dirty_fields() == set()
+
+    payment.attrs.session["b"] = 2
+    payment.attrs.items.append(2)
+    assert payment.get_dirty_fields() == {"extra_data"}
+    payment.save()
+    payment = Payment.objects.get(pk=payment.pk)
+    assert payment.attrs.session == {"a": 1, "b": 2}
+    assert payment.attrs.items == [1, 2]
+
+
+def test_payment_attributes_json_field() -> None:
+    payment = Payment()
+    payment.extra_data = {"attr1": "test1"}  # type: ignore[assignment]
+    payment.attrs.attr2 = "test2"
+    assert payment.extra_data == {"attr1": "test1", "attr2": "test2"}
+
+
 def test_capture_with_wrong_status() -> None:
     payment = Payment(variant="default", status=PaymentStatus.WAITING)
     with pytest.raises(
@@ -318,3 +466,560 @@ def test_cancel_input_payment_successfully(mocked_cancel_method):
         payment.cancel()
         assert payment.status == PaymentStatus.CANCELLED
     assert mocked_cancel_method.call_count == 1
+
+
+class CountingProvider:
+    instances = 0
+
+    def __init__(self, **kwargs) -> None:
+        type(self).instances += 1
+        self.kwargs = kwargs
+
+
+@pytest.fixture
+def counting_variants(settings):
+    CountingProvider.instances = 0
+    settings.PAYMENT_VARIANTS = {
+        "counting": ("payments.test_core.CountingProvider", {"key": "a"}),
+        "other": ("payments.test_core.CountingProvider", {"key": "b"}),
+        "third": ("payments.test_core.CountingProvider", {"key": "c"}),
+    }
+    return settings.PAYMENT_VARIANTS
+
+
+def test_provider_registry_builds_once(counting_variants) -> None:
+    registry = core.ProviderRegistry()
+    assert registry.get("counting") is registry.get("counting")
+    assert CountingProvider.instances == 1
+
+    stats = registry.stats()
+    assert stats.hits == 1
+    assert stats.misses == 1
+    assert stats.size == 1
+    assert set(stats.instantiation_times) == {"counting"}
+
+
+def test_provider_registry_builds_once_under_contention(counting_variants) -> None:
+    registry = core.ProviderRegistry()
+    barrier = threading.Barrier(8)
+
+    def get():
+        barrier.wait()
+        return registry.get("counting")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        providers = list(executor.map(lambda _: get(), range(8)))
+
+    assert CountingProvider.instances == 1
+    assert all(provider is providers[0] for provider in providers)
+
+
+def test_provider_registry_invalidate(counting_variants) -> None:
+    registry = core.ProviderRegistry()
+    first = registry.get("counting")
+    other = registry.get("other")
+
+    registry.invalidate("counting")
+    assert registry.get("counting") is not first
+    assert registry.get("other") is other
+
+    registry.invalidate()
+    assert registry.stats().size == 0
+
+
+def test_provider_registry_evicts_least_recently_used(counting_variants) -> None:
+    registry = core.ProviderRegistry(maxsize=2)
+    registry.get("counting")
+    registry.get("other")
+    registry.get("counting")
+    registry.get("third")
+
+    assert "counting" in registry
+    assert "other" not in registry
+    assert "third" in registry
+
+
+def test_provider_registry_warm_up(counting_variants) -> None:
+    registry = core.ProviderRegistry()
+    timings = registry.warm_up(v for v in ["counting", "other"])
+    assert set(timings) == {"counting", "other"}
+    assert CountingProvider.instances == 2
+    assert "third" not in registry
+
+
+def test_provider_registry_variants(counting_variants) -> None:
+    assert core.ProviderRegistry().variants() == list(counting_variants)
+
+
+def test_provider_registry_invalidated_on_settings_change(settings) -> None:
+    provider = core.provider_factory("default")
+    settings.PAYMENT_VARIANTS = {"default": ("payments.dummy.DummyProvider", {})}
+    assert core.provider_factory("default") is not provider
+
+
+def test_create_http_session_uses_settings(settings) -> None:
+    settings.PAYMENT_HTTP_OPTIONS = {"pool_maxsize": 32, "timeout": 3}
+    session = core.create_http_session({"keep_alive": False})
+
+    adapter = session.get_adapter("https://api.example.com")
+    assert isinstance(adapter, core._TimeoutHTTPAdapter)
+    assert adapter._pool_maxsize == 32  # type: ignore[attr-defined]
+    assert adapter.timeout == 3
+    assert adapter.max_retries.connect == core.DEFAULT_HTTP_OPTIONS["max_retries"]
+    assert adapter.max_retries.read == 0
+    assert session.headers["Connection"] == "close"
+
+
+def test_http_session_applies_default_timeout() -> None:
+    session = core.create_http_session({"timeout": (1, 2)})
+    adapter = session.get_adapter("https://api.example.com")
+    with patch("requests.adapters.HTTPAdapter.send") as send:
+        send.return_value = requests.Response()
+        session.get("https://api.example.com")
+        assert send.call_args.kwargs["timeout"] == (1, 2)
+        session.get("https://api.example.com", timeout=10)
+        assert send.call_args.kwargs["timeout"] == 10
+    assert isinstance(adapter, core._TimeoutHTTPAdapter)
+
+
+def test_http_session_keeps_no_cookies() -> None:
+    session = core.create_http_session()
+    headers = HTTPMessage()
+    headers["Set-Cookie"] = "sessionid=secret; Path=/"
+
+    def send(request, **kwargs):
+        raw = HTTPResponse(
+            body=BytesIO(b""),
+            headers=dict(headers),
+            status=200,
+            preload_content=False,
+            original_response=SimpleNamespace(msg=headers, isclosed=lambda: True),
+        )
+        return HTTPAdapter().build_response(request, raw)
+
+    with patch.object(core._TimeoutHTTPAdapter, "send", side_effect=send):
+        first = session.get("https://api.example.com", cookies={"explicit": "1"})
+        second = session.get("https://api.example.com")
+    assert first.request.headers["Cookie"] == "explicit=1"
+    assert "Cookie" not in second.request.headers
+    assert not session.cookies
+
+
+def test_provider_reuses_http_session() -> None:
+    provider = core.BasicProvider()
+    assert provider.http_session is provider.http_session
+    assert core.BasicProvider().http_session is not provider.http_session
+
+
+@pytest.mark.django_db
+def test_save_writes_changed_fields_only() -> None:
+    payment = Payment.objects.create(variant="default", currency="USD")
+    payment = Payment.objects.get(pk=payment.pk)
+    assert payment.get_dirty_fields() == set()
+
+    payment.description = "changed"
+    payment.attrs.attr1 = "test1"
+    assert payment.get_dirty_fields() == {"description", "extra_data"}
+    with CaptureQueriesContext(connection) as queries:
+        payment.save()
+    (update,) = queries.captured_queries
+    assert '"description"' in update["sql"]
+    assert '"extra_data"' in update["sql"]
+    assert '"status"' not in update["sql"]
+    assert payment.get_dirty_fields() == set()
+    payment.refresh_from_db()
+    assert payment.description == "changed"
+    assert payment.attrs.attr1 == "test1"
+
+
+@pytest.mark.django_db
+def test_batch_saves_writes_once() -> None:
+    received = []
+    payment = Payment.objects.create(variant="default", currency="USD")
+
+    def handler(sender, instance, **kwargs):
+        received.append(Payment.objects.get(pk=instance.pk).status)
+
+    status_changed.connect(handler, sender=Payment)
+    try:
+        with CaptureQueriesContext(connection) as queries, payment.batch_saves():
+            payment.attrs.attr1 = "test1"
+            payment.save()
+            payment.change_status(PaymentStatus.CONFIRMED, "message")
+            payment.captured_amount = Decimal(10)
+            assert not queries.captured_queries
+            assert received == []
+        (update,) = [q["sql"] for q in queries.captured_queries if "UPDATE" in q["sql"]]
+        for column in ("extra_data", "status", "message", "captured_amount"):
+            assert f'"{column}"' in update
+        assert '"description"' not in update
+        assert received == [PaymentStatus.CONFIRMED]
+
+        with payment.batch_saves():
+            payment.change_status(PaymentStatus.REFUNDED)
+            assert received == [PaymentStatus.CONFIRMED]
+        assert received == [PaymentStatus.CONFIRMED, PaymentStatus.REFUNDED]
+    finally:
+        status_changed.disconnect(handler, sender=Payment)
+
+
+def change_status_and_raise(payment, error: Exception) -> None:
+    with payment.batch_saves():
+        payment.transaction_id = "partial"
+        payment.change_status(PaymentStatus.ERROR, str(error))
+        raise error
+
+
+def save_and_raise(payment, error: Exception) -> None:
+    with payment.batch_saves():
+        payment.transaction_id = "partial"
+        payment.save()
+        raise error
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "error", [PaymentError("declined"), RedirectNeeded("https://example.com")]
+)
+def test_batch_saves_flushes_on_provider_outcomes(error) -> None:
+    payment = Payment.objects.create(variant="default", currency="USD")
+    with pytest.raises(type(error)):
+        change_status_and_raise(payment, error)
+    stored = Payment.objects.get(pk=payment.pk)
+    assert stored.status == PaymentStatus.ERROR
+    assert stored.transaction_id == "partial"
+
+
+@pytest.mark.django_db
+def test_batch_saves_discards_saves_on_other_errors() -> None:
+    payment = Payment.objects.create(variant="default", currency="USD")
+    with pytest.raises(ConnectionError):
+        save_and_raise(payment, ConnectionError())
+    assert "_save_batch" not in payment.__dict__
+    stored = Payment.objects.get(pk=payment.pk)
+    assert stored.transaction_id == ""
+
+
+@pytest.mark.django_db
+def test_batch_saves_flushes_status_changes_on_other_errors() -> None:
+    received = []
+    payment = Payment.objects.create(variant="default", currency="USD")
+
+    def handler(sender, instance, **kwargs):
+        received.append(instance.status)
+
+    status_changed.connect(handler, sender=Payment)
+    try:
+        with pytest.raises(ConnectionError):
+            change_status_and_raise(payment, ConnectionError())
+    finally:
+        status_changed.disconnect(handler, sender=Payment)
+    assert received == [PaymentStatus.ERROR]
+    assert "_save_batch" not in payment.__dict__
+    stored = Payment.objects.get(pk=payment.pk)
+    assert stored.status == PaymentStatus.ERROR
+    assert stored.transaction_id == "partial"
+
+
+@pytest.mark.django_db
+def test_save_writes_fields_changed_by_pre_save_receivers() -> None:
+    payment = Payment.objects.create(variant="default", currency="USD")
+    payment = Payment.objects.get(pk=payment.pk)
+
+    def handler(sender, instance, **kwargs):
+        instance.message = "set by receiver"
+
+    pre_save.connect(handler, sender=Payment)
+    try:
+        payment.description = "changed"
+        payment.save()
+    finally:
+        pre_save.disconnect(handler, sender=Payment)
+    stored = Payment.objects.get(pk=payment.pk)
+    assert stored.description == "changed"
+    assert stored.message == "set by receiver"
+    assert payment.get_dirty_fields() == set()
+
+
+@pytest.mark.django_db
+def test_save_assigns_token_with_single_insert() -> None:
+    payment = Payment(variant="default", currency="USD")
+    with CaptureQueriesContext(connection) as queries:
+        payment.save()
+    assert len(queries.captured_queries) == 1
+    assert queries.captured_queries[0]["sql"].startswith("INSERT")
+    assert len(payment.token) == 36
+
+
+@pytest.mark.django_db(transaction=True)
+def test_save_retries_token_collision() -> None:
+    existing = Payment.objects.create(variant="default", currency="USD")
+    tokens = iter([existing.token, "00000000-0000-4000-8000-000000000000"])
+    with patch("payments.models.uuid4", side_effect=lambda: next(tokens)):
+        payment = Payment.objects.create(variant="default", currency="USD")
+    assert payment.token == "00000000-0000-4000-8000-000000000000"
+
+
+def test_assign_tokens() -> None:
+    payments = BasePayment.assign_tokens(
+        [Payment(token="existing"), Payment(extra_data="")]
+    )
+    assert payments[0].token == "existing"
+    assert len(payments[1].token) == 36
+
+
+@pytest.mark.django_db
+def test_bulk_create_assigns_tokens() -> None:
+    created = Payment.objects.bulk_create(
+        [Payment(variant="default", currency="USD") for _ in range(2)]
+    )
+    assert len({payment.token for payment in created}) == 2
+    assert all(payment.token for payment in created)
+
+
+@pytest.mark.django_db
+def test_bulk_create_payments() -> None:
+    received = []
+
+    def handler(sender, instances, **kwargs):
+        received.append(len(instances))
+
+    payments = [Payment(variant="default", currency="USD") for _ in range(3)]
+    payments[0].attrs.attr1 = "test1"
+    payments_created.connect(handler, sender=Payment)
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            created = Payment.objects.bulk_create_payments(payments)
+    finally:
+        payments_created.disconnect(handler, sender=Payment)
+    assert len(queries.captured_queries) == 1
+    assert received == [3]
+    assert len({payment.token for payment in created}) == 3
+    assert Payment.objects.get(token=created[0].token).attrs.attr1 == "test1"
+
+
+@pytest.mark.django_db
+def test_bulk_create_payments_sends_one_signal_per_call() -> None:
+    received = []
+
+    def handler(sender, instances, **kwargs):
+        received.append(len(instances))
+
+    payments = [Payment(variant="default", currency="USD") for _ in range(3)]
+    payments_created.connect(handler, sender=Payment)
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            Payment.objects.bulk_create_payments(payments, batch_size=2)
+    finally:
+        payments_created.disconnect(handler, sender=Payment)
+    assert len(queries.captured_queries) == 2
+    assert received == [3]
+
+
+@pytest.mark.django_db
+def test_bulk_create_payments_checks_variants() -> None:
+    payments = [Payment(variant="default"), Payment(variant="fake_provider")]
+    with pytest.raises(ValueError, match="Payment variant does not exist"):
+        Payment.objects.bulk_create_payments(payments)
+    assert not Payment.objects.exists()
+
+
+@pytest.mark.django_db
+def test_bulk_create_payments_uses_provider_factory() -> None:
+    def provider_factory(variant, payment=None):
+        if variant != "custom":
+            raise ValueError(f"Payment variant does not exist: {variant}")
+        return core.BasicProvider()
+
+    payments = [Payment(variant="custom"), Payment(variant="custom")]
+    with patch("payments.models.provider_factory", wraps=provider_factory) as factory:
+        Payment.objects.bulk_create_payments(payments)
+    factory.assert_called_once_with("custom", payments[0])
+    assert Payment.objects.count() == 2
+    with (
+        patch("payments.models.provider_factory", provider_factory),
+        pytest.raises(ValueError, match="Payment variant does not exist"),
+    ):
+        Payment.objects.bulk_create_payments([Payment(variant="default")])
+
+
+@pytest.mark.django_db
+def test_batch_saves_locks_payment_for_write() -> None:
+    payment = Payment.objects.create(variant="default")
+    with patch.object(Payment, "lock", autospec=True) as lock:
+        with payment.batch_saves():
+            payment.change_status(PaymentStatus.CONFIRMED)
+            lock.assert_not_called()
+        lock.assert_called_once_with(payment)
+
+
+@pytest.mark.django_db
+def test_batch_saves_rejects_status_changed_concurrently() -> None:
+    payment = Payment.objects.create(variant="default", total=Decimal(100))
+    Payment.objects.get(pk=payment.pk).change_status(PaymentStatus.CANCELLED)
+
+    def confirm():
+        with payment.batch_saves():
+            payment.captured_amount = payment.total
+            payment.change_status(PaymentStatus.CONFIRMED)
+
+    with pytest.raises(PaymentError) as excinfo:
+        confirm()
+
+    assert excinfo.value.code == 409
+    payment = Payment.objects.get(pk=payment.pk)
+    assert payment.status == PaymentStatus.CANCELLED
+    assert payment.captured_amount == 0
+
+
+@pytest.mark.django_db
+def test_batch_saves_merges_concurrent_changes() -> None:
+    payment = Payment.objects.create(
+        variant="default",
+        status=PaymentStatus.CONFIRMED,
+        captured_amount=Decimal(100),
+    )
+    other = Payment.objects.get(pk=payment.pk)
+    with other.batch_saves():
+        other.captured_amount -= 30
+        other.save()
+    with payment.batch_saves():
+        payment.captured_amount -= 20
+        payment.save()
+    assert payment.captured_amount == 50
+    payment.refresh_from_db()
+    assert payment.captured_amount == 50
+
+    other.change_status(PaymentStatus.REFUNDED)
+    with payment.batch_saves():
+        payment.transaction_id = "other"
+        payment.save()
+    assert payment.status == PaymentStatus.REFUNDED
+    payment.refresh_from_db()
+    assert payment.status == PaymentStatus.REFUNDED
+    assert payment.transaction_id == "other"
+
+
+@pytest.mark.django_db(transaction=True)
+@patch("payments.dummy.DummyProvider.process_data")
+def test_process_data_runs_outside_transaction(process_data, client) -> None:
+    payment = Payment.objects.create(variant="default")
+
+    def process(payment, request):
+        assert not connection.in_atomic_block
+        payment.change_status(PaymentStatus.CONFIRMED)
+        return HttpResponse("OK")
+
+    process_data.side_effect = process
+    with patch("payments.urls.get_payment_model", return_value=Payment):
+        response = client.post(f"/payments/process/{payment.token}/")
+    assert response.status_code == 200
+    payment.refresh_from_db()
+    assert payment.status == PaymentStatus.CONFIRMED
+
+
+def test_create_async_http_client_uses_settings(settings) -> None:
+    httpx = pytest.importorskip("httpx")
+    settings.PAYMENT_HTTP_OPTIONS = {"pool_maxsize": 32, "timeout": (1, 2)}
+    client = core.create_async_http_client({"keep_alive": False})
+
+    assert client.timeout == httpx.Timeout(2, connect=1)
+    assert client.headers["Connection"] == "close"
+    pool = client._transport._pool  # type: ignore[attr-defined]
+    assert pool._max_keepalive_connections == 0
+    async_to_sync(client.aclose)()
+
+
+def test_async_http_client_keeps_no_cookies() -> None:
+    httpx = pytest.importorskip("httpx")
+    client = core.create_async_http_client()
+    client._transport = httpx.MockTransport(
+        lambda request: httpx.Response(
+            200, headers={"Set-Cookie": "sessionid=secret; Path=/"}
+        )
+    )
+
+    async def get():
+        async with client:
+            await client.get("https://api.example.com")
+            return await client.get("https://api.example.com")
+
+    response = async_to_sync(get)()
+    assert not client.cookies
+    assert "Cookie" not in response.request.headers
+
+
+def test_provider_reuses_async_http_client_within_event_loop() -> None:
+    pytest.importorskip("httpx")
+    provider = core.BasicProvider()
+
+    async def get_clients():
+        return provider.get_async_http_client(), provider.get_async_http_client()
+
+    first, second = async_to_sync(get_clients)()
+    assert first is second
+    assert async_to_sync(get_clients)()[0] is not first
+
+
+def test_provider_aclose_closes_http_clients() -> None:
+    pytest.importorskip("httpx")
+    provider = core.BasicProvider()
+    session = provider.http_session
+
+    async def use_and_close():
+        client = provider.get_async_http_client()
+        await provider.aclose()
+        return client
+
+    client = async_to_sync(use_and_close)()
+    assert client.is_closed
+    assert provider.http_session is not session
+
+
+def test_discarded_provider_closes_http_clients() -> None:
+    pytest.importorskip("httpx")
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        provider = core.BasicProvider()
+
+        async def get_client(provider):
+            return provider.get_async_http_client()
+
+        client = asyncio.run_coroutine_threadsafe(get_client(provider), loop).result()
+        del provider
+        gc.collect()
+        # Let the loop run the scheduled aclose().
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.01), loop).result()
+        assert client.is_closed
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+@patch("payments.dummy.DummyProvider.capture", return_value=Decimal(10))
+def test_async_api_runs_sync_method(mocked_capture_method: MagicMock) -> None:
+    provider = core.provider_factory("default")
+    payment = Payment(variant="default")
+    assert async_to_sync(provider.acapture)(payment, Decimal(10)) == Decimal(10)
+    mocked_capture_method.assert_called_once_with(payment, Decimal(10))
+
+
+@pytest.mark.django_db(transaction=True)
+@patch("payments.dummy.DummyProvider.aprocess_data")
+def test_async_process_data_awaits_provider(aprocess_data) -> None:
+    payment = Payment.objects.create(variant="default")
+
+    async def process(payment, request):
+        await sync_to_async(payment.change_status)(PaymentStatus.CONFIRMED)
+        return HttpResponse("OK")
+
+    aprocess_data.side_effect = process
+    request = AsyncRequestFactory().post(f"/payments/process/{payment.token}/")
+    with patch("payments.urls.get_payment_model", return_value=Payment):
+        response = async_to_sync(urls.aprocess_data)(request, payment.token)
+    assert response.status_code == 200
+    payment.refresh_from_db()
+    assert payment.status == PaymentStatus.CONFIRMED
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+from io import StringIO
+
+import pytest
+from django.apps import apps
+from django.core.management import CommandError
+from django.core.management import call_command
+
+from payments.cards import BinDatabase
+from payments.cards import BinRange
+from payments.core import provider_registry
+
+
+@pytest.fixture
+def variants(settings):
+    settings.PAYMENT_VARIANTS = {
+        "default": ("payments.dummy.DummyProvider", {}),
+        "other": ("payments.dummy.DummyProvider", {}),
+    }
+    yield settings.PAYMENT_VARIANTS
+    provider_registry.invalidate()
+
+
+def test_warmup_builds_all_variants(variants) -> None:
+    out = StringIO()
+    call_command("payments_warmup", stdout=out)
+    output = out.getvalue()
+    assert "default: " in output
+    assert "other: " in output
+    assert "default" in provider_registry
+    assert "other" in provider_registry
+
+
+def test_warmup_builds_given_variants(variants) -> None:
+    call_command("payments_warmup", "other", stdout=StringIO())
+    assert "default" not in provider_registry
+    assert "other" in provider_registry
+
+
+@pytest.mark.parametrize(
+    ("handler", "error"),
+    [
+        (None, "ValueError"),
+        ("payments.dummy.MissingProvider", "ImportError"),
+        ("payments.dummy.DummyProvider", "TypeError"),
+    ],
+)
+def test_warmup_reports_failures(variants, handler, error) -> None:
+    if handler:
+        variants["missing"] = (handler, {"unknown_option": True})
+    err = StringIO()
+    with pytest.raises(CommandError, match="Could not build variants: missing"):
+        call_command(
+            "payments_warmup", "missing", "default", stdout=StringIO(), stderr=err
+        )
+    assert f"missing: {error}" in err.getvalue()
+    assert "default" in provider_registry
+
+
+@pytest.mark.parametrize(
+    ("preload", "expected"),
+    [(True, {"default", "other"}), (["other"], {"other"}), ((), set())],
+)
+def test_preload_variants_on_ready(settings, variants, preload, expected) -> None:
+    settings.PAYMENT_PRELOAD_VARIANTS = preload
+    apps.get_app_config("payments").ready()
+    assert {v for v in variants if v in provider_registry} == expected
+
+
+def test_build_bin_database(tmp_path) -> None:
+    source = tmp_path / "bins.csv"
+    source.write_text(
+        "start,end,country,funding,level,bank\n"
+        "411111,,US,credit,classic,Example Bank\n"
+        "555500,555599,GB,debit,,\n"
+    )
+    output = tmp_path / "bins.db"
+    out = StringIO()
+    call_command("payments_build_bin_database", str(source), str(output), stdout=out)
+    assert out.getvalue() == f"Wrote 2 ranges to {output}\n"
+    database = BinDatabase(output)
+    assert database.lookup("4111111111111111") == BinRange(
+        "US", "credit", "classic", "Example Bank"
+    )
+    assert database.lookup("5555991111111111") == BinRange("GB", "debit", None, None)
+    database.close()
+
+
+def test_build_bin_database_reports_invalid_ranges(tmp_path) -> None:
+    source = tmp_path / "bins.csv"
+    source.write_text("start,end\n4111,4110\n")
+    with pytest.raises(CommandError, match="Invalid BIN range: 4111-4110"):
+        call_command(
+            "payments_build_bin_database", str(source), str(tmp_path / "bins.db")
+        )
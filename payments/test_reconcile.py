@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from payments import PaymentStatus
+from payments.core import BasicProvider
+from payments.core import StatusUpdate
+from payments.core import provider_registry
+from payments.outbox.models import StatusChange
+from payments.signals import status_changed
+from payments.test_core import Payment
+
+from .reconcile import RateLimiter
+from .reconcile import reconcile_payments
+
+
+class PollingProvider(BasicProvider):
+    poll_batch_size = 2
+    batches: list[list[int]] = []
+    statuses: dict[str, StatusUpdate] = {}
+
+    def poll_statuses(self, payments):
+        type(self).batches.append(sorted(payment.pk for payment in payments))
+        return {
+            payment.pk: self.statuses[payment.description]
+            for payment in payments
+            if payment.description in self.statuses
+        }
+
+
+@pytest.fixture
+def polling_variants(settings):
+    PollingProvider.batches = []
+    PollingProvider.statuses = {
+        "paid": StatusUpdate(PaymentStatus.CONFIRMED, captured_amount=10),
+        "failed": StatusUpdate(PaymentStatus.REJECTED, "declined"),
+    }
+    settings.PAYMENT_VARIANTS = {
+        "default": ("payments.dummy.DummyProvider", {}),
+        "polling": ("payments.test_reconcile.PollingProvider", {}),
+    }
+    yield settings.PAYMENT_VARIANTS
+    provider_registry.invalidate()
+
+
+@pytest.fixture
+def received():
+    received = []
+
+    def handler(sender, instance, **kwargs):
+        received.append((instance.description, instance.status))
+
+    status_changed.connect(handler, sender=Payment)
+    yield received
+    status_changed.disconnect(handler, sender=Payment)
+
+
+@pytest.mark.django_db
+def test_reconcile_payments_updates_in_bulk(
+    polling_variants, received, django_capture_on_commit_callbacks
+) -> None:
+    paid = Payment.objects.create(variant="polling", description="paid")
+    failed = Payment.objects.create(variant="polling", description="failed")
+    pending = Payment.objects.create(variant="polling", description="pending")
+    dummy = Payment.objects.create(variant="default", description="paid")
+    Payment.objects.create(
+        variant="polling", description="paid", status=PaymentStatus.CONFIRMED
+    )
+
+    with (
+        django_capture_on_commit_callbacks(execute=True),
+        CaptureQueriesContext(connection) as queries,
+    ):
+        updated = reconcile_payments(
+            Payment.objects.all(), rate_limits={"polling": None}
+        )
+
+    assert updated == {"polling": 2}
+    assert PollingProvider.batches == [[paid.pk, failed.pk], [pending.pk]]
+    updates = [q for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+    assert len(updates) == 1
+    assert sorted(received) == [
+        ("failed", PaymentStatus.REJECTED),
+        ("paid", PaymentStatus.CONFIRMED),
+    ]
+    paid.refresh_from_db()
+    assert paid.status == PaymentStatus.CONFIRMED
+    assert paid.captured_amount == 10
+    failed.refresh_from_db()
+    assert (failed.status, failed.message) == (PaymentStatus.REJECTED, "declined")
+    pending.refresh_from_db()
+    assert pending.status == PaymentStatus.WAITING
+    dummy.refresh_from_db()
+    assert dummy.status == PaymentStatus.WAITING
+
+
+@pytest.mark.django_db
+def test_reconcile_payments_records_outbox(
+    settings, polling_variants, received
+) -> None:
+    settings.PAYMENT_STATUS_OUTBOX = True
+    paid = Payment.objects.create(variant="polling", description="paid")
+
+    assert reconcile_payments(Payment.objects.all(), variants=["polling"]) == {
+        "polling": 1
+    }
+    assert received == []
+    (change,) = StatusChange.objects.all()
+    assert change.payment_pk == str(paid.pk)
+    assert change.status == PaymentStatus.CONFIRMED
+
+
+@pytest.mark.django_db
+def test_reconcile_payments_skips_failed_batches(polling_variants) -> None:
+    Payment.objects.create(variant="polling", description="paid")
+    with patch.object(PollingProvider, "poll_statuses", side_effect=OSError):
+        assert reconcile_payments(Payment.objects.all()) == {}
+
+
+def test_rate_limiter_spaces_calls() -> None:
+    limiter = RateLimiter(4)
+    with (
+        patch("time.monotonic", return_value=100.0),
+        patch("time.sleep") as sleep,
+    ):
+        limiter.wait()
+        limiter.wait()
+        limiter.wait()
+    assert [call.args[0] for call in sleep.call_args_list] == [0.25, 0.5]
+
+
+@pytest.mark.django_db
+def test_reconcile_command(settings, polling_variants) -> None:
+    settings.PAYMENT_MODEL = "payments.Payment"
+    Payment.objects.create(variant="polling", description="paid")
+    out = StringIO()
+    call_command("payments_reconcile", "polling", stdout=out)
+    assert out.getvalue() == "polling: updated 1 payments\n"
@@ -2,12 +2,21 @@
 
 from __future__ import annotations
 
+import asyncio
+import json
 from unittest.mock import Mock
 from unittest.mock import patch
 
+import pytest
+from django.core.cache import cache
+from django.http import Http404
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory
 from django.test import TestCase
+from django.test import override_settings
 
 from payments import PaymentError
+from payments.urls import astatic_callback
 
 
 class StaticCallbackTestCase(TestCase):
@@ -82,3 +91,114 @@ class StaticCallbackTestCase(TestCase):
         assert data["variant"] == "dummy"
         # Token should not be exposed in error response for security
         assert "token" not in data
+
+
+@override_settings(PAYMENT_WEBHOOK_DEDUP_TTL=60)
+class WebhookDeduplicationTestCase(TestCase):
+    """Test that redelivered webhooks are only processed once."""
+
+    def setUp(self):
+        cache.clear()
+        self.provider = Mock()
+        self.provider.get_token_from_request.return_value = "token"
+        self.provider.get_webhook_event_id.return_value = "evt_1"
+        patch("payments.urls.provider_factory", return_value=self.provider).start()
+        self.process = patch("payments.urls.process_data").start()
+        self.addCleanup(patch.stopall)
+
+    def post(self, body="{}"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                "/payments/process/dummy/", body, content_type="application/json"
+            )
+
+    def test_redelivery_replays_response(self):
+        self.process.return_value = HttpResponse("Thanks", status=201)
+        first = self.post()
+        second = self.post()
+
+        assert self.process.call_count == 1
+        assert second.status_code == first.status_code == 201
+        assert second.content == b"Thanks"
+
+    def test_failed_delivery_is_processed_again(self):
+        self.process.side_effect = [
+            HttpResponse("Try again", status=500),
+            HttpResponse("Thanks"),
+        ]
+        assert self.post().status_code == 500
+        assert self.post().status_code == 200
+        assert self.process.call_count == 2
+
+    def test_events_without_id_use_body_hash(self):
+        self.provider.get_webhook_event_id.return_value = None
+        self.process.return_value = HttpResponse("Thanks")
+        self.post('{"a": 1}')
+        self.post('{"a": 1}')
+        self.post('{"a": 2}')
+        assert self.process.call_count == 2
+
+    def test_provider_can_opt_out(self):
+        self.provider.get_webhook_event_id.return_value = ""
+        self.process.return_value = HttpResponse("Thanks")
+        self.post()
+        self.post()
+        assert self.process.call_count == 2
+
+    @override_settings(PAYMENT_WEBHOOK_DEDUP_TTL=None)
+    def test_disabled_by_default(self):
+        self.process.return_value = HttpResponse("Thanks")
+        self.post()
+        self.post()
+        assert self.process.call_count == 2
+
+
+@override_settings(PAYMENT_WEBHOOK_DEDUP_TTL=60)
+class AsyncStaticCallbackTestCase(TestCase):
+    """Test the asynchronous static_callback view."""
+
+    def setUp(self):
+        cache.clear()
+        self.provider = Mock()
+        self.provider.get_token_from_request.return_value = "token"
+        self.provider.get_webhook_event_id.return_value = "evt_1"
+        patch("payments.urls.provider_factory", return_value=self.provider).start()
+        self.process = patch("payments.urls._aprocess_data").start()
+        self.addCleanup(patch.stopall)
+
+    async def post(self):
+        request = AsyncRequestFactory().post(
+            "/payments/process/dummy/", "{}", content_type="application/json"
+        )
+        return await astatic_callback(request, "dummy")
+
+    async def test_redelivery_replays_response(self):
+        self.process.return_value = HttpResponse("Thanks", status=201)
+        first = await self.post()
+        second = await self.post()
+
+        assert self.process.await_count == 1
+        assert second.status_code == first.status_code == 201
+        assert second.content == b"Thanks"
+
+    async def test_event_id_is_read_outside_event_loop(self):
+        def get_webhook_event_id(request):
+            with pytest.raises(RuntimeError):
+                asyncio.get_running_loop()
+            return "evt_1"
+
+        self.provider.get_webhook_event_id.side_effect = get_webhook_event_id
+        self.process.return_value = HttpResponse("Thanks")
+
+        response = await self.post()
+
+        assert response.status_code == 200
+        self.provider.get_webhook_event_id.assert_called_once()
+
+    async def test_payment_not_found_returns_json_404(self):
+        self.process.side_effect = Http404("Payment not found")
+
+        response = await self.post()
+
+        assert response.status_code == 404
+        assert json.loads(response.content)["error"] == "Payment not found"
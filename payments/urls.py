@@ -6,8 +6,10 @@ data (asynchronous transaction updates).
 from __future__ import annotations
 
 from typing import TYPE_CHECKING
+from typing import Any
 
-from django.db.transaction import atomic
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.http import Http404
 from django.http import HttpRequest
 from django.http import HttpResponse
@@ -20,13 +22,18 @@ from django.views.decorators.csrf import csrf_exempt
 from . import PaymentError
 from . import get_payment_model
 from .core import provider_factory
+from .inbox import inbox_enabled
+from .webhooks import adeduplicate
+from .webhooks import deduplicate
 
 if TYPE_CHECKING:
+    from collections.abc import Callable
+
     from .core import BasicProvider
+    from .models import BasePayment
 
 
 @csrf_exempt
-@atomic
 def process_data(
     request: HttpRequest,
     token: str,
@@ -35,10 +42,86 @@ def process_data(
     """
     Calls process_data of an appropriate provider.
 
+    No transaction is held while the provider talks to its gateway; changes to
+    the payment are written in one short transaction at the end (see
+    :meth:`~payments.models.BasePayment.batch_saves`).
+
     Raises Http404 if variant does not exist.
     Note: When called via static_callback, Http404 exceptions are caught
     and converted to JSON error responses for webhook systems.
     """
+    if provider is None:
+        # Called for a per-payment URL; static_callback deduplicates by itself.
+        return deduplicate(
+            request,
+            f"token:{token}",
+            lambda: _get_provider_for_token(token),
+            lambda: _process_data(request, token, None),
+        )
+    return _process_data(request, token, provider)
+
+
+@csrf_exempt
+async def aprocess_data(
+    request: HttpRequest,
+    token: str,
+    provider: BasicProvider | None = None,
+) -> HttpResponse:
+    """
+    Asynchronous version of :func:`process_data`.
+
+    Awaits the provider's
+    :meth:`~payments.core.BasicProvider.aprocess_data`, so that providers with
+    native asynchronous implementations don't hold a thread while waiting for
+    their gateway. Used when ``PAYMENT_ASYNC_VIEWS`` is enabled.
+    """
+    if provider is None:
+        return await adeduplicate(
+            request,
+            f"token:{token}",
+            lambda: sync_to_async(_get_provider_for_token)(token),
+            lambda: _aprocess_data(request, token, None),
+        )
+    return await _aprocess_data(request, token, provider)
+
+
+def _get_provider_for_token(token: str) -> BasicProvider | None:
+    Payment = get_payment_model()
+    variant = (
+        Payment._default_manager.filter(token=token)
+        .values_list("variant", flat=True)
+        .first()
+    )
+    try:
+        return provider_factory(variant) if variant else None
+    except ValueError:
+        return None
+
+
+def _process_data(
+    request: HttpRequest,
+    token: str,
+    provider: BasicProvider | None,
+) -> HttpResponse:
+    payment, provider = _get_payment_and_provider(token, provider)
+    with payment.batch_saves():
+        return provider.process_data(payment, request)
+
+
+async def _aprocess_data(
+    request: HttpRequest,
+    token: str,
+    provider: BasicProvider | None,
+) -> HttpResponse:
+    payment, provider = await sync_to_async(_get_payment_and_provider)(token, provider)
+    async with payment.abatch_saves():
+        return await provider.aprocess_data(payment, request)
+
+
+def _get_payment_and_provider(
+    token: str,
+    provider: BasicProvider | None,
+) -> tuple[BasePayment, BasicProvider]:
     Payment = get_payment_model()
     payment = get_object_or_404(Payment, token=token)
     if not provider:
@@ -46,11 +129,10 @@ def process_data(
             provider = provider_factory(payment.variant, payment)
         except ValueError as e:
             raise Http404("No such payment") from e
-    return provider.process_data(payment, request)
+    return payment, provider
 
 
 @csrf_exempt
-@atomic
 def static_callback(request: HttpRequest, variant: str) -> HttpResponse:
     """
     Handle webhooks sent to a static provider endpoint.
@@ -64,10 +146,87 @@ def static_callback(request: HttpRequest, variant: str) -> HttpResponse:
     try:
         provider = provider_factory(variant)
     except ValueError:
-        return JsonResponse(
-            {"error": "Invalid payment provider", "variant": variant}, status=400
-        )
+        return _invalid_variant(variant)
 
+    return deduplicate(
+        request,
+        f"variant:{variant}",
+        lambda: provider,
+        lambda: _static_callback(request, variant, provider),
+    )
+
+
+@csrf_exempt
+async def astatic_callback(request: HttpRequest, variant: str) -> HttpResponse:
+    """
+    Asynchronous version of :func:`static_callback`.
+
+    Used when ``PAYMENT_ASYNC_VIEWS`` is enabled.
+    """
+    try:
+        provider = await sync_to_async(provider_factory)(variant)
+    except ValueError:
+        return _invalid_variant(variant)
+
+    async def get_provider() -> BasicProvider:
+        return provider
+
+    return await adeduplicate(
+        request,
+        f"variant:{variant}",
+        get_provider,
+        lambda: _astatic_callback(request, variant, provider),
+    )
+
+
+def _static_callback(
+    request: HttpRequest,
+    variant: str,
+    provider: BasicProvider,
+) -> HttpResponse:
+    token = _get_token_from_request(request, variant, provider)
+    if isinstance(token, HttpResponse):
+        return token
+
+    if inbox_enabled():
+        from .inbox.models import WebhookEvent
+
+        WebhookEvent.store(request, variant, token)
+        return HttpResponse("Accepted", status=202)
+
+    try:
+        return process_data(request, token, provider)
+    except Http404:
+        return _payment_not_found(variant)
+
+
+async def _astatic_callback(
+    request: HttpRequest,
+    variant: str,
+    provider: BasicProvider,
+) -> HttpResponse:
+    token = await sync_to_async(_get_token_from_request)(request, variant, provider)
+    if isinstance(token, HttpResponse):
+        return token
+
+    if inbox_enabled():
+        from .inbox.models import WebhookEvent
+
+        await sync_to_async(WebhookEvent.store)(request, variant, token)
+        return HttpResponse("Accepted", status=202)
+
+    try:
+        return await _aprocess_data(request, token, provider)
+    except Http404:
+        return _payment_not_found(variant)
+
+
+def _get_token_from_request(
+    request: HttpRequest,
+    variant: str,
+    provider: BasicProvider,
+) -> str | HttpResponse:
+    """Return the payment token of a webhook, or an error response."""
     try:
         token = provider.get_token_from_request(request=request, payment=None)
     except PaymentError as e:
@@ -84,29 +243,44 @@ def static_callback(request: HttpRequest, variant: str) -> HttpResponse:
             },
             status=400,
         )
+    return token
+
+
+def _invalid_variant(variant: str) -> JsonResponse:
+    return JsonResponse(
+        {"error": "Invalid payment provider", "variant": variant}, status=400
+    )
+
+
+def _payment_not_found(variant: str) -> JsonResponse:
+    # Don't expose full token in error response for security
+    return JsonResponse(
+        {"error": "Payment not found", "variant": variant},
+        status=404,
+    )
 
-    try:
-        return process_data(request, token, provider)
-    except Http404:
-        # Don't expose full token in error response for security
-        return JsonResponse(
-            {"error": "Payment not found", "variant": variant},
-            status=404,
-        )
 
+_process_data_view: Callable[..., Any]
+_static_callback_view: Callable[..., Any]
+if getattr(settings, "PAYMENT_ASYNC_VIEWS", False):
+    _process_data_view = aprocess_data
+    _static_callback_view = astatic_callback
+else:
+    _process_data_view = process_data
+    _static_callback_view = static_callback
 
 urlpatterns = [
     # A per-payment callback endpoint.
     # Providers that use a unique URL for each payment will deliver webhook
     # notifications to this view.
-    path("process/<uuid:token>/", process_data, name="process_payment"),
+    path("process/<uuid:token>/", _process_data_view, name="process_payment"),
     # A static per-provider callback endpoint.
     # Providers that use single URL for all payments will deliver webhook notifications
     # to this view. Some providers (e.g.: Stripe) need to be manually configured to
     # deliver notifications to this route.
     re_path(
         r"^process/(?P<variant>[a-z-]+)/$",
-        static_callback,
+        _static_callback_view,
         name="static_process_payment",
     ),
 ]
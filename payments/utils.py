@@ -15,3 +15,30 @@ def get_year_choices():
         (str(x), str(x)) for x in range(date.today().year, date.today().year + 15)
     ]
     return [("", _("Year")), *year_choices]
+
+
+def get_request_cache(request) -> dict:
+    """Return a dict for values derived from ``request``, e.g.: a verified webhook.
+
+    The dict lives as long as the request, so providers can avoid parsing or
+    verifying the same request body in several steps of processing it.
+    """
+    return request.__dict__.setdefault("_payments_cache", {})
+
+
+def mark_webhook_verified(request) -> None:
+    """Record that the signature of the webhook in ``request`` was verified.
+
+    Providers call this once they have checked a webhook's signature, including
+    any limit on its age. See :func:`is_webhook_verified`.
+    """
+    get_request_cache(request)["webhook_verified"] = True
+
+
+def is_webhook_verified(request) -> bool:
+    """Return whether the webhook in ``request`` was verified on receipt.
+
+    This is also true for webhooks stored by the deferred webhook mode and
+    rebuilt later, so that providers don't reject them for their age.
+    """
+    return get_request_cache(request).get("webhook_verified", False)
@@ -0,0 +1,152 @@
+"""
+Deduplication of webhook deliveries.
+
+Gateways redeliver webhooks they consider unacknowledged, and often deliver the
+same event more than once anyway. When ``PAYMENT_WEBHOOK_DEDUP_TTL`` is set,
+the response to each successfully processed delivery is remembered in a Django
+cache for that many seconds, and replayed for redeliveries of the same event
+without processing them again.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from typing import TYPE_CHECKING
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable
+    from collections.abc import Callable
+
+    from django.http import HttpRequest
+
+    from .core import BasicProvider
+
+#: Stored while a delivery is being processed.
+IN_PROGRESS = "in-progress"
+
+#: Seconds after which a delivery that is still being processed is forgotten,
+#: e.g.: because the process handling it died.
+PROCESSING_TIMEOUT = 300
+
+
+def deduplicate(
+    request: HttpRequest,
+    scope: str,
+    get_provider: Callable[[], BasicProvider | None],
+    handle: Callable[[], HttpResponse],
+) -> HttpResponse:
+    """Call ``handle`` unless the delivered event was already processed.
+
+    Events are identified by
+    :meth:`~payments.core.BasicProvider.get_webhook_event_id`, or by a hash of
+    the request body.
+
+    :param scope: Namespace for event IDs, e.g.: the variant or payment token.
+    :param get_provider: Returns the provider the webhook is meant for, if known.
+    :returns: the response of ``handle``, or the response stored for an
+        identical earlier delivery.
+    """
+    ttl = _get_ttl(request)
+    if not ttl:
+        return handle()
+    key = _get_event_key(request, scope, get_provider())
+    if key is None:
+        return handle()
+    cache = _get_cache()
+
+    if not cache.add(key, IN_PROGRESS, timeout=min(ttl, PROCESSING_TIMEOUT)):
+        return _replay(cache.get(key))
+
+    try:
+        response = handle()
+    except BaseException:
+        cache.delete(key)
+        raise
+    stored = _get_stored_response(response)
+    if stored is not None:
+        # Only remember the event once its effects are committed.
+        transaction.on_commit(lambda: cache.set(key, stored, timeout=ttl))
+    else:
+        cache.delete(key)
+    return response
+
+
+async def adeduplicate(
+    request: HttpRequest,
+    scope: str,
+    get_provider: Callable[[], Awaitable[BasicProvider | None]],
+    handle: Callable[[], Awaitable[HttpResponse]],
+) -> HttpResponse:
+    """Asynchronous version of :func:`deduplicate`.
+
+    ``get_provider`` and ``handle`` are coroutine functions. The response is
+    stored as soon as ``handle`` returns, since asynchronous views don't run
+    in a transaction.
+    """
+    ttl = _get_ttl(request)
+    if not ttl:
+        return await handle()
+    # Providers may verify the webhook's signature to read its event ID.
+    key = await sync_to_async(_get_event_key)(request, scope, await get_provider())
+    if key is None:
+        return await handle()
+    cache = _get_cache()
+
+    if not await cache.aadd(key, IN_PROGRESS, timeout=min(ttl, PROCESSING_TIMEOUT)):
+        return _replay(await cache.aget(key))
+
+    try:
+        response = await handle()
+    except BaseException:
+        await cache.adelete(key)
+        raise
+    stored = _get_stored_response(response)
+    if stored is not None:
+        await cache.aset(key, stored, timeout=ttl)
+    else:
+        await cache.adelete(key)
+    return response
+
+
+def _get_ttl(request: HttpRequest) -> int | None:
+    if request.method != "POST":
+        return None
+    return getattr(settings, "PAYMENT_WEBHOOK_DEDUP_TTL", None)
+
+
+def _get_cache():
+    return caches[getattr(settings, "PAYMENT_WEBHOOK_DEDUP_CACHE", "default")]
+
+
+def _get_event_key(
+    request: HttpRequest,
+    scope: str,
+    provider: BasicProvider | None,
+) -> str | None:
+    event_id = provider.get_webhook_event_id(request) if provider else None
+    if event_id == "":
+        return None
+    if event_id is None:
+        event_id = "sha256:" + hashlib.sha256(request.body).hexdigest()
+    digest = hashlib.sha256(f"{scope}:{event_id}".encode()).hexdigest()
+    return f"payments:webhook:{digest}"
+
+
+def _replay(stored) -> HttpResponse:
+    if stored is None or stored == IN_PROGRESS:
+        # Another worker is processing this event; have the gateway retry.
+        return HttpResponse("Event is being processed", status=409)
+    status, content, content_type = stored
+    return HttpResponse(content, status=status, content_type=content_type)
+
+
+def _get_stored_response(response: HttpResponse) -> tuple | None:
+    if 200 <= response.status_code < 300 and not response.streaming:
+        return (response.status_code, response.content, response["Content-Type"])
+    return None
@@ -16,7 +16,12 @@ TEMPLATES = [
 SECRET_KEY = "NOTREALLY"
 PAYMENT_HOST = "example.com"
 
-INSTALLED_APPS = ["payments", "django.contrib.sites"]
+INSTALLED_APPS = [
+    "payments",
+    "payments.inbox",
+    "payments.outbox",
+    "django.contrib.sites",
+]
 
 ROOT_URLCONF = "test_settings"
 
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-16 12:00
+from __future__ import annotations
+
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("testmain", "0003_alter_payment_status"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="token",
+            field=models.CharField(blank=True, default="", max_length=36, unique=True),
+        ),
+    ]